@@ -0,0 +1,191 @@
+"""Report pipeline benchmark on synthetic WB categories.
+
+    python -m benchmarks.report_pipeline -s 1k -s 10k -o results.json --compare previous.json
+"""
+import inspect
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import click
+import jinja2
+import numpy
+import pandas
+from seller_stats.category_stats import CategoryStats
+
+from src.reports import render_report_html, render_report_page_groups, render_report_pdf, render_report_pdf_parallel
+from src.viewmodels.report import Report
+
+from .synthetic import generate_category_items
+
+sizes = {
+    '1k': 1000,
+    '10k': 10000,
+    '100k': 100000,
+    '500k': 500000,
+}
+
+
+def report_properties() -> list:
+    return [name for name, member in inspect.getmembers(Report) if isinstance(member, property)]
+
+
+def measure(func, trace_memory=False):
+    """Returns result, seconds spent and peak of the allocated memory in bytes."""
+    if trace_memory:
+        tracemalloc.start()
+
+    start_time = time.perf_counter()
+
+    try:
+        result = func()
+    finally:
+        seconds = time.perf_counter() - start_time
+        peak = None
+
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    return result, seconds, peak
+
+
+def run_size(size: int, seed: int, with_pdf: bool, trace_memory: bool, render_workers: int = 1) -> dict:
+    data = generate_category_items(size, seed=seed)
+    timings = {}
+    peaks = {}
+    errors = {}
+
+    def record(stage, func):
+        try:
+            result, timings[stage], peak = measure(func, trace_memory=trace_memory)
+        except Exception as error:
+            # Падение одной стадии не должно обнулять замеры остальных
+            errors[stage] = f'{error.__class__.__name__}: {str(error)}'
+            return None
+
+        if peak is not None:
+            peaks[stage] = peak
+
+        return result
+
+    stats = record('category_stats', lambda: CategoryStats(data=data))
+
+    for name in report_properties():
+        # Новый Report на каждое свойство, чтобы не попадать в закешированные в stats результаты соседей
+        record(f'report.{name}', lambda name=name: getattr(Report(stats=stats, username='benchmark'), name))
+
+    report_dict = record('report.to_dict', lambda: Report(stats=stats, username='benchmark').to_dict())
+    html = record('render.html', lambda: render_report_html(report_dict)) if report_dict is not None else None
+
+    if with_pdf and html is not None:
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as temp_file:
+            record('render.pdf', lambda: render_report_pdf(html, target=temp_file.name))
+
+            if render_workers > 1:
+                htmls = render_report_page_groups(report_dict, groups=render_workers)
+                record('render.pdf_parallel', lambda: render_report_pdf_parallel(htmls, target=temp_file.name, workers=render_workers))
+
+    return {
+        'items': size,
+        'timings': timings,
+        'peak_memory': peaks,
+        'errors': errors,
+    }
+
+
+def get_git_sha():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_metadata(seed: int) -> dict:
+    versions = {
+        'python': platform.python_version(),
+        'pandas': pandas.__version__,
+        'numpy': numpy.__version__,
+        'jinja2': jinja2.__version__,
+    }
+
+    try:
+        import weasyprint
+        versions['weasyprint'] = weasyprint.__version__
+    except (ImportError, OSError):
+        versions['weasyprint'] = None
+
+    return {
+        'created_at': datetime.now().isoformat(),
+        'git_sha': get_git_sha(),
+        'platform': platform.platform(),
+        'seed': seed,
+        'versions': versions,
+    }
+
+
+def compare_results(previous: dict, current: dict, threshold: float) -> list:
+    """Stages which became slower than the previous run by more than threshold, as a share."""
+    regressions = []
+
+    for size, result in current['results'].items():
+        previous_timings = previous.get('results', {}).get(size, {}).get('timings', {})
+
+        for stage, seconds in result['timings'].items():
+            before = previous_timings.get(stage)
+
+            if before and seconds > before * (1 + threshold):
+                regressions.append((size, stage, before, seconds))
+
+    return regressions
+
+
+@click.command()
+@click.option('--size', '-s', 'size_names', multiple=True, type=click.Choice(list(sizes.keys())), default=['1k', '10k'],
+              help='category sizes to benchmark')
+@click.option('--seed', default=42, help='seed of the synthetic dataset')
+@click.option('--output', '-o', type=click.Path(), help='file to save results as JSON')
+@click.option('--compare', type=click.Path(exists=True), help='previous results file to compare with')
+@click.option('--threshold', default=0.2, help='slowdown share reported as a regression')
+@click.option('--pdf/--no-pdf', default=True, help='benchmark WeasyPrint output')
+@click.option('--render-workers', default=1, help='also benchmark parallel PDF rendering with this many processes')
+@click.option('--memory/--no-memory', default=True, help='trace peak memory of every stage, slows the run down')
+def main(size_names, seed, output, compare, threshold, pdf, render_workers, memory):
+    results = {
+        'metadata': get_metadata(seed),
+        'results': {},
+    }
+
+    for size_name in size_names:
+        click.echo(f'Benchmarking {size_name} items')
+        results['results'][size_name] = run_size(
+            sizes[size_name], seed=seed, with_pdf=pdf, trace_memory=memory, render_workers=render_workers,
+        )
+
+        for stage, seconds in results['results'][size_name]['timings'].items():
+            click.echo(f'  {stage:<50} {seconds:10.4f}s')
+
+        for stage, error in results['results'][size_name]['errors'].items():
+            click.echo(f'  {stage:<50} failed: {error}')
+
+    if output:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2, ensure_ascii=False)
+
+    if compare:
+        with open(compare) as file:
+            regressions = compare_results(json.load(file), results, threshold)
+
+        for size, stage, before, after in regressions:
+            click.echo(f'Regression in {size} {stage}: {before:.4f}s -> {after:.4f}s')
+
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Local stand-ins for the Telegram Bot API, Scrapinghub and Amplitude.
+
+One threaded HTTP server answers all of them under different path prefixes, so the bot can be loaded without
+touching real services. Every response can be delayed to emulate network round trips.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+bot_user = {
+    'id': 982115507,
+    'is_bot': True,
+    'first_name': 'Wildsearch load test',
+    'username': 'wildsearch_load_test_bot',
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def read_params(self) -> dict:
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8')
+        params = {key: values[0] for key, values in parse_qs(urlsplit(self.path).query).items()}
+
+        if not body:
+            return params
+
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            params.update(json.loads(body))
+        else:
+            params.update({key: values[0] for key, values in parse_qs(body).items()})
+
+        return params
+
+    def respond(self, payload, content_type='application/json'):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def dispatch(self):
+        params = self.read_params()
+        path = urlsplit(self.path).path
+        self.server.count(path)
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if path.startswith('/telegram/'):
+            self.respond({'ok': True, 'result': telegram_result(path.rsplit('/', 1)[-1], params)})
+        elif path.startswith('/scrapinghub/api/run.json'):
+            self.respond({'status': 'ok', 'jobid': f'{params.get("project", 1)}/1/{self.server.next_job_id()}'})
+        elif path.startswith('/scrapinghub/storage/ids/'):
+            self.respond(b'1\n')
+        elif path.startswith('/scrapinghub/storage/jobq/'):
+            self.respond(b'0\n')
+        elif path.startswith('/amplitude/'):
+            self.respond({'code': 200, 'events_ingested': 1})
+        else:
+            self.send_error(404)
+
+
+def telegram_result(method: str, params: dict):
+    if method == 'getMe':
+        return bot_user
+
+    if method == 'getMyCommands':
+        return []
+
+    if method.startswith('send') or method.startswith('edit'):
+        chat_id = int(params.get('chat_id') or 0)
+
+        return {
+            'message_id': 1,
+            'from': bot_user,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'date': int(time.time()),
+            'text': params.get('text', ''),
+        }
+
+    return True
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0):
+        super().__init__((host, port), StubHandler)
+        self.latency = latency
+        self.requests = {}
+        self.lock = threading.Lock()
+        self.job_id = 0
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def count(self, path: str):
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def next_job_id(self) -> int:
+        with self.lock:
+            self.job_id += 1
+            return self.job_id
+
+    def environ(self) -> dict:
+        """Variables which point the bot to this server instead of the real services."""
+        return {
+            'TELEGRAM_API_BASE_URL': f'{self.url}/telegram/bot',
+            'SH_PROJECT_ID': '1',
+            'SH_DASH_ENDPOINT': f'{self.url}/scrapinghub/api/',
+            'SH_STORAGE_ENDPOINT': f'{self.url}/scrapinghub/storage/',
+            'AMPLITUDE_ENDPOINT': f'{self.url}/amplitude/2/httpapi',
+        }
+
+    def start(self) -> 'StubServer':
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
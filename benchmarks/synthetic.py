@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+from seller_stats.utils.transformers import WildsearchCrawlerWildberriesTransformer as wb_transformer
+
+countries = ['Россия', 'Китай', 'Турция', 'Беларусь', 'Узбекистан', 'Индия', 'Италия', 'Германия', 'Корея, Республика',
+             'Вьетнам', 'Бангладеш', 'Польша', 'Франция', 'Соединенные Штаты', 'Киргизия']
+countries_weights = np.array([40, 25, 9, 6, 4, 3, 2, 2, 2, 2, 1, 1, 1, 1, 1], dtype=float)
+
+ratings = [0, 1, 2, 3, 4, 5]
+ratings_weights = np.array([30, 2, 3, 7, 18, 40], dtype=float)
+
+
+def generate_category_items(size: int, seed: int = 42, category_slug: str = 'synthetic') -> list:
+    """Raw crawler items of a WB category with long-tailed brands, prices and sales."""
+    random = np.random.RandomState(seed)
+
+    brands_count = max(1, int(size ** 0.75 / 2))
+    brand_ids = np.minimum(random.zipf(1.3, size), brands_count) - 1
+
+    prices = np.round(random.lognormal(mean=7, sigma=1.1, size=size))
+    purchases = np.where(
+        random.random_sample(size) < 0.35,
+        0,
+        np.round(random.pareto(1.1, size) * 20),
+    )
+
+    item_countries = random.choice(len(countries), size=size, p=countries_weights / countries_weights.sum())
+    item_ratings = random.choice(ratings, size=size, p=ratings_weights / ratings_weights.sum())
+
+    now = datetime.now()
+    review_days = random.randint(1, 365 * 5, size=size)
+    has_review = (purchases > 0) & (random.random_sample(size) < 0.9)
+
+    category_url = f'https://www.wildberries.ru/catalog/{category_slug}'
+    transformer = wb_transformer()
+
+    items = []
+    for index in range(size):
+        brand_id = int(brand_ids[index])
+        item_id = 1000000 + index
+
+        first_review = None
+        if has_review[index]:
+            first_review = (now - timedelta(days=int(review_days[index]))).strftime('%Y-%m-%dT%H:%M:%S.0000000+03:00')
+
+        items.append(transformer.transform_item({
+            'image_urls': [f'//img1.wbstatic.net/big/new/{item_id}-1.jpg'],
+            'marketplace': 'wildberries',
+            'product_name': f'Товар {item_id}',
+            'product_url': f'https://www.wildberries.ru/catalog/{item_id}/detail.aspx',
+            'wb_brand_country': countries[int(item_countries[index])],
+            'wb_brand_logo': f'//images.wbstatic.net/brands/small/new/{brand_id}.jpg',
+            'wb_brand_name': f'Бренд {brand_id}',
+            'wb_brand_url': f'https://www.wildberries.ru/brands/brand-{brand_id}',
+            'wb_category_name': 'Синтетическая категория',
+            'wb_category_position': index + 1,
+            'wb_category_url': category_url,
+            'wb_first_review_date': first_review,
+            'wb_id': str(item_id),
+            'wb_manufacture_country': countries[int(item_countries[index])],
+            'wb_price': str(int(prices[index])),
+            'wb_purchases_count': int(purchases[index]),
+            'wb_rating': str(int(item_ratings[index])),
+            'wb_reviews_count': str(int(purchases[index] // 10)),
+        }))
+
+    return items
@@ -0,0 +1,268 @@
+"""Webhook throughput load test.
+
+In-process mode serves src.web.app with a threaded WSGI server against local stand-ins of external services:
+
+    python -m benchmarks.webhook_load run --rate 50 --duration 30
+
+Any other server (uwsgi with the given processes and threads, an async one) is loaded with --url. Start the stand-ins
+first and export the printed variables to the environment of that server:
+
+    python -m benchmarks.webhook_load stubs --port 8090
+    python -m benchmarks.webhook_load run --url http://localhost:8000 --rate 200
+"""
+import copy
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import click
+import numpy as np
+import requests
+
+from .stubs import StubServer
+
+mocks_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'mocks')
+
+default_mix = 'start=2,help=1,catalog=4,info=1,callback=2,unknown=1'
+
+
+def load_mock(name: str) -> dict:
+    with open(os.path.join(mocks_path, name)) as file:
+        return json.load(file)
+
+
+class UpdateFactory:
+    """Recorded updates from tests/mocks with the text, sender and update ID replaced."""
+
+    def __init__(self, users: int, seed: int = 42):
+        self.users = users
+        self.random = random.Random(seed)
+        self.update_id = 0
+        self.lock = threading.Lock()
+
+        self.command = load_mock('tg_request_command.json')
+        self.text = load_mock('tg_request_text.json')
+        self.callback = load_mock('tg_request_callback.json')
+
+        self.kinds = {
+            'start': lambda: self.make_command('/start'),
+            'help': lambda: self.make_command('/help'),
+            'catalog': lambda: self.make_text('https://www.wildberries.ru/catalog/dom-i-dacha/vannaya/aksessuary'),
+            'info': lambda: self.make_text('ℹ️ О сервисе'),
+            'callback': lambda: self.make_callback('keyboard_help_catalog_link'),
+            'unknown': lambda: self.make_text('Привет'),
+        }
+
+    def next_ids(self):
+        with self.lock:
+            self.update_id += 1
+            return self.update_id, 1000000 + self.random.randrange(self.users)
+
+    def make_command(self, command: str) -> dict:
+        update = copy.deepcopy(self.command)
+        update['message']['text'] = command
+        update['message']['entities'][0]['length'] = len(command)
+
+        return self.personalize(update, update['message'])
+
+    def make_text(self, text: str) -> dict:
+        update = copy.deepcopy(self.text)
+        update['message']['text'] = text
+
+        return self.personalize(update, update['message'])
+
+    def make_callback(self, data: str) -> dict:
+        update = copy.deepcopy(self.callback)
+        update['callback_query']['data'] = data
+        update = self.personalize(update, update['callback_query']['message'], sender=update['callback_query']['from'])
+        update['callback_query']['id'] = str(update['update_id'])
+
+        return update
+
+    def personalize(self, update: dict, message: dict, sender: dict = None) -> dict:
+        update['update_id'], chat_id = self.next_ids()
+        message['chat']['id'] = chat_id
+        (sender or message['from'])['id'] = chat_id
+        message['date'] = int(time.time())
+
+        return update
+
+    def make(self, kind: str) -> dict:
+        return self.kinds[kind]()
+
+
+def parse_mix(mix: str, kinds) -> dict:
+    weights = {}
+
+    for part in mix.split(','):
+        kind, _, weight = part.partition('=')
+        if kind.strip() not in kinds:
+            raise click.BadParameter(f'Unknown update kind {kind}, use one of {", ".join(kinds)}')
+
+        weights[kind.strip()] = float(weight or 1)
+
+    return weights
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve_app_in_process(stubs: StubServer, broker: str, eager: bool) -> str:
+    """Point the bot to the stand-ins and serve src.web.app, returns the webhook URL."""
+    os.environ.update(stubs.environ())
+    os.environ['REDIS_URL'] = broker
+    os.environ['CELERY_ALWAYS_EAGER'] = str(eager)
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'load.sqlite'))
+    os.environ.pop('SENTRY_DSN', None)
+
+    from src.web import app
+
+    server = make_server('127.0.0.1', 0, app, server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return f'http://127.0.0.1:{server.server_port}/{os.environ["TELEGRAM_API_TOKEN"]}'
+
+
+def summarize(samples: list, duration: float) -> dict:
+    """Latency percentiles in milliseconds and error rate for each update kind and for all of them."""
+    groups = {}
+    for kind, latency, ok in samples:
+        groups.setdefault(kind, []).append((latency, ok))
+    groups['all'] = [(latency, ok) for _, latency, ok in samples]
+
+    summary = {}
+    for kind, values in groups.items():
+        latencies = np.array([latency for latency, _ in values]) * 1000
+        errors = sum(1 for _, ok in values if not ok)
+
+        summary[kind] = {
+            'requests': len(values),
+            'rps': round(len(values) / duration, 2),
+            'errors': errors,
+            'error_rate': round(errors / len(values), 4),
+            'p50': round(float(np.percentile(latencies, 50)), 2),
+            'p90': round(float(np.percentile(latencies, 90)), 2),
+            'p99': round(float(np.percentile(latencies, 99)), 2),
+            'max': round(float(latencies.max()), 2),
+        }
+
+    return summary
+
+
+def run_load(webhook_url: str, factory: UpdateFactory, weights: dict, rate: float, duration: float,
+             concurrency: int, timeout: float) -> list:
+    """Sends updates at a constant rate, latency is counted from the planned send time to not hide queueing."""
+    samples = []
+    samples_lock = threading.Lock()
+    local = threading.local()
+    kinds = list(weights.keys())
+
+    def send(kind, payload, planned_at):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+
+        try:
+            ok = local.session.post(webhook_url, data=payload, timeout=timeout,
+                                    headers={'Content-Type': 'application/json'}).status_code == 200
+        except requests.RequestException:
+            ok = False
+
+        with samples_lock:
+            samples.append((kind, time.perf_counter() - planned_at, ok))
+
+    total = int(rate * duration)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start_time = time.perf_counter()
+
+        for index in range(total):
+            planned_at = start_time + index / rate
+            kind = factory.random.choices(kinds, weights=[weights[kind] for kind in kinds])[0]
+            payload = json.dumps(factory.make(kind))
+
+            delay = planned_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            executor.submit(send, kind, payload, planned_at)
+
+    return samples
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8090)
+@click.option('--latency', default=0.0, help='seconds every stand-in response is delayed for')
+def stubs(host, port, latency):
+    """Run the stand-ins in the foreground for an externally started server."""
+    server = StubServer(host=host, port=port, latency=latency)
+
+    for key, value in server.environ().items():
+        click.echo(f'export {key}={value}')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command()
+@click.option('--url', help='webhook URL of an already running server, in-process app is served otherwise')
+@click.option('--rate', default=20.0, help='updates per second')
+@click.option('--duration', default=10.0, help='seconds to send updates for')
+@click.option('--concurrency', default=64, help='max simultaneous requests')
+@click.option('--mix', default=default_mix, help='weights of update kinds')
+@click.option('--users', default=100, help='distinct chats updates come from')
+@click.option('--latency', default=0.05, help='seconds every stand-in response is delayed for')
+@click.option('--broker', default='memory://', help='Celery broker for the in-process app')
+@click.option('--eager/--no-eager', default=False, help='run Celery tasks inside the webhook request of the in-process app')
+@click.option('--timeout', default=30.0, help='request timeout in seconds')
+@click.option('--seed', default=42)
+@click.option('--output', '-o', type=click.Path(), help='file to save results as JSON')
+def run(url, rate, duration, concurrency, mix, users, latency, broker, eager, timeout, seed, output):
+    """Replay the update mix against the webhook and report latency per update kind."""
+    factory = UpdateFactory(users=users, seed=seed)
+    weights = parse_mix(mix, factory.kinds.keys())
+
+    stub_server = None
+    if url is None:
+        stub_server = StubServer(latency=latency).start()
+        url = serve_app_in_process(stub_server, broker, eager)
+
+    samples = run_load(url, factory, weights, rate=rate, duration=duration, concurrency=concurrency, timeout=timeout)
+    summary = summarize(samples, duration)
+
+    click.echo(f'{"kind":<10} {"requests":>9} {"rps":>8} {"errors":>7} {"p50 ms":>9} {"p90 ms":>9} {"p99 ms":>9} {"max ms":>9}')
+    for kind, row in summary.items():
+        click.echo(f'{kind:<10} {row["requests"]:>9} {row["rps"]:>8} {row["errors"]:>7} {row["p50"]:>9} {row["p90"]:>9} {row["p99"]:>9} {row["max"]:>9}')
+
+    if output:
+        results = {
+            'settings': {'rate': rate, 'duration': duration, 'concurrency': concurrency, 'mix': weights, 'users': users,
+                         'stub_latency': latency, 'eager': eager, 'url': url if stub_server is None else 'in-process'},
+            'summary': summary,
+            'stub_requests': stub_server.requests if stub_server is not None else None,
+        }
+
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    cli()
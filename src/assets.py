@@ -0,0 +1,165 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit
+
+from envparse import env
+
+from .transport import get_session
+
+logger = logging.getLogger(__name__)
+
+_local_assets = {}
+_local_assets_lock = threading.Lock()
+_failed_urls = {}
+_image_cache = None
+
+
+class ImageCache:
+    """Remote images on the local disk, least recently used files are evicted when the size limit is reached."""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+
+    def file_path(self, url: str) -> str:
+        return os.path.join(self.path, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def get(self, url: str):
+        file_path = self.file_path(url)
+
+        try:
+            with open(file_path, 'rb') as file:
+                content = file.read()
+        except FileNotFoundError:
+            return None
+
+        os.utime(file_path)
+
+        return content
+
+    def put(self, url: str, content: bytes):
+        file_path = self.file_path(url)
+        temp_path = f'{file_path}.{threading.get_ident()}.tmp'
+
+        with open(temp_path, 'wb') as file:
+            file.write(content)
+
+        os.replace(temp_path, file_path)
+
+    def evict(self):
+        with self.lock:
+            files = []
+            for entry in os.scandir(self.path):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in files)
+
+            for _, size, file_path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+
+                try:
+                    os.remove(file_path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+
+
+def get_image_cache() -> ImageCache:
+    global _image_cache
+
+    if _image_cache is None:
+        _image_cache = ImageCache(
+            path=env('REPORT_IMAGE_CACHE_DIR', cast=str, default='/tmp/wildsearch_images'),
+            max_bytes=env('REPORT_IMAGE_CACHE_SIZE', cast=int, default=200) * 1024 * 1024,
+        )
+
+    return _image_cache
+
+
+def is_remote(url: str) -> bool:
+    return url.startswith('http://') or url.startswith('https://')
+
+
+def report_image_urls(html: str) -> list:
+    """Remote images referenced by the rendered report, in order and without duplicates."""
+    return list(dict.fromkeys(url for url in re.findall(r'src="([^"]+)"', html) if is_remote(url)))
+
+
+def fetch_remote(url: str):
+    cache = get_image_cache()
+    content = cache.get(url)
+
+    if content is not None:
+        return content
+
+    # недоступную картинку не ждем повторно при верстке сразу после неудачной предзагрузки
+    if time.time() - _failed_urls.get(url, 0) < env('REPORT_IMAGE_RETRY_AFTER', cast=int, default=600):
+        return None
+
+    try:
+        response = get_session(url).get(url, timeout=env('REPORT_IMAGE_TIMEOUT', cast=float, default=5.0))
+        response.raise_for_status()
+    except Exception as exception_info:
+        logger.warning(f'Image {url} was not fetched: {str(exception_info)}')
+        _failed_urls[url] = time.time()
+        return None
+
+    cache.put(url, response.content)
+
+    return response.content
+
+
+def prefetch_images(urls: list, workers: int = None):
+    """Downloads the images in parallel before layout, so WeasyPrint only reads them from the disk cache."""
+    if not urls:
+        return
+
+    workers = workers or env('REPORT_IMAGE_PREFETCH_WORKERS', cast=int, default=16)
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(urls))) as executor:
+        list(executor.map(fetch_remote, urls))
+
+    get_image_cache().evict()
+
+
+def read_local_asset(path: str) -> bytes:
+    """Icons, flags and fonts of the templates are read once per process."""
+    with _local_assets_lock:
+        if path not in _local_assets:
+            with open(path, 'rb') as file:
+                _local_assets[path] = file.read()
+
+        return _local_assets[path]
+
+
+def asset_url_fetcher(url: str) -> dict:
+    """WeasyPrint fetcher which never waits for a remote server longer than the timeout."""
+    mime_type, _ = mimetypes.guess_type(urlsplit(url).path)
+
+    if is_remote(url):
+        content = fetch_remote(url)
+
+        if content is None:
+            # WeasyPrint пропускает ресурс, который не удалось получить, и верстает альтернативный текст
+            raise IOError(f'Image {url} is not available')
+
+        return {'string': content, 'mime_type': mime_type, 'redirected_url': url}
+
+    if url.startswith('file://'):
+        return {'string': read_local_asset(unquote(urlsplit(url).path)), 'mime_type': mime_type, 'redirected_url': url}
+
+    from weasyprint import default_url_fetcher
+
+    return default_url_fetcher(url)
@@ -4,6 +4,8 @@ from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMa
 from telegram.ext import CallbackContext, CallbackQueryHandler, CommandHandler, Dispatcher, Filters, MessageHandler
 
 from . import tasks
+from .marketplaces import detect_marketplace_by_url, registry
+from .metrics import timed
 from .models import create_tables, log_command, user_get_by_update
 
 # включаем логи
@@ -39,9 +41,6 @@ def process_command(name, user, text=''):
 
 def help_start(update: Update, context: CallbackContext):
     user = user_get_by_update(update)
-
-    tasks.add_user_to_crm(user.chat_id)
-
     process_command(name='Started bot', user=user)
 
     context.bot.send_message(
@@ -134,7 +133,7 @@ def help_marketplace_not_supported(update: Update, context: CallbackContext):
 
     context.bot.send_message(
         chat_id=user.chat_id,
-        text='⚠️🤷 Сейчас бот может анализировать только ссылки на каталоги Wildberries, другие площадки пока не поддерживаются',
+        text='⚠️🤷 Сейчас бот может анализировать только ссылки на каталоги Wildberries и Ozon, другие площадки пока не поддерживаются',
         reply_markup=InlineKeyboardMarkup([
             [InlineKeyboardButton('💁‍️ Как правильно указать категорию?', callback_data='keyboard_help_catalog_link')],
         ]),
@@ -167,8 +166,27 @@ def wb_catalog(update: Update, context: CallbackContext):
         process_event(user=user, event='Received "Out of requests" error')
 
     else:
+        marketplace = detect_marketplace_by_url(update.message.text)
         tasks.schedule_category_export.delay(update.message.text, update.message.chat_id, log_item.id)
-        process_event(user=user, event='Started WB catalog export')
+        process_event(user=user, event=f'Started {marketplace.slug} catalog export')
+
+
+def report_format(update: Update, context: CallbackContext):
+    user = user_get_by_update(update)
+    _, report_format, job_id = update.callback_query.data.split(':', 2)
+
+    update.callback_query.answer()
+    tasks.send_category_report.delay(job_id, [user.chat_id], report_format)
+    process_event(user=user, event=f'Requested {report_format} report')
+
+
+def category_slice(update: Update, context: CallbackContext):
+    user = user_get_by_update(update)
+    _, filters, job_id = update.callback_query.data.split(':', 2)
+
+    update.callback_query.answer()
+    tasks.send_category_slice.delay(job_id, user.chat_id, filters)
+    process_event(user=user, event='Requested category slice')
 
 
 def reset_webhook(bot, url, token):
@@ -192,14 +210,21 @@ def start_bot(bot):
     dp.add_handler(CallbackQueryHandler(help_catalog_link, pattern='keyboard_help_catalog_link'))
     dp.add_handler(CallbackQueryHandler(help_feedback, pattern='keyboard_help_info_feedback'))
     dp.add_handler(CallbackQueryHandler(help_no_limits, pattern='keyboard_help_no_limits'))
+    dp.add_handler(CallbackQueryHandler(report_format, pattern='^report_format:'))
+    dp.add_handler(CallbackQueryHandler(category_slice, pattern='^slice:'))
 
-    dp.add_handler(MessageHandler(Filters.text & Filters.regex(r'(ozon\.ru|beru\.ru|goods\.ru|tmall\.ru|lamoda\.ru)/'), help_marketplace_not_supported))
     dp.add_handler(MessageHandler(Filters.text & Filters.regex(r'www\.wildberries\.ru/catalog/.*/detail\.aspx'), help_command_not_found))
-    dp.add_handler(MessageHandler(Filters.text & Filters.regex(r'www\.wildberries\.ru/catalog/'), wb_catalog))
-    dp.add_handler(MessageHandler(Filters.text & Filters.regex(r'www\.wildberries\.ru/brands/'), wb_catalog))
-    dp.add_handler(MessageHandler(Filters.text & Filters.regex(r'www\.wildberries\.ru/promotions/'), wb_catalog))
-    dp.add_handler(MessageHandler(Filters.text & Filters.regex(r'www\.wildberries\.ru/search\?text='), wb_catalog))
+    dp.add_handler(MessageHandler(Filters.text & Filters.regex(r'ozon\.ru/(product|context/detail)/'), help_command_not_found))
+
+    for marketplace in registry:
+        dp.add_handler(MessageHandler(Filters.text & Filters.regex(marketplace.url_regex), wb_catalog))
+
+    dp.add_handler(MessageHandler(Filters.text & Filters.regex(r'(beru\.ru|goods\.ru|tmall\.ru|lamoda\.ru)/'), help_marketplace_not_supported))
 
     dp.add_handler(MessageHandler(Filters.all, help_command_not_found))
 
+    for handlers in dp.handlers.values():
+        for handler in handlers:
+            handler.callback = timed('webhook.handler', handler=handler.callback.__name__)(handler.callback)
+
     return dp
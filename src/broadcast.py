@@ -0,0 +1,121 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from peewee import chunked
+from telegram.error import RetryAfter, TelegramError, TimedOut
+
+from .models import Broadcast, BroadcastMessage
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Thread-safe token bucket, `acquire` blocks until the next message is allowed to go."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Stop all senders, Telegram flood control is global for the bot."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+class Broadcaster:
+    def __init__(self, bot, broadcast: Broadcast, workers: int = 8, rate: float = 25, max_retries: int = 5):
+        self.bot = bot
+        self.broadcast = broadcast
+        self.workers = workers
+        self.bucket = TokenBucket(rate=rate)
+        self.max_retries = max_retries
+
+    def send(self, chat_id: int) -> (int, str, str):
+        for _ in range(self.max_retries):
+            self.bucket.acquire()
+
+            try:
+                self.bot.send_message(chat_id=chat_id, text=self.broadcast.text, parse_mode='Markdown', disable_web_page_preview=True)
+                return chat_id, 'sent', None
+            except RetryAfter as error:
+                logger.warning(f'Flood control while sending to {chat_id}, waiting {error.retry_after}s')
+                self.bucket.pause(error.retry_after)
+            except TimedOut as error:
+                # сообщение могло уйти, поэтому не повторяем, чтобы не прислать его дважды
+                return chat_id, 'timed_out', str(error)
+            except TelegramError as error:
+                return chat_id, 'failed', str(error)
+
+        return chat_id, 'failed', 'Retries exceeded'
+
+    def save_results(self, results):
+        rows = [{
+            'broadcast': self.broadcast.id,
+            'user': chat_id,
+            'status': status,
+            'error': error[:255] if error else None,
+            'sent_at': datetime.now(),
+        } for chat_id, status, error in results]
+
+        # при продолжении рассылки неудачная отправка заменяется новым результатом
+        for batch in chunked(rows, 100):
+            BroadcastMessage.insert_many(batch).on_conflict(
+                conflict_target=[BroadcastMessage.broadcast, BroadcastMessage.user],
+                preserve=[BroadcastMessage.status, BroadcastMessage.error, BroadcastMessage.sent_at],
+            ).execute()
+
+    def run(self, progress_every: int = 25, flush_interval: float = 1.0) -> dict:
+        chat_ids = self.broadcast.pending_chat_ids()
+        counters = {'sent': 0, 'failed': 0, 'timed_out': 0}
+
+        logger.info(f'Broadcast #{self.broadcast.id}: {len(chat_ids)} recipients left')
+        self.broadcast.set_status('running')
+
+        results = []
+        flushed_at = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.send, chat_id) for chat_id in chat_ids]
+
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                counters[result[1]] += 1
+
+                # прогресс сохраняем небольшими пачками, чтобы при падении не разослать повторно уже отправленное
+                if len(results) >= progress_every or time.monotonic() - flushed_at >= flush_interval:
+                    self.save_results(results)
+                    results = []
+                    flushed_at = time.monotonic()
+
+        self.save_results(results)
+        self.broadcast.set_status('finished')
+
+        logger.info(f'Broadcast #{self.broadcast.id} finished: {counters["sent"]} sent, {counters["failed"]} failed, {counters["timed_out"]} timed out')
+
+        return counters
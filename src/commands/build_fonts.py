@@ -0,0 +1,100 @@
+import logging
+import os
+import re
+
+import click
+
+from ..reports import base_path
+
+faces = {
+    100: 'Thin',
+    300: 'Light',
+    400: 'Regular',
+    500: 'Medium',
+    700: 'Bold',
+    900: 'Black',
+}
+
+weight_keywords = {
+    'normal': 400,
+    'bold': 700,
+}
+
+# Basic Latin, Latin-1, кириллица, типографские знаки, рубль и номер
+unicodes = [
+    *range(0x0020, 0x007F),
+    *range(0x00A0, 0x0100),
+    *range(0x0400, 0x0460),
+    0x0490, 0x0491,
+    *range(0x2010, 0x2028),
+    *range(0x2030, 0x203B),
+    0x20AC, 0x20BD, 0x2116, 0x2122, 0x2191, 0x2193, 0x2212,
+]
+
+
+def used_font_weights(css: str) -> list:
+    """Weights set by the report styles, regular and bold are always needed for plain text and <strong>."""
+    css = re.sub(r'@font-face\s*{[^}]*}', '', css)
+    weights = {400, 700}
+
+    for value in re.findall(r'font-weight\s*:\s*([\w-]+)', css):
+        if value.isdigit():
+            weights.add(int(value))
+        elif value in weight_keywords:
+            weights.add(weight_keywords[value])
+
+    return sorted(weight for weight in weights if weight in faces)
+
+
+def font_face_css(weights: list) -> str:
+    rules = [
+        '@font-face {\n'
+        '  font-family: Roboto;\n'
+        '  font-style: normal;\n'
+        f'  font-weight: {weight};\n'
+        f'  src: url(../fonts/subset/Roboto-{faces[weight]}.ttf);\n'
+        '}\n'
+        for weight in weights
+    ]
+
+    return '/* Generated by src.commands.build_fonts, do not edit */\n\n' + '\n'.join(rules)
+
+
+def subset_font(source: str, target: str):
+    from fontTools import subset
+
+    options = subset.Options()
+    options.layout_features = ['kern', 'liga', 'lnum', 'tnum']
+    options.hinting = False
+    options.name_IDs = [1, 2, 3, 4, 6]
+
+    font = subset.load_font(source, options)
+    subsetter = subset.Subsetter(options=options)
+    subsetter.populate(unicodes=unicodes)
+    subsetter.subset(font)
+    subset.save_font(font, target, options)
+
+
+@click.command()
+@click.option('--path', '-p', default=base_path, help='report templates directory')
+def main(path):
+    logging.getLogger('fontTools').setLevel(logging.WARNING)
+
+    with open(os.path.join(path, 'css', 'style.css')) as file:
+        weights = used_font_weights(file.read())
+
+    os.makedirs(os.path.join(path, 'fonts', 'subset'), exist_ok=True)
+
+    for weight in weights:
+        source = os.path.join(path, 'fonts', f'Roboto-{faces[weight]}.ttf')
+        target = os.path.join(path, 'fonts', 'subset', f'Roboto-{faces[weight]}.ttf')
+        subset_font(source, target)
+
+        print(f'{os.path.basename(target)}: {os.path.getsize(source)} -> {os.path.getsize(target)} bytes')  # noqa: T001
+
+    with open(os.path.join(path, 'css', 'fonts.css'), 'w') as file:
+        file.write(font_face_css(weights))
+
+
+if __name__ == '__main__':
+    main()
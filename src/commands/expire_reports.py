@@ -0,0 +1,25 @@
+import click
+from botocore.exceptions import BotoCoreError, ClientError
+from envparse import env
+
+from ..storage import set_reports_expiration
+
+
+@click.command()
+@click.option('--days', '-d', default=env('REPORT_STORAGE_DAYS', cast=int, default=14), help='days to keep stored reports and datasets')
+def main(days):
+    # команда запускается при каждой выкладке, поэтому нехватка прав на бакет не должна ее останавливать
+    try:
+        changed = set_reports_expiration(days)
+    except (BotoCoreError, ClientError) as exception_info:
+        print(f'Reports expiration was not set: {str(exception_info)}')  # noqa: T001
+        return
+
+    if changed:
+        print(f'Stored reports expire in {days} days')  # noqa: T001
+    else:
+        print(f'Stored reports already expire in {days} days')  # noqa: T001
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+import io
+import os
+
+import click
+
+from ..reports import base_path
+
+
+def optimize_png(path: str) -> int:
+    """Lossless recompression, the file is replaced only if it got smaller. Returns saved bytes."""
+    from PIL import Image
+
+    with open(path, 'rb') as file:
+        original = file.read()
+
+    image = Image.open(io.BytesIO(original))
+    optimized = io.BytesIO()
+    image.save(optimized, format='PNG', optimize=True)
+
+    if len(optimized.getvalue()) >= len(original):
+        return 0
+
+    with open(path, 'wb') as file:
+        file.write(optimized.getvalue())
+
+    return len(original) - len(optimized.getvalue())
+
+
+@click.command()
+@click.option('--path', '-p', default=os.path.join(base_path, 'images'), help='directory with report images')
+def main(path):
+    saved = 0
+
+    for directory, _, files in os.walk(path):
+        for name in sorted(files):
+            if name.endswith('.png'):
+                saved += optimize_png(os.path.join(directory, name))
+
+    print(f'Saved {saved} bytes')  # noqa: T001
+
+
+if __name__ == '__main__':
+    main()
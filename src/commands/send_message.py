@@ -2,29 +2,48 @@ import logging
 
 import click
 from envparse import env
-from telegram import Bot
+
+from ..broadcast import Broadcaster
+from ..models import Broadcast
+from ..transport import get_bot
 
 logger = logging.getLogger(__name__)
 
-bot = Bot(env('TELEGRAM_API_TOKEN'))
+bot = get_bot()
 
 
 @click.command()
-@click.argument('text')
+@click.argument('text', required=False)
 @click.option(
     '--chat-ids', '-i',
-    help='chat IDs for bulk sending',
+    help='chat IDs for bulk sending, all users by default',
+)
+@click.option(
+    '--recipients', '-r',
+    type=click.Choice(['all', 'subscribed']),
+    default='all',
+    help='users to send the message to',
 )
-def main(text, chat_ids):
-    chat_ids = str.split(chat_ids, ',')
+@click.option(
+    '--resume', 'broadcast_id',
+    type=int,
+    help='ID of the interrupted broadcast to continue',
+)
+@click.option('--workers', '-w', default=8, help='concurrent senders')
+@click.option('--rate', default=env('SETTINGS_BROADCAST_RATE', cast=float, default=25.0), help='messages per second')
+def main(text, chat_ids, recipients, broadcast_id, workers, rate):
+    if broadcast_id is not None:
+        broadcast = Broadcast.get_by_id(broadcast_id)
+    elif text:
+        broadcast = Broadcast.create(text=text, recipients=recipients, chat_ids=chat_ids)
+    else:
+        raise click.UsageError('Pass message text or --resume with broadcast ID')
+
+    print(f'Broadcast #{broadcast.id} started')  # noqa: T001
 
-    for chat_id in chat_ids:
-        try:
-            bot.send_message(chat_id=chat_id, text=text, parse_mode='Markdown', disable_web_page_preview=True)
+    counters = Broadcaster(bot, broadcast, workers=workers, rate=rate).run()
 
-            print(f'Sending message to chat {chat_id} success')  # noqa: T001
-        except Exception as error:
-            print(f'Sending message to chat {chat_id} failed: {str(error)}')  # noqa: T001
+    print(f'Broadcast #{broadcast.id} finished: {counters["sent"]} sent, {counters["failed"]} failed, {counters["timed_out"]} timed out')  # noqa: T001
 
 
 if __name__ == '__main__':
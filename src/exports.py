@@ -0,0 +1,80 @@
+import csv
+import importlib.util
+from datetime import date, datetime
+
+from envparse import env
+from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype
+
+
+def export_formats() -> list:
+    """Parquet is offered only where pyarrow is installed."""
+    formats = ['xlsx', 'csv']
+
+    if importlib.util.find_spec('pyarrow') is not None:
+        formats.append('parquet')
+
+    return formats
+
+
+def cell_value(value):
+    if value is None or isinstance(value, (str, int, float, bool, datetime, date)):
+        return value
+
+    if isinstance(value, (list, tuple)):
+        return ', '.join(str(item) for item in value)
+
+    return str(value)
+
+
+def sheet_rows(df, chunk_size: int = None):
+    """Header and rows of the dataframe as plain Python values, converted chunk by chunk so memory does not grow with the sheet."""
+    chunk_size = chunk_size or env('EXPORT_CHUNK_SIZE', cast=int, default=10000)
+    text_columns = [
+        position for position, column in enumerate(df.columns)
+        if not is_numeric_dtype(df[column]) and not is_datetime64_any_dtype(df[column])
+    ]
+
+    yield list(df.columns)
+
+    for start in range(0, len(df.index), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+
+        for row in chunk.itertuples(index=False, name=None):
+            if text_columns:
+                row = list(row)
+                for position in text_columns:
+                    row[position] = cell_value(row[position])
+
+            yield row
+
+
+def write_xlsx(sheets: dict, target):
+    """Sheet name to dataframe, written by openpyxl in write-only mode: rows are streamed to the file and never kept as cells."""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+
+    for title, df in sheets.items():
+        worksheet = workbook.create_sheet(title=title)
+
+        for row in sheet_rows(df):
+            worksheet.append(row)
+
+    workbook.save(target)
+
+
+def write_csv(df, target):
+    # BOM нужен, чтобы Excel открыл кириллицу без мастера импорта
+    with open(target, 'w', newline='', encoding='utf-8-sig') as file:
+        csv.writer(file).writerows(sheet_rows(df))
+
+
+def write_parquet(df, target):
+    df = df.copy()
+
+    for column in df.columns:
+        if not is_numeric_dtype(df[column]) and not is_datetime64_any_dtype(df[column]):
+            df[column] = df[column].map(cell_value)
+
+    df.to_parquet(target, index=False)
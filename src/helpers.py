@@ -1,15 +1,16 @@
 import json
 import logging
 import math
-import re
 from typing import Union
+from urllib.parse import urlsplit, urlunsplit
 
 import boto3
-import requests
 from envparse import env
 from scrapinghub import ScrapinghubClient
-from seller_stats.utils.transformers import WildsearchCrawlerOzonTransformer as ozon_transformer
-from seller_stats.utils.transformers import WildsearchCrawlerWildberriesTransformer as wb_transformer
+
+from . import metrics
+from .marketplaces import detect_marketplace_by_job_id, detect_marketplace_by_url, get_marketplace
+from .transport import get_session, mount_adapter
 
 logger = logging.getLogger(__name__)
 
@@ -20,7 +21,8 @@ s3 = boto3.client('s3')
 class AmplitudeLogger:
     def __init__(self, api_key: str):
         self.api_key = api_key
-        self.endpoint = 'https://api.amplitude.com/2/httpapi'
+        self.endpoint = env('AMPLITUDE_ENDPOINT', default='https://api.amplitude.com/2/httpapi')
+        self.session = get_session(self.endpoint)
 
     def log(self, user_id: int, event: str, user_properties=None, event_properties=None, timestamp=None):
         amp_event = {
@@ -45,24 +47,43 @@ class AmplitudeLogger:
             ],
         }
 
-        requests.post(self.endpoint, data=json.dumps(amp_request))
+        self.session.post(self.endpoint, data=json.dumps(amp_request))
 
 
 def detect_mp_by_job_id(job_id: str):
-    spider = re.findall(r'\d+\/(\d+)\/\d+', job_id)[0]
+    marketplace = detect_marketplace_by_job_id(job_id)
+
+    if marketplace is None:
+        return None, None, None
+
+    return marketplace.slug, marketplace.name, marketplace.transformer()
+
 
-    if spider == env('SH_WB_SPIDER'):
-        return 'WB', 'Wildberries', wb_transformer()
+_scrapinghub_clients = {}
 
-    if spider == env('SH_OZON_SPIDER'):
-        return 'Ozon', 'Ozon', ozon_transformer()
 
-    return None, None, None
+def get_scrapinghub_client() -> ScrapinghubClient:
+    """Client is reused within the process to keep its HTTP connections alive."""
+    api_key = env('SH_APIKEY')
+
+    if api_key not in _scrapinghub_clients:
+        logger.info('Initializing scrapinghub')
+        endpoints = {
+            'dash_endpoint': env('SH_DASH_ENDPOINT', default=None),
+            'endpoint': env('SH_STORAGE_ENDPOINT', default=None),
+        }
+        client = ScrapinghubClient(api_key, **{key: value for key, value in endpoints.items() if value})
+
+        mount_adapter(client._hsclient.session)
+        mount_adapter(client._connection._session)
+
+        _scrapinghub_clients[api_key] = client
+
+    return _scrapinghub_clients[api_key]
 
 
 def init_scrapinghub():
-    logger.info('Initializing scrapinghub')
-    client = ScrapinghubClient(env('SH_APIKEY'))
+    client = get_scrapinghub_client()
     project = client.get_project(env('SH_PROJECT_ID'))
 
     return client, project
@@ -73,24 +94,72 @@ def scheduled_jobs_count(project: str, spider: str) -> int:
     return spider.jobs.count(state='pending') + spider.jobs.count(state='running')
 
 
-def category_export(url: str, chat_id: int, spider='wb') -> str:
-    """Schedule WB category export on Scrapinghub."""
-    logger.info(f'Export {url} for chat #{chat_id}')
+def category_export(url: str, chat_id: int = None, spider: str = None, callback='category_export', threshold: int = None, callback_params: dict = None) -> str:
+    """Schedule category export on Scrapinghub, the spider is chosen by the marketplace of the URL."""
+    if spider is not None:
+        marketplace = get_marketplace(spider)
+    else:
+        marketplace = detect_marketplace_by_url(url) or get_marketplace('wb')
+
+    spider = marketplace.spider
+
+    logger.info(f'Export {url} for chat #{chat_id} with spider {spider}')
     client, project = init_scrapinghub()
 
-    if scheduled_jobs_count(project, spider) > env('SCHEDULED_JOBS_THRESHOLD', cast=int, default=1):
-        raise Exception('Spider wb has more than SCHEDULED_JOBS_THRESHOLD queued jobs')
+    with metrics.timer('scrapinghub.jobs_count', spider=spider):
+        jobs_count = scheduled_jobs_count(project, spider)
+
+    if threshold is None:
+        threshold = env('SCHEDULED_JOBS_THRESHOLD', cast=int, default=1)
 
-    job = project.jobs.run(spider, job_args={
+    if jobs_count > threshold:
+        raise Exception(f'Spider {spider} has more than SCHEDULED_JOBS_THRESHOLD queued jobs')
+
+    job_args = {
         'category_url': url,
-        'callback_url': env('WILDSEARCH_JOB_FINISHED_CALLBACK') + f'/{spider}_category_export',
-        'callback_params': f'chat_id={chat_id}',
-    })
+        'callback_url': env('WILDSEARCH_JOB_FINISHED_CALLBACK') + '/' + marketplace.callback_route(callback),
+    }
+
+    params = dict(callback_params or {})
+
+    if chat_id is not None:
+        params['chat_id'] = chat_id
+
+    if params:
+        job_args['callback_params'] = '&'.join(f'{key}={value}' for key, value in params.items())
+
+    with metrics.timer('scrapinghub.run', spider=spider):
+        job = project.jobs.run(spider, job_args=job_args)
 
     logger.info(f'Export for category {url} will have job key {job.key}')
     return 'https://app.scrapinghub.com/p/' + job.key
 
 
+def normalize_category_url(url: str) -> str:
+    """Bring category URL to the single form so snapshots of the same category could be matched."""
+    url = str(url).strip()
+
+    if '://' not in url:
+        url = 'https://' + url
+
+    parts = urlsplit(url)
+
+    return urlunsplit((
+        'https',
+        parts.netloc.lower(),
+        parts.path.rstrip('/') or '/',
+        parts.query,
+        '',
+    ))
+
+
+def parent_category_url(url: str) -> str:
+    """Normalized URL of the catalog section the category belongs to, categories of one section are neighbours."""
+    parts = urlsplit(normalize_category_url(url))
+
+    return urlunsplit(('https', parts.netloc, parts.path.rsplit('/', 1)[0] or '/', '', ''))
+
+
 def smart_format_number(number: Union[int, float]):
     # 10 650 руб.
     # 15 тыс. шт.
@@ -0,0 +1,75 @@
+import re
+from functools import lru_cache
+
+from envparse import env
+from seller_stats.utils.transformers import WildsearchCrawlerOzonTransformer as ozon_transformer
+from seller_stats.utils.transformers import WildsearchCrawlerWildberriesTransformer as wb_transformer
+
+
+class Marketplace:
+    """Everything the bot needs to know to export and analyse categories of one marketplace."""
+
+    def __init__(self, slug: str, name: str, spider: str, spider_id_env: str, transformer, url_pattern: str):
+        self.slug = slug
+        self.name = name
+        self.spider = spider
+        self.spider_id_env = spider_id_env
+        self.transformer = transformer
+        self.url_pattern = url_pattern
+        self.url_regex = re.compile(url_pattern)
+
+    def callback_route(self, callback: str = 'category_export') -> str:
+        """Route Scrapinghub calls when the job of the spider is finished."""
+        return f'{self.spider}_{callback}'
+
+    def spider_id(self) -> str:
+        return env(self.spider_id_env, cast=str)
+
+
+registry = [
+    Marketplace(
+        slug='WB',
+        name='Wildberries',
+        spider='wb',
+        spider_id_env='SH_WB_SPIDER',
+        transformer=wb_transformer,
+        url_pattern=r'www\.wildberries\.ru/(catalog/|brands/|promotions/|search\?text=)',
+    ),
+    Marketplace(
+        slug='Ozon',
+        name='Ozon',
+        spider='ozon',
+        spider_id_env='SH_OZON_SPIDER',
+        transformer=ozon_transformer,
+        url_pattern=r'(www\.)?ozon\.ru/(category|brand|highlight|search)/',
+    ),
+]
+
+
+def get_marketplace(spider: str) -> Marketplace:
+    return next(marketplace for marketplace in registry if marketplace.spider == spider)
+
+
+def detect_marketplace_by_url(url: str):
+    for marketplace in registry:
+        if marketplace.url_regex.search(url):
+            return marketplace
+
+    return None
+
+
+@lru_cache(maxsize=None)
+def marketplaces_by_spider_id() -> dict:
+    # номера пауков не меняются, пока работает процесс, поэтому читаем их из окружения один раз
+    return {marketplace.spider_id(): marketplace for marketplace in registry}
+
+
+@lru_cache(maxsize=1024)
+def detect_marketplace_by_job_id(job_id: str):
+    """Job key looks like project/spider/job, the spider number tells the marketplace."""
+    parts = str(job_id).split('/')
+
+    if len(parts) != 3:
+        return None
+
+    return marketplaces_by_spider_id().get(parts[1])
@@ -0,0 +1,145 @@
+import logging
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+from envparse import env
+from prometheus_client import CollectorRegistry, Histogram, generate_latest, multiprocess
+
+logger = logging.getLogger(__name__)
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+class StatsdClient:
+    """Fire-and-forget DogStatsD client, metrics are sent to the Datadog agent over UDP."""
+
+    def __init__(self, host: str, port: int, prefix: str = ''):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+    def histogram(self, name: str, value: float, tags: dict = None):
+        packet = f'{self.prefix}{name}:{value}|h'
+
+        if tags:
+            packet += '|#' + ','.join(f'{key}:{val}' for key, val in sorted(tags.items()))
+
+        try:
+            self.socket.sendto(packet.encode('utf-8'), self.address)
+        except OSError as error:
+            logger.debug(f'Metric {name} was not sent: {str(error)}')
+
+
+class MetricsRegistry:
+    """Histograms are kept by prometheus_client, in multiprocess mode every process writes them to the shared directory."""
+
+    def __init__(self, statsd: StatsdClient = None, prefix: str = 'wildsearch_'):
+        self.statsd = statsd
+        self.prefix = prefix
+        self.registry = CollectorRegistry()
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name: str, labelnames: tuple) -> Histogram:
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(
+                    self.prefix + name.replace('.', '_') + '_seconds',
+                    f'Duration of {name}',
+                    labelnames=labelnames,
+                    buckets=default_buckets,
+                    registry=self.registry,
+                )
+
+        return self.histograms[name]
+
+    def observe(self, name: str, seconds: float, **tags):
+        # значения меток в Prometheus только строки, None тоже приводим к строке
+        labels = {tag: str(value) for tag, value in tags.items()}
+        histogram = self.histogram(name, tuple(sorted(labels)))
+
+        try:
+            (histogram.labels(**labels) if labels else histogram).observe(seconds)
+        except ValueError as error:
+            logger.warning(f'Metric {name} was not observed: {str(error)}')
+
+        if self.statsd is not None:
+            self.statsd.histogram(name, round(seconds * 1000, 3), tags)
+
+    def render_prometheus(self) -> bytes:
+        """Prometheus text exposition format, durations are in seconds."""
+        path = multiprocess_dir()
+
+        if path is None:
+            return generate_latest(self.registry)
+
+        # каждый воркер uwsgi пишет свои значения в общий каталог, отдаем их сумму
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=path)
+
+        return generate_latest(registry)
+
+
+def multiprocess_dir():
+    return env('prometheus_multiproc_dir', cast=str, default=None)
+
+
+def init_statsd():
+    if env('DD_AGENT_HOST', default=None) is None:
+        return None
+
+    return StatsdClient(
+        host=env('DD_AGENT_HOST'),
+        port=env('DD_DOGSTATSD_PORT', cast=int, default=8125),
+        prefix=env('STATSD_PREFIX', cast=str, default='wildsearch.'),
+    )
+
+
+registry = MetricsRegistry(statsd=init_statsd())
+
+
+def observe(name: str, seconds: float, **tags):
+    registry.observe(name, seconds, **tags)
+
+
+@contextmanager
+def timer(name: str, **tags):
+    start_time = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start_time, **tags)
+
+
+def timed(name: str, **tags):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name, **tags):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def task_queue_wait(request) -> float:
+    """Seconds the task spent in the broker, not counting the countdown it was scheduled with."""
+    published_at = getattr(request, 'published_at', None)
+
+    if published_at is None:
+        return None
+
+    ready_at = published_at
+
+    if request.eta:
+        eta = request.eta if isinstance(request.eta, datetime) else datetime.fromisoformat(request.eta)
+        ready_at = max(ready_at, eta.timestamp())
+
+    return max(time.time() - ready_at, 0)
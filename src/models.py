@@ -5,6 +5,8 @@ from envparse import env
 from playhouse.db_url import connect
 from telegram import Update
 
+from .helpers import normalize_category_url, parent_category_url
+
 env.read_envfile()
 db = connect(env('DATABASE_URL', cast=str, default='sqlite:///db.sqlite'))
 
@@ -89,6 +91,243 @@ class LogCommandItem(pw.Model):
         database = db
 
 
+class CategorySnapshot(pw.Model):
+    category_url = pw.CharField(index=True)
+    job_id = pw.CharField(index=True, null=True)
+    items_count = pw.IntegerField(default=0)
+    purchases = pw.FloatField(default=0)
+    turnover = pw.FloatField(default=0)
+    added_count = pw.IntegerField(default=0)
+    removed_count = pw.IntegerField(default=0)
+    changed_count = pw.IntegerField(default=0)
+    purchases_delta = pw.FloatField(default=0)
+    turnover_delta = pw.FloatField(default=0)
+    created_at = pw.DateTimeField(index=True)
+
+    def save(self, *args, **kwargs):
+        """Add timestamps for creating and updating items."""
+        if not self.created_at:
+            self.created_at = datetime.now()
+
+        return super(CategorySnapshot, self).save(*args, **kwargs)
+
+    class Meta:
+        database = db
+
+
+class CategorySnapshotDelta(pw.Model):
+    """Single changed SKU between two consecutive snapshots of the category."""
+    snapshot = pw.ForeignKeyField(CategorySnapshot, index=True, backref='deltas', on_delete='CASCADE')
+    item_id = pw.CharField(index=True)
+    change = pw.CharField(index=True)
+    price = pw.FloatField(default=0)
+    purchases = pw.FloatField(default=0)
+    turnover = pw.FloatField(default=0)
+    price_delta = pw.FloatField(default=0)
+    purchases_delta = pw.FloatField(default=0)
+    turnover_delta = pw.FloatField(default=0)
+
+    class Meta:
+        database = db
+
+
+class CategoryItemState(pw.Model):
+    """Last known state of SKU in the category, updated only by the deltas."""
+    category_url = pw.CharField()
+    item_id = pw.CharField()
+    price = pw.FloatField(default=0)
+    purchases = pw.FloatField(default=0)
+    turnover = pw.FloatField(default=0)
+
+    class Meta:
+        database = db
+        indexes = (
+            (('category_url', 'item_id'), True),
+        )
+
+
+class CategoryAggregate(pw.Model):
+    """Main indicators of the last analysed state of the category, enough to compare it with the neighbours."""
+    category_url = pw.CharField(unique=True)
+    parent_url = pw.CharField(index=True)
+    category_name = pw.CharField(null=True)
+    first_sales = pw.DateTimeField(null=True)
+    turnover_month = pw.FloatField(default=0)
+    goods_count = pw.IntegerField(default=0)
+    brands_count = pw.IntegerField(default=0)
+    turnover_median = pw.FloatField(default=0)
+    monopoly_index = pw.IntegerField(default=0)
+    updated_at = pw.DateTimeField(index=True)
+
+    class Meta:
+        database = db
+
+
+class CategoryJob(pw.Model):
+    """Scrapinghub export of the category: who is waiting for it and when each stage has ended."""
+    job_id = pw.CharField(unique=True)
+    category_url = pw.CharField(index=True)
+    marketplace = pw.CharField(null=True)
+    state = pw.CharField(default='scheduled', index=True)
+    items_count = pw.IntegerField(null=True)
+    scheduled_at = pw.DateTimeField(index=True)
+    finished_at = pw.DateTimeField(null=True)
+    analysed_at = pw.DateTimeField(null=True)
+
+    def add_recipient(self, user, log_item=None):
+        CategoryJobRecipient.insert(
+            job=self,
+            user=user,
+            log_item=log_item,
+            created_at=datetime.now(),
+        ).on_conflict_ignore().execute()
+
+    def add_recipients(self, chat_ids: list):
+        created_at = datetime.now()
+        rows = [{'job': self, 'user': chat_id, 'created_at': created_at} for chat_id in chat_ids]
+
+        for batch in pw.chunked(rows, 100):
+            CategoryJobRecipient.insert_many(batch).on_conflict_ignore().execute()
+
+    def chat_ids(self, joined_before: datetime = None) -> list:
+        query = CategoryJobRecipient.select(CategoryJobRecipient.user).where(
+            CategoryJobRecipient.job == self,
+        ).order_by(CategoryJobRecipient.id)
+
+        if joined_before is not None:
+            query = query.where(CategoryJobRecipient.created_at <= joined_before)
+
+        return [chat_id for chat_id, in query.tuples()]
+
+    def set_state(self, state, **fields):
+        self.state = state
+
+        if state in ['finished', 'analysed']:
+            setattr(self, f'{state}_at', datetime.now())
+
+        for field, value in fields.items():
+            setattr(self, field, value)
+
+        self.save()
+        return self
+
+    def save(self, *args, **kwargs):
+        """Add timestamps for creating and updating items."""
+        if not self.scheduled_at:
+            self.scheduled_at = datetime.now()
+
+        return super(CategoryJob, self).save(*args, **kwargs)
+
+    class Meta:
+        database = db
+
+
+class CategoryJobRecipient(pw.Model):
+    job = pw.ForeignKeyField(CategoryJob, backref='recipients', on_delete='CASCADE')
+    user = pw.ForeignKeyField(User, index=True)
+    log_item = pw.ForeignKeyField(LogCommandItem, null=True)
+    created_at = pw.DateTimeField()
+
+    class Meta:
+        database = db
+        indexes = (
+            (('job', 'user'), True),
+        )
+
+
+class DueNotification(pw.Model):
+    """Message to send at the given time, found by the periodic sweep instead of waiting in the broker as a countdown."""
+    user = pw.ForeignKeyField(User)
+    kind = pw.CharField()
+    due_at = pw.DateTimeField(index=True)
+
+    class Meta:
+        database = db
+        indexes = (
+            (('user', 'kind'), True),
+        )
+
+
+class Broadcast(pw.Model):
+    text = pw.TextField()
+    recipients = pw.CharField(default='all')
+    chat_ids = pw.TextField(null=True)
+    status = pw.CharField(default='new', index=True)
+    created_at = pw.DateTimeField(index=True)
+    finished_at = pw.DateTimeField(null=True)
+
+    def recipients_query(self):
+        query = User.select(User.chat_id)
+
+        if self.recipients == 'subscribed':
+            query = query.where(User.subscribe_to_wb_categories_updates == True)  # noqa: E712
+
+        if self.chat_ids:
+            query = query.where(User.chat_id.in_([int(chat_id) for chat_id in self.chat_ids.split(',')]))
+
+        return query
+
+    def pending_chat_ids(self) -> list:
+        """Recipients who have not received this broadcast yet, so interrupted sending could be resumed."""
+        # неудачные отправки повторяем, а после таймаута сообщение могло дойти, поэтому второй раз его не шлем
+        processed = BroadcastMessage.select(BroadcastMessage.user).where(
+            BroadcastMessage.broadcast == self,
+            BroadcastMessage.status.in_(['sent', 'timed_out']),
+        )
+        query = self.recipients_query().where(User.chat_id.not_in(processed)).order_by(User.chat_id)
+
+        return [user.chat_id for user in query]
+
+    def set_status(self, status):
+        self.status = status
+
+        if status == 'finished':
+            self.finished_at = datetime.now()
+
+        self.save()
+        return self
+
+    def save(self, *args, **kwargs):
+        """Add timestamps for creating and updating items."""
+        if not self.created_at:
+            self.created_at = datetime.now()
+
+        return super(Broadcast, self).save(*args, **kwargs)
+
+    class Meta:
+        database = db
+
+
+class BroadcastMessage(pw.Model):
+    broadcast = pw.ForeignKeyField(Broadcast, backref='messages', on_delete='CASCADE')
+    user = pw.ForeignKeyField(User, index=True)
+    status = pw.CharField(index=True)
+    error = pw.CharField(null=True)
+    sent_at = pw.DateTimeField()
+
+    class Meta:
+        database = db
+        indexes = (
+            (('broadcast', 'user'), True),
+        )
+
+
+class CrmSyncItem(pw.Model):
+    user = pw.ForeignKeyField(User, primary_key=True)
+    record_id = pw.CharField(null=True)
+    synced_at = pw.DateTimeField(index=True)
+
+    class Meta:
+        database = db
+
+
+def get_users_to_sync_with_crm(limit: int = 100):
+    """New users and users changed since the last sync, oldest changes first."""
+    return User.select(User, CrmSyncItem).join(CrmSyncItem, pw.JOIN.LEFT_OUTER).where(
+        (CrmSyncItem.user.is_null()) | (User.updated_at > CrmSyncItem.synced_at),
+    ).order_by(User.updated_at).limit(limit)
+
+
 def user_get_by_chat_id(chat_id):
     return User.get(User.chat_id == chat_id)
 
@@ -133,5 +372,104 @@ def get_subscribed_to_wb_categories_updates() -> []:
     return User.select().where(User.subscribe_to_wb_categories_updates == True)  # noqa: E712
 
 
+def get_watched_categories(days: int = 30) -> dict:
+    """Categories requested by users subscribed to updates, each with the list of its subscribers."""
+    time_from = datetime.now() - timedelta(days=days)
+
+    requests = LogCommandItem.select(LogCommandItem.user, LogCommandItem.message).join(User).where(
+        User.subscribe_to_wb_categories_updates == True,  # noqa: E712
+        LogCommandItem.command == 'wb_catalog',
+        LogCommandItem.status == 'success',
+        LogCommandItem.created_at >= time_from,
+    ).tuples()
+
+    watched = {}
+    for chat_id, category_url in requests:
+        if not category_url:
+            continue
+
+        subscribers = watched.setdefault(normalize_category_url(category_url), [])
+        if chat_id not in subscribers:
+            subscribers.append(chat_id)
+
+    return watched
+
+
+def get_last_category_snapshot(category_url: str):
+    return CategorySnapshot.select().where(
+        CategorySnapshot.category_url == category_url,
+    ).order_by(CategorySnapshot.created_at.desc(), CategorySnapshot.id.desc()).first()
+
+
+def save_category_aggregate(category_url: str, aggregate: dict):
+    """Only the latest state of the category is kept, so the table grows with the number of categories, not crawls."""
+    fields = {
+        **aggregate,
+        'category_url': normalize_category_url(category_url),
+        'parent_url': parent_category_url(category_url),
+        'updated_at': datetime.now(),
+    }
+
+    CategoryAggregate.insert(**fields).on_conflict(
+        conflict_target=[CategoryAggregate.category_url],
+        update={getattr(CategoryAggregate, field): value for field, value in fields.items() if field != 'category_url'},
+    ).execute()
+
+
+def get_category_neighbours(category_url: str, limit: int = 5) -> list:
+    """Other analysed categories of the same catalog section, the biggest by turnover first."""
+    category_url = normalize_category_url(category_url)
+
+    return list(CategoryAggregate.select().where(
+        CategoryAggregate.parent_url == parent_category_url(category_url),
+        CategoryAggregate.category_url != category_url,
+    ).order_by(CategoryAggregate.turnover_month.desc()).limit(limit).dicts())
+
+
+def get_category_job(job_id: str):
+    return CategoryJob.get_or_none(CategoryJob.job_id == str(job_id))
+
+
+def get_recent_category_job(category_url: str, state: str, minutes: int):
+    """Latest job of the category in the given state started within the window, None if there is no such job."""
+    time_from = datetime.now() - timedelta(minutes=minutes)
+
+    return CategoryJob.select().where(
+        CategoryJob.category_url == normalize_category_url(category_url),
+        CategoryJob.state == state,
+        CategoryJob.scheduled_at >= time_from,
+    ).order_by(CategoryJob.scheduled_at.desc()).first()
+
+
+def schedule_notification(chat_id: int, kind: str, due_at: datetime):
+    """One pending notification of the kind per user, a later request only moves it."""
+    DueNotification.insert(user=chat_id, kind=kind, due_at=due_at).on_conflict(
+        conflict_target=[DueNotification.user, DueNotification.kind],
+        update={DueNotification.due_at: due_at},
+    ).execute()
+
+
+def pop_due_notifications(limit: int = 500) -> list:
+    """Chat ids and kinds of the notifications that are due, removed from the table as they are taken."""
+    due = list(DueNotification.select(DueNotification.id, DueNotification.user, DueNotification.kind, DueNotification.due_at).where(
+        DueNotification.due_at <= datetime.now(),
+    ).order_by(DueNotification.due_at).limit(limit).tuples())
+
+    taken = []
+    with db.atomic():
+        for notification_id, chat_id, kind, due_at in due:
+            # уведомление, перенесенное на потом или уже забранное другим воркером, не удалится и не отправится
+            deleted = DueNotification.delete().where(
+                DueNotification.id == notification_id,
+                DueNotification.due_at == due_at,
+            ).execute()
+
+            if deleted:
+                taken.append((chat_id, kind))
+
+    return taken
+
+
 def create_tables():
-    db.create_tables([User, LogCommandItem])
+    db.create_tables([User, LogCommandItem, CategorySnapshot, CategorySnapshotDelta, CategoryItemState, CategoryAggregate,
+                      CategoryJob, CategoryJobRecipient, DueNotification, Broadcast, BroadcastMessage, CrmSyncItem])
@@ -0,0 +1,133 @@
+import cProfile
+import io
+import json
+import logging
+import marshal
+import os
+import platform
+import pstats
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from envparse import env
+
+logger = logging.getLogger(__name__)
+
+
+def profiling_enabled() -> bool:
+    return env('PROFILING_ENABLED', cast=bool, default=False)
+
+
+def profiling_requested(chat_id: int) -> bool:
+    """Categories requested from these chats are profiled even when profiling is disabled for everyone."""
+    chat_ids = env('PROFILING_CHAT_IDS', cast=str, default='')
+
+    return str(chat_id) in [item.strip() for item in chat_ids.split(',') if item.strip()]
+
+
+class JobProfiler:
+    """cProfile of every stage of the category job, saved together with the dataset size."""
+
+    def __init__(self, job_id: str, enabled: bool = False):
+        self.job_id = job_id
+        self.enabled = enabled
+        self.profiles = {}
+        self.timings = {}
+        self.metadata = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield
+            return
+
+        profile = cProfile.Profile()
+        start_time = time.perf_counter()
+        profile.enable()
+
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.timings[name] = self.timings.get(name, 0) + time.perf_counter() - start_time
+            self.profiles.setdefault(name, []).append(profile)
+
+    def describe_dataset(self, df, **kwargs):
+        if not self.enabled:
+            return
+
+        self.metadata.update({
+            'items': len(df.index),
+            'columns': len(df.columns),
+            'memory_bytes': int(df.memory_usage(deep=True).sum()),
+            **kwargs,
+        })
+
+    def artefacts(self) -> dict:
+        """File name to contents, binary pstats dumps are loadable with pstats or snakeviz."""
+        files = {}
+
+        for name, profiles in self.profiles.items():
+            # тот же формат, что пишет pstats.Stats.dump_stats
+            files[f'{name}.prof'] = marshal.dumps(pstats.Stats(*profiles).stats)
+
+            summary = io.StringIO()
+            pstats.Stats(*profiles, stream=summary).sort_stats('cumulative').print_stats(40)
+            files[f'{name}.txt'] = summary.getvalue().encode('utf-8')
+
+        files['meta.json'] = json.dumps({
+            'job_id': self.job_id,
+            'created_at': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'timings': self.timings,
+            'dataset': self.metadata,
+        }, indent=2, ensure_ascii=False).encode('utf-8')
+
+        return files
+
+    def save(self):
+        if not self.enabled or not self.profiles:
+            return None
+
+        try:
+            prefix = profile_prefix(self.job_id)
+            files = self.artefacts()
+
+            if env('PROFILING_STORAGE', cast=str, default='local') == 's3':
+                return save_to_s3(prefix, files)
+
+            return save_to_disk(prefix, files)
+        except Exception as exception_info:
+            logger.error(f'Profile of job {self.job_id} was not saved: {str(exception_info)}')
+
+
+def profile_prefix(job_id: str) -> str:
+    return 'profiles/' + str(job_id).replace('/', '-')
+
+
+def save_to_disk(prefix: str, files: dict) -> str:
+    path = os.path.join(env('PROFILING_DIR', cast=str, default='/tmp'), prefix)
+    os.makedirs(path, exist_ok=True)
+
+    for name, content in files.items():
+        with open(os.path.join(path, name), 'wb') as file:
+            file.write(content)
+
+    logger.info(f'Profile saved to {path}')
+
+    return path
+
+
+def save_to_s3(prefix: str, files: dict) -> str:
+    import boto3
+
+    bucket = env('PROFILING_S3_BUCKET', cast=str, default=env('AWS_S3_BUCKET_NAME', cast=str, default=''))
+    s3 = boto3.client('s3')
+
+    for name, content in files.items():
+        s3.put_object(Bucket=bucket, Key=f'{prefix}/{name}', Body=content)
+
+    logger.info(f'Profile saved to s3://{bucket}/{prefix}')
+
+    return f's3://{bucket}/{prefix}'
@@ -0,0 +1,230 @@
+import io
+import logging
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from envparse import env
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from .assets import asset_url_fetcher, prefetch_images, report_image_urls
+from .viewmodels.base import BaseListViewModel, BaseViewModel
+
+logger = logging.getLogger(__name__)
+
+base_path = os.path.dirname(os.path.abspath(__file__)) + '/templates/pdf/report/'
+
+_environment = None
+_executors = {}
+_executors_lock = threading.Lock()
+_fonts = None
+
+
+def get_template_environment() -> Environment:
+    """Environment is shared within the process, so compiled templates are cached between reports."""
+    global _environment
+
+    if _environment is None:
+        _environment = Environment(
+            loader=FileSystemLoader(base_path),
+            autoescape=select_autoescape(['html', 'xml']),
+        )
+
+    return _environment
+
+
+def render_report_html(report_dict: dict, template_name: str = '_index.j2') -> str:
+    return get_template_environment().get_template(template_name).render(report_dict)
+
+
+def get_fonts() -> tuple:
+    """Font configuration with the report font faces registered once per process, not on every render."""
+    global _fonts
+
+    if _fonts is None:
+        from weasyprint import CSS
+        from weasyprint.fonts import FontConfiguration
+
+        font_config = FontConfiguration()
+        stylesheet = CSS(filename=base_path + 'css/fonts.css', font_config=font_config, url_fetcher=asset_url_fetcher)
+        _fonts = (font_config, [stylesheet])
+
+    return _fonts
+
+
+def layout_report(html: str):
+    from weasyprint import HTML
+
+    font_config, stylesheets = get_fonts()
+
+    return HTML(string=html, base_url=base_path, url_fetcher=asset_url_fetcher).render(
+        stylesheets=stylesheets,
+        font_config=font_config,
+    )
+
+
+def render_report_pdf(html: str, target):
+    prefetch_images(report_image_urls(html))
+    layout_report(html).write_pdf(target=target)
+
+
+def plain_report(value):
+    """Report dict without view-model internals, so it could be stored and rendered again later."""
+    if isinstance(value, (BaseViewModel, BaseListViewModel)):
+        return plain_report(value.to_dict())
+
+    if isinstance(value, dict):
+        return {
+            key: plain_report(item)
+            for key, item in value.items()
+            if not key.startswith('_') and not callable(item) and key != 'stats'
+        }
+
+    if isinstance(value, (list, tuple)):
+        return [plain_report(item) for item in value]
+
+    return value
+
+
+def render_report_web_html(report_dict: dict) -> str:
+    """Same pages for the browser, styles and icons are served by the web app."""
+    asset_base_url = env('REPORT_ASSETS_URL', cast=str, default=env('WILDSEARCH_WEBHOOKS_DOMAIN', cast=str, default='') + '/report/')
+
+    return render_report_html({**report_dict, 'asset_base_url': asset_base_url})
+
+
+def render_report_card_png(report_dict: dict, target):
+    layout_report(render_report_html(report_dict, template_name='_card.j2')).write_png(target=target)
+
+
+def report_pages(template_name: str = '_index.j2') -> list:
+    """Page templates included by the index, so the list of enabled pages is kept in one place."""
+    environment = get_template_environment()
+    source, _, _ = environment.loader.get_source(environment, template_name)
+    source = re.sub(r'{#.*?#}', '', source, flags=re.DOTALL)
+
+    return re.findall(r"{%\s*include\s+'(\d+_\w+\.j2)'\s*%}", source)
+
+
+def split_pages(pages: list, groups: int) -> list:
+    """Contiguous groups of nearly equal size, so the merged document keeps the page order."""
+    groups = max(1, min(groups, len(pages)))
+    size, rest = divmod(len(pages), groups)
+    result = []
+    start = 0
+
+    for index in range(groups):
+        end = start + size + (1 if index < rest else 0)
+        result.append(pages[start:end])
+        start = end
+
+    return result
+
+
+def render_report_page_groups(report_dict: dict, groups: int = 1) -> list:
+    if groups <= 1:
+        return [render_report_html(report_dict)]
+
+    template = get_template_environment().get_template('_pages.j2')
+
+    return [template.render(report_dict, pages=pages) for pages in split_pages(report_pages(), groups)]
+
+
+def render_pdf_part(html: str) -> tuple:
+    """Lays out one group of pages, returns PDF bytes and bookmarks as (level, label, page number) tuples."""
+    document = layout_report(html)
+    bookmarks = [
+        (level, label, page_number)
+        for page_number, page in enumerate(document.pages)
+        for level, label, _, _ in page.bookmarks
+    ]
+
+    return document.write_pdf(), bookmarks
+
+
+def merge_pdf_parts(parts: list, target, title: str = None):
+    """Merges PDF parts in order and restores the bookmarks hierarchy across them, fonts stay embedded in every part."""
+    from PyPDF2 import PdfFileReader, PdfFileWriter
+
+    writer = PdfFileWriter()
+    parents = []
+
+    for content, bookmarks in parts:
+        offset = writer.getNumPages()
+        reader = PdfFileReader(io.BytesIO(content))
+
+        for page_number in range(reader.getNumPages()):
+            writer.addPage(reader.getPage(page_number))
+
+        for level, label, page_number in bookmarks:
+            while parents and parents[-1][0] >= level:
+                parents.pop()
+
+            parent = parents[-1][1] if parents else None
+            parents.append((level, writer.addBookmark(label, offset + page_number, parent=parent)))
+
+    if title is not None:
+        writer.addMetadata({'/Title': title})
+
+    if isinstance(target, str):
+        with open(target, 'wb') as file:
+            writer.write(file)
+    else:
+        writer.write(target)
+
+
+def get_executor(workers: int) -> ProcessPoolExecutor:
+    """One pool per size, shared by all threads of the worker and created on the first report."""
+    with _executors_lock:
+        if workers not in _executors:
+            # spawn, а не fork: воркер тяжелой очереди многопоточный, а форк копирует чужие захваченные блокировки
+            _executors[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+        return _executors[workers]
+
+
+def reset_executor(workers: int):
+    with _executors_lock:
+        executor = _executors.pop(workers, None)
+
+    if executor is not None:
+        executor.shutdown(wait=False)
+
+
+def can_start_processes() -> bool:
+    # дочерние процессы prefork-пула Celery демонические, и свои процессы запускать им нельзя
+    return not multiprocessing.current_process().daemon
+
+
+def report_render_workers() -> int:
+    """Page groups are rendered in parallel only where worker processes can be started, otherwise the report is laid out at once."""
+    workers = env('REPORT_RENDER_WORKERS', cast=int, default=1)
+
+    return workers if can_start_processes() else 1
+
+
+def render_report_pdf_parallel(htmls: list, target, workers: int = None):
+    """Pages groups are laid out in worker processes, so the render time is bounded by the slowest group."""
+    workers = workers or report_render_workers()
+
+    if len(htmls) == 1:
+        render_report_pdf(htmls[0], target=target)
+        return
+
+    # картинки качаем один раз в общий дисковый кеш, а не в каждом процессе верстки
+    prefetch_images(report_image_urls(''.join(htmls)))
+
+    if workers <= 1 or not can_start_processes():
+        parts = [render_pdf_part(html) for html in htmls]
+    else:
+        try:
+            parts = list(get_executor(workers).map(render_pdf_part, htmls))
+        except (BrokenProcessPool, OSError) as exception_info:
+            logger.warning(f'Parallel report rendering failed, rendering sequentially: {str(exception_info)}')
+            reset_executor(workers)
+            parts = [render_pdf_part(html) for html in htmls]
+
+    merge_pdf_parts(parts, target, title='Отчет')
@@ -0,0 +1,50 @@
+import datetime
+
+import msgpack
+import numpy as np
+from kombu.serialization import register
+
+content_type = 'application/x-wildsearch-msgpack'
+
+# коды расширений msgpack для типов, которых нет в самом формате
+DATETIME = 1
+DATE = 2
+
+
+def default(value):
+    if isinstance(value, datetime.datetime):
+        return msgpack.ExtType(DATETIME, value.isoformat().encode())
+
+    if isinstance(value, datetime.date):
+        return msgpack.ExtType(DATE, value.isoformat().encode())
+
+    if isinstance(value, np.integer):
+        return int(value)
+
+    if isinstance(value, np.floating):
+        return float(value)
+
+    raise TypeError(f'Object of type {type(value).__name__} can not be sent to a task, pass it through the storage')
+
+
+def ext_hook(code: int, data: bytes):
+    if code == DATETIME:
+        return datetime.datetime.fromisoformat(data.decode())
+
+    if code == DATE:
+        return datetime.date.fromisoformat(data.decode())
+
+    return msgpack.ExtType(code, data)
+
+
+def dumps(value) -> bytes:
+    """Bytes stay binary, datetimes and dates are restored with their types, anything else must be a plain value."""
+    return msgpack.packb(value, default=default, use_bin_type=True)
+
+
+def loads(data: bytes):
+    return msgpack.unpackb(data, ext_hook=ext_hook, raw=False, strict_map_key=False)
+
+
+def register_serializer(name: str = 'wildsearch'):
+    register(name, dumps, loads, content_type=content_type, content_encoding='binary')
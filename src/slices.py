@@ -0,0 +1,121 @@
+import copy
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from seller_stats.category_stats import get_distribution_thresholds
+
+from .storage import load_category_stats
+from .viewmodels.distributions import bin_codes
+
+dimensions = {
+    'brand': 'бренд',
+    'price': 'цена',
+    'country': 'страна',
+    'rating': 'рейтинг',
+}
+
+# в callback_data кнопки Telegram помещается только 64 байта, поэтому срез записываем однобуквенными ключами
+short_keys = {dimension[0]: dimension for dimension in dimensions}
+
+
+class InvertedIndex:
+    """Row positions of every value of one column, stored as a single sorted array with offsets."""
+
+    def __init__(self, codes: np.ndarray, labels: list):
+        # строки без значения (-1) в индекс не попадают
+        indexed = np.flatnonzero(codes >= 0)
+
+        self.labels = labels
+        self.counts = np.bincount(codes[indexed], minlength=len(labels))
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)])
+        self.positions = indexed[np.argsort(codes[indexed], kind='stable')]
+
+    def lookup(self, code: int) -> np.ndarray:
+        return self.positions[self.offsets[code]:self.offsets[code + 1]]
+
+
+def factorized_index(series: pd.Series) -> InvertedIndex:
+    codes, uniques = pd.factorize(series, sort=True)
+
+    return InvertedIndex(codes, [str(value) for value in uniques])
+
+
+class CategoryIndex:
+    """Brand, price band, country and rating indexes over the stored dataset of the category."""
+
+    def __init__(self, stats):
+        self.stats = stats
+        df = stats.df
+
+        thresholds, price_labels = get_distribution_thresholds(df.price)
+        ratings = df.rating.fillna(0).to_numpy(dtype=float)
+
+        self.indexes = {
+            'brand': factorized_index(df.brand_name),
+            'price': InvertedIndex(bin_codes(df.price.to_numpy(dtype=float), thresholds), [f'{label} руб.' for label in price_labels]),
+            'country': factorized_index(df.manufacture_country),
+            'rating': InvertedIndex(np.where(np.isin(ratings, range(6)), ratings, -1).astype(int), ['без рейтинга', '1', '2', '3', '4', '5']),
+        }
+
+    def options(self, dimension: str, limit: int = None) -> list:
+        """Codes and labels of the non-empty values, the biggest first."""
+        index = self.indexes[dimension]
+        codes = np.flatnonzero(index.counts)
+
+        if dimension in ['brand', 'country']:
+            codes = codes[np.argsort(-index.counts[codes], kind='stable')]
+        elif dimension == 'rating':
+            codes = codes[::-1]
+
+        return [(int(code), index.labels[code]) for code in codes[:limit]]
+
+    def positions(self, filters: dict) -> np.ndarray:
+        lookups = sorted((self.indexes[dimension].lookup(code) for dimension, code in filters.items()), key=len)
+        positions = lookups[0]
+
+        for lookup in lookups[1:]:
+            positions = np.intersect1d(positions, lookup, assume_unique=True)
+
+        return np.sort(positions)
+
+    def title(self, filters: dict) -> str:
+        return ', '.join(f'{dimensions[dimension]} {self.indexes[dimension].labels[code]}' for dimension, code in filters.items())
+
+    def select(self, filters: dict):
+        """Same stats object with only the matching items, None for an empty slice."""
+        positions = self.positions(filters)
+
+        if not len(positions):
+            return None
+
+        stats = copy.copy(self.stats)
+        stats.df = self.stats.df.iloc[positions].reset_index(drop=True)
+
+        return stats
+
+
+def parse_filters(value: str) -> dict:
+    """Reads both the short form b12,p1 and the long form brand=12,price=1 of the buttons sent earlier."""
+    filters = {}
+
+    for item in filter(None, value.split(',')):
+        if '=' in item:
+            dimension, code = item.split('=')
+        else:
+            dimension, code = short_keys.get(item[0]), item[1:]
+
+        if dimension in dimensions:
+            filters[dimension] = int(code)
+
+    return filters
+
+
+def format_filters(filters: dict) -> str:
+    return ','.join(f'{dimension[0]}{code}' for dimension, code in filters.items())
+
+
+@lru_cache(maxsize=4)
+def get_category_index(job_id: str) -> CategoryIndex:
+    """Index is built once per process for the latest categories, so drill-down clicks do not reload the dataset."""
+    return CategoryIndex(load_category_stats(job_id))
@@ -0,0 +1,141 @@
+import logging
+
+import numpy as np
+import pandas as pd
+from peewee import chunked
+
+from .helpers import normalize_category_url
+from .models import CategoryItemState, CategorySnapshot, CategorySnapshotDelta, get_last_category_snapshot
+
+logger = logging.getLogger(__name__)
+
+state_fields = ['price', 'purchases', 'turnover']
+
+
+def prepare_category_state(df: pd.DataFrame) -> pd.DataFrame:
+    """Leave only fields we are tracking between snapshots, one row per SKU."""
+    state = df.loc[:, ['id'] + state_fields].copy()
+    state['id'] = state['id'].astype(str)
+    state[state_fields] = state[state_fields].astype(float).fillna(0)
+
+    return state.drop_duplicates(subset='id', keep='first')
+
+
+def calc_category_diff(previous: pd.DataFrame, current: pd.DataFrame) -> pd.DataFrame:
+    """Join two category states on SKU id and return only added, removed and changed SKUs."""
+    df = previous.merge(current, on='id', how='outer', suffixes=('_old', '_new'), indicator=True)
+
+    for field in state_fields:
+        df[f'{field}_old'] = df[f'{field}_old'].fillna(0)
+        df[f'{field}_new'] = df[f'{field}_new'].fillna(0)
+        df[f'{field}_delta'] = df[f'{field}_new'] - df[f'{field}_old']
+
+    changed_mask = np.zeros(len(df.index), dtype=bool)
+    for field in state_fields:
+        changed_mask |= ~np.isclose(df[f'{field}_old'], df[f'{field}_new'])
+
+    df['change'] = np.select(
+        [df['_merge'] == 'right_only', df['_merge'] == 'left_only', changed_mask],
+        ['added', 'removed', 'changed'],
+        default='',
+    )
+
+    df = df[df['change'] != '']
+
+    diff = pd.DataFrame({
+        'item_id': df['id'],
+        'change': df['change'],
+        'price': df['price_new'],
+        'purchases': df['purchases_new'],
+        'turnover': df['turnover_new'],
+        'price_delta': df['price_delta'],
+        'purchases_delta': df['purchases_delta'],
+        'turnover_delta': df['turnover_delta'],
+    })
+
+    return diff.reset_index(drop=True)
+
+
+def load_category_state(category_url: str) -> pd.DataFrame:
+    rows = CategoryItemState.select(
+        CategoryItemState.item_id.alias('id'),
+        CategoryItemState.price,
+        CategoryItemState.purchases,
+        CategoryItemState.turnover,
+    ).where(CategoryItemState.category_url == category_url).dicts()
+
+    return pd.DataFrame(list(rows), columns=['id'] + state_fields)
+
+
+def record_category_snapshot(stats, job_id: str = None) -> CategorySnapshot:
+    """Compare fresh crawl with the last known state of the category and store only the difference."""
+    category_url = normalize_category_url(stats.category_url())
+
+    previous_snapshot = get_last_category_snapshot(category_url)
+    diff = calc_category_diff(load_category_state(category_url), prepare_category_state(stats.df))
+
+    added = diff[diff.change == 'added']
+    removed = diff[diff.change == 'removed']
+    changed = diff[diff.change == 'changed']
+
+    # агрегаты считаем от предыдущего снимка, чтобы не пересчитывать всю историю
+    snapshot = CategorySnapshot(
+        category_url=category_url,
+        job_id=job_id,
+        items_count=(previous_snapshot.items_count if previous_snapshot else 0) + len(added.index) - len(removed.index),
+        purchases=(previous_snapshot.purchases if previous_snapshot else 0) + float(diff.purchases_delta.sum()),
+        turnover=(previous_snapshot.turnover if previous_snapshot else 0) + float(diff.turnover_delta.sum()),
+        added_count=len(added.index),
+        removed_count=len(removed.index),
+        changed_count=len(changed.index),
+        purchases_delta=float(diff.purchases_delta.sum()),
+        turnover_delta=float(diff.turnover_delta.sum()),
+    )
+
+    with CategorySnapshot._meta.database.atomic():
+        snapshot.save()
+
+        # у первого снимка все товары новые, их и так хранит состояние категории, поэтому изменения не пишем
+        deltas = diff.to_dict('records') if previous_snapshot is not None else []
+        for delta in deltas:
+            delta['snapshot'] = snapshot.id
+
+        for batch in chunked(deltas, 100):
+            CategorySnapshotDelta.insert_many(batch).execute()
+
+        if len(removed.index) > 0:
+            for batch in chunked(removed.item_id.tolist(), 500):
+                CategoryItemState.delete().where(
+                    CategoryItemState.category_url == category_url,
+                    CategoryItemState.item_id.in_(batch),
+                ).execute()
+
+        upserted = [{
+            'category_url': category_url,
+            'item_id': row['item_id'],
+            'price': row['price'],
+            'purchases': row['purchases'],
+            'turnover': row['turnover'],
+        } for row in diff[diff.change != 'removed'].to_dict('records')]
+
+        for batch in chunked(upserted, 100):
+            CategoryItemState.insert_many(batch).on_conflict(
+                conflict_target=[CategoryItemState.category_url, CategoryItemState.item_id],
+                preserve=[CategoryItemState.price, CategoryItemState.purchases, CategoryItemState.turnover],
+            ).execute()
+
+    logger.info(f'Snapshot for {category_url} saved: {snapshot.added_count} added, {snapshot.removed_count} removed, {snapshot.changed_count} changed')
+
+    return snapshot
+
+
+def get_category_changes(snapshot: CategorySnapshot, change: str = None, order_by: str = 'turnover_delta', limit: int = 5) -> pd.DataFrame:
+    """Biggest changes of the snapshot, read straight from the stored deltas."""
+    query = CategorySnapshotDelta.select().where(CategorySnapshotDelta.snapshot == snapshot)
+
+    if change is not None:
+        query = query.where(CategorySnapshotDelta.change == change)
+
+    query = query.order_by(getattr(CategorySnapshotDelta, order_by).desc()).limit(limit)
+
+    return pd.DataFrame(list(query.dicts()))
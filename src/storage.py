@@ -0,0 +1,115 @@
+import gzip
+import logging
+
+import pandas as pd
+from botocore.exceptions import ClientError
+from envparse import env
+from seller_stats.category_stats import CategoryStats
+
+from . import serializers
+from .helpers import s3
+
+logger = logging.getLogger(__name__)
+
+
+def bucket_name() -> str:
+    return env('AWS_S3_BUCKET_NAME', cast=str)
+
+
+def job_key(job_id: str, name: str) -> str:
+    return 'reports/' + str(job_id).replace('/', '-') + '/' + name
+
+
+def put_object(key: str, body: bytes, content_type: str = 'application/octet-stream'):
+    s3.put_object(Bucket=bucket_name(), Key=key, Body=body, ContentType=content_type)
+
+
+def get_object(key: str) -> bytes:
+    return s3.get_object(Bucket=bucket_name(), Key=key)['Body'].read()
+
+
+def public_url(key: str) -> str:
+    return s3.generate_presigned_url(
+        'get_object',
+        Params={'Bucket': bucket_name(), 'Key': key},
+        ExpiresIn=env('REPORT_LINK_TTL', cast=int, default=7 * 24 * 60 * 60),
+    )
+
+
+def set_reports_expiration(days: int) -> bool:
+    """Stored reports and datasets are removed by S3 itself, other lifecycle rules of the bucket are kept.
+
+    Returns False when the bucket already has the same rule and nothing was changed.
+    """
+    rule = {
+        'ID': 'reports-expiration',
+        'Filter': {'Prefix': 'reports/'},
+        'Status': 'Enabled',
+        'Expiration': {'Days': days},
+    }
+
+    try:
+        rules = s3.get_bucket_lifecycle_configuration(Bucket=bucket_name())['Rules']
+    except ClientError as exception_info:
+        if exception_info.response['Error']['Code'] != 'NoSuchLifecycleConfiguration':
+            raise
+        rules = []
+
+    # конфигурация перезаписывается целиком, поэтому при каждой выкладке трогаем ее, только если правило изменилось
+    if rule in rules:
+        return False
+
+    rules = [item for item in rules if item.get('ID') != rule['ID']] + [rule]
+    s3.put_bucket_lifecycle_configuration(Bucket=bucket_name(), LifecycleConfiguration={'Rules': rules})
+
+    return True
+
+
+def save_job_object(job_id: str, name: str, value) -> bool:
+    """Plain values only: dicts, lists, strings, numbers and dates, nothing is unpickled from the storage."""
+    try:
+        put_object(job_key(job_id, name), serializers.dumps(value), content_type=serializers.content_type)
+    except Exception as exception_info:
+        logger.error(f'{name} of job {job_id} was not saved: {str(exception_info)}')
+        return False
+
+    return True
+
+
+def load_job_object(job_id: str, name: str):
+    return serializers.loads(get_object(job_key(job_id, name)))
+
+
+def save_report_context(job_id: str, context: dict) -> bool:
+    """View-model of the report is kept so other formats could be rendered later without loading the category again."""
+    return save_job_object(job_id, 'report.msgpack', context)
+
+
+def load_report_context(job_id: str) -> dict:
+    return load_job_object(job_id, 'report.msgpack')
+
+
+def save_report_card(job_id: str, card: dict) -> bool:
+    return save_job_object(job_id, 'card.msgpack', card)
+
+
+def load_report_card(job_id: str) -> dict:
+    return load_job_object(job_id, 'card.msgpack')
+
+
+def save_category_stats(job_id: str, data: list) -> bool:
+    """Items of the category as loaded from the crawler, column by column, stats are calculated again on load."""
+    try:
+        columns = pd.DataFrame(data=data).to_dict(orient='list')
+        put_object(job_key(job_id, 'dataset.msgpack.gz'), gzip.compress(serializers.dumps(columns)), content_type='application/gzip')
+    except Exception as exception_info:
+        logger.error(f'Dataset of job {job_id} was not saved: {str(exception_info)}')
+        return False
+
+    return True
+
+
+def load_category_stats(job_id: str) -> CategoryStats:
+    columns = serializers.loads(gzip.decompress(get_object(job_key(job_id, 'dataset.msgpack.gz'))))
+
+    return CategoryStats(data=pd.DataFrame(data=columns))
@@ -5,40 +5,151 @@ import tempfile
 import time
 
 import boto3
-import pandas as pd
 from airtable import Airtable
 from celery import Celery
+from celery.schedules import crontab
+from celery.signals import before_task_publish, task_postrun, task_prerun
 from envparse import env
+from kombu import Queue
+from peewee import chunked
 from seller_stats.category_stats import CategoryStats, calc_sales_distribution
 from seller_stats.exceptions import BadDataSet, NotReady
 from seller_stats.utils.formatters import format_currency as fcur
 from seller_stats.utils.formatters import format_number as fnum
 from seller_stats.utils.formatters import format_quantity as fquan
 from seller_stats.utils.loaders import ScrapinghubLoader
-from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
-
-from .helpers import AmplitudeLogger, category_export, detect_mp_by_job_id
-from .models import LogCommandItem, get_subscribed_to_wb_categories_updates, user_get_by_chat_id
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.utils.helpers import escape_markdown
+
+from . import metrics
+from .helpers import (AmplitudeLogger, category_export, detect_mp_by_job_id, get_scrapinghub_client,
+                      normalize_category_url)
+from .exports import export_formats, write_csv, write_parquet, write_xlsx
+from .marketplaces import detect_marketplace_by_url
+from .models import (CategoryJob, CrmSyncItem, LogCommandItem, User, get_category_job, get_category_neighbours,
+                     get_last_category_snapshot, get_recent_category_job, get_subscribed_to_wb_categories_updates,
+                     get_users_to_sync_with_crm, get_watched_categories, pop_due_notifications, save_category_aggregate,
+                     schedule_notification, user_get_by_chat_id)
+from .profiling import JobProfiler, profiling_enabled, profiling_requested
+from .reports import (plain_report, render_report_card_png, render_report_page_groups, render_report_pdf_parallel,
+                      render_report_web_html, report_render_workers)
+from .serializers import register_serializer
+from .slices import dimensions as slice_dimensions
+from .slices import format_filters, get_category_index, parse_filters
+from .snapshots import get_category_changes, record_category_snapshot
+from .storage import (job_key, load_category_stats, load_report_card, load_report_context, public_url, put_object,
+                      save_category_stats, save_report_card, save_report_context)
+from .transport import get_bot, mount_adapter
 
 env.read_envfile()
 
+# у каждой очереди свой пул воркеров: тяжелый отчет или пачка событий аналитики не задерживают ответы в чат,
+# а внутри очереди задачи, которых ждет пользователь, идут раньше фоновых (в Redis 0 — наивысший приоритет)
+task_routes = {
+    '*.calculate_category_stats': {'queue': 'heavy', 'priority': 3},
+    '*.send_category_report': {'queue': 'heavy', 'priority': 0},
+    '*.send_category_slice': {'queue': 'heavy', 'priority': 0},
+    '*.calculate_category_digest': {'queue': 'heavy', 'priority': 9},
+    '*.send_category_card': {'queue': 'heavy', 'priority': 0},
+    '*.send_digest_message': {'queue': 'interactive', 'priority': 9},
+    '*.check_requests_count_recovered': {'queue': 'interactive', 'priority': 9},
+    '*.track_amplitude': {'queue': 'analytics'},
+    '*.sync_users_to_crm': {'queue': 'analytics'},
+    '*.schedule_categories_digest': {'queue': 'analytics'},
+    '*.export_category_digest': {'queue': 'analytics'},
+}
+
+register_serializer('wildsearch')
+
 celery = Celery('tasks')
 celery.conf.update(
     broker_url=env('REDIS_URL'),
     task_always_eager=env('CELERY_ALWAYS_EAGER', cast=bool, default=False),
-    task_serializer='pickle',  # we transfer binary data like photos or voice messages,
-    accept_content=['pickle'],
+    # в задачи передаются только простые значения, все крупное идет через хранилище по ссылке
+    task_serializer='wildsearch',
+    result_serializer='wildsearch',
+    # pickle нужен только на время выкладки, пока в очереди остаются старые сообщения
+    accept_content=['wildsearch'] + (['pickle'] if env('CELERY_ACCEPT_PICKLE', cast=bool, default=False) else []),
     redis_max_connections=env('CELERY_REDIS_MAX_CONNECTIONS', default=None),
-    broker_transport_options={'visibility_timeout': 3600 * 48},
+    # длинных отсрочек в брокере больше нет, таймаут нужен только на самые долгие отчеты
+    broker_transport_options={'visibility_timeout': env('CELERY_VISIBILITY_TIMEOUT', cast=int, default=3600 * 2)},
     timezone=env('TIME_ZONE', cast=str, default='Europe/Moscow'),
+    task_queues=[Queue('interactive'), Queue('analytics'), Queue('heavy')],
+    task_default_queue='interactive',
+    task_default_priority=0,
+    task_routes=task_routes,
 )
 
 # включаем логи
 logger = logging.getLogger(__name__)
 
-bot = Bot(env('TELEGRAM_API_TOKEN'))
+bot = get_bot()
 s3 = boto3.client('s3')
 
+# формат отчета: заголовок сообщения и подпись кнопки
+report_formats = {
+    'pdf': ('PDF-отчет', '📑 PDF'),
+    'html': ('веб-отчет', '🌐 Веб-версия'),
+    'png': ('отчет-карточка', '🖼 Карточка'),
+}
+
+# выгрузка данных категории: заголовок сообщения и подпись кнопки
+data_formats = {
+    'xlsx': ('файл Excel', '📊 Excel'),
+    'csv': ('файл CSV', '🧾 CSV'),
+    'parquet': ('файл Parquet', '🗄 Parquet'),
+}
+
+
+@before_task_publish.connect
+def mark_task_published(headers=None, **kwargs):
+    if headers is not None:
+        headers['published_at'] = time.time()
+
+
+_tasks_started_at = {}
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, task=None, **kwargs):
+    queue_wait = metrics.task_queue_wait(task.request)
+    if queue_wait is not None:
+        metrics.observe('celery.queue_wait', queue_wait, task=task.name)
+
+    _tasks_started_at[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def stop_task_timer(task_id=None, task=None, state=None, **kwargs):
+    started_at = _tasks_started_at.pop(task_id, None)
+    if started_at is not None:
+        metrics.observe('celery.run', time.perf_counter() - started_at, task=task.name, state=state)
+
+
+@celery.on_after_configure.connect
+def setup_periodic_tasks(sender, **kwargs):
+    sender.add_periodic_task(
+        crontab(
+            minute=0,
+            hour=env('SETTINGS_DIGEST_HOUR', cast=int, default=10),
+            day_of_week=env('SETTINGS_DIGEST_DAY_OF_WEEK', cast=str, default='*'),
+        ),
+        schedule_categories_digest.s(),
+        name='categories digest',
+    )
+
+    sender.add_periodic_task(
+        env('SETTINGS_NOTIFICATIONS_INTERVAL', cast=int, default=60),
+        send_due_notifications.s(),
+        name='due notifications',
+    )
+
+    sender.add_periodic_task(
+        env('SETTINGS_CRM_SYNC_INTERVAL', cast=int, default=60),
+        sync_users_to_crm.s(),
+        name='CRM sync',
+    )
+
 
 def get_cat_update_users():
     users = get_subscribed_to_wb_categories_updates()
@@ -46,46 +157,297 @@ def get_cat_update_users():
 
 
 @celery.task(bind=True, default_retry_delay=10, max_retries=6)
-def calculate_category_stats(self, job_id, chat_id):
-    user = user_get_by_chat_id(chat_id=chat_id)
+def calculate_category_stats(self, job_id, chat_id=None, profile=False):
+    """Without chat_id the result goes to every user waiting for the job in the registry."""
+    from .viewmodels.report import Report
+
+    job = get_category_job(job_id)
+    chat_ids = [int(chat_id)] if chat_id is not None else (job.chat_ids() if job is not None else [])
+
+    if not chat_ids:
+        logger.error(f'Job {job_id} has no recipients')
+        return
+
+    user = user_get_by_chat_id(chat_id=chat_ids[0])
     slug, marketplace, transformer = detect_mp_by_job_id(job_id=job_id)
+    profiler = JobProfiler(job_id, enabled=profile or profiling_enabled())
     data = []
 
     try:
-        data = ScrapinghubLoader(job_id=job_id, transformer=transformer).load()
+        with metrics.timer('scrapinghub.load', marketplace=slug), profiler.stage('load'):
+            data = ScrapinghubLoader(job_id=job_id, client=get_scrapinghub_client(), transformer=transformer).load()
     except NotReady:
         logger.error(f'Job {job_id} is not finished yet, placing new task')
         self.retry(countdown=10)
 
     try:
-        stats = CategoryStats(data=data)
+        with metrics.timer('report.stats'), profiler.stage('stats'):
+            stats = CategoryStats(data=data)
     except BadDataSet:
-        bot.send_message(chat_id=chat_id, text='❌ Мы не смогли обработать ссылку. Скорее всего, вы указали неправильную страницу, либо категория оказалась пустой.',
-                         parse_mode='Markdown', disable_web_page_preview=True)
+        for chat_id in chat_ids:
+            try:
+                bot.send_message(chat_id=chat_id, text='❌ Мы не смогли обработать ссылку. Скорее всего, вы указали неправильную страницу, либо категория оказалась пустой.',
+                                 parse_mode='Markdown', disable_web_page_preview=True)
+            except Exception as exception_info:
+                logger.error(f'Message was not sent to chat #{chat_id}: {str(exception_info)}')
+
+        if job is not None:
+            job.set_state('failed')
+
         logger.error(f'Job {job_id} returned empty category')
         return
 
-    message = generate_category_stats_message(stats=stats)
-    bot.send_message(chat_id=chat_id, text=message, parse_mode='Markdown', disable_web_page_preview=True)
+    if job is not None and job.state != 'analysed':
+        mark_category_job_analysed(job, items_count=len(stats.df.index), marketplace=slug)
+
+    # пока выгрузка не отмечена проанализированной, к ней могли присоединиться еще пользователи,
+    # а кто пришел позже — получит отчет отдельным запуском по уже готовой выгрузке
+    if chat_id is None:
+        chat_ids = job.chat_ids(joined_before=job.analysed_at)
+
+    profiler.describe_dataset(stats.df, marketplace=slug, category_url=stats.category_url())
+
+    report_format = default_report_format()
+    name = f'{stats.category_name()} на {marketplace}'
 
-    # export_file = generate_category_stats_export_file(stats)
-    export_file = generate_category_stats_report_file(stats, username=user.user_name)
+    # сводка считается по самому датасету и уходит сразу, не дожидаясь отчета
+    with profiler.stage('message'):
+        message = generate_category_stats_message(stats=stats, report_format=report_format)
+        summaries = {}
 
-    filename, file_extension = os.path.splitext(export_file.name)
+        for chat_id in chat_ids:
+            try:
+                summaries[chat_id] = bot.send_message(chat_id=chat_id, text=message, parse_mode='Markdown', disable_web_page_preview=True)
+            except Exception as exception_info:
+                logger.error(f'Summary was not sent to chat #{chat_id}: {str(exception_info)}')
 
+    # кто заблокировал бота или удалил аккаунт, дальше не участвует, а остальные получают отчет как обычно
+    chat_ids = list(summaries.keys())
+
+    # соседние разделы берутся из уже посчитанных агрегатов, без дополнительных выгрузок
+    neighbours = []
     try:
-        bot.send_document(
-            chat_id=chat_id,
-            document=export_file,
-            caption='Файл с отчетом',
-            filename=f'{stats.category_name()} на {marketplace}.{file_extension}',
-        )
+        neighbours = get_category_neighbours(stats.category_url(), limit=env('SETTINGS_NEIGHBOURS_COUNT', cast=int, default=5))
     except Exception as exception_info:
-        logger.error(f'Error while sending file: {str(exception_info)}')
-        pass
+        logger.error(f'Error while loading category neighbours: {str(exception_info)}')
+
+    report = Report(stats=stats, username=user.user_name, neighbours=neighbours)
+
+    if report_format != 'png':
+        with metrics.timer('report.viewmodel', stage='card'), profiler.stage('card'):
+            card = plain_report(report.to_card_dict())
+
+        # в брокер уходит только ссылка на карточку в хранилище, не сам view-model
+        if save_report_card(job_id, card):
+            send_category_card.delay(job_id, chat_ids, caption=name)
+        else:
+            send_category_card(job_id, chat_ids, caption=name, card=card)
+
+    with metrics.timer('report.viewmodel', stage='report'), profiler.stage('viewmodel'):
+        context = {'report': plain_report(report.to_dict()), 'name': name}
+
+    # общий отчет верстается один раз на всех получателей, поэтому без личного приветствия
+    if len(chat_ids) > 1:
+        context['report']['base_username'] = None
+
+    try:
+        save_category_aggregate(stats.category_url(), report.to_aggregate_dict())
+    except Exception as exception_info:
+        logger.error(f'Error while saving category aggregate: {str(exception_info)}')
+
+    # полный отчет верстается отдельной задачей, остальные форматы — позже по кнопкам из сохраненного отчета
+    if save_report_context(job_id, context):
+        send_category_report.delay(job_id, chat_ids, report_format, profile=profiler.enabled)
+
+        # датасет нужен только для выгрузки в таблицу и срезов, поэтому сохраняем его уже после постановки отчета,
+        # а кнопки таблиц показываем, только если он сохранился
+        with profiler.stage('dataset'):
+            with_data = save_category_stats(job_id, data)
+
+        for chat_id, summary in summaries.items():
+            try:
+                bot.edit_message_reply_markup(
+                    chat_id=chat_id,
+                    message_id=summary.message_id,
+                    reply_markup=report_formats_keyboard(job_id, exclude=report_format, with_data=with_data),
+                )
+            except Exception as exception_info:
+                logger.error(f'Report formats keyboard was not added: {str(exception_info)}')
+    else:
+        deliver_category_report(chat_ids, job_id=job_id, context=context, report_format=report_format, profiler=profiler)
+
+    # история изменений нужна только дайджесту, поэтому пишем ее, когда пользователи уже получили результат
+    try:
+        with profiler.stage('snapshot'):
+            record_category_snapshot(stats, job_id=job_id)
+    except Exception as exception_info:
+        logger.error(f'Error while saving category snapshot: {str(exception_info)}')
+
+    profiler.save()
+
+    for chat_id in chat_ids:
+        send_category_requests_count_message.delay(chat_id)
+        track_amplitude.delay(chat_id=chat_id, event=f'Received {slug} category analyses')
+
+
+@celery.task()
+def send_category_card(job_id, chat_ids: list, caption: str, card: dict = None):
+    try:
+        if card is None:
+            card = load_report_card(job_id)
+
+        send_report_card(chat_ids, card, caption=caption)
+    except Exception as exception_info:
+        logger.error(f'Error while sending report card: {str(exception_info)}')
 
-    send_category_requests_count_message.delay(chat_id)
-    track_amplitude.delay(chat_id=chat_id, event=f'Received {slug} category analyses')
+
+@celery.task()
+def send_category_report(job_id, chat_ids: list, report_format: str, profile=False):
+    """Report is rendered once and the same file goes to every recipient of the job."""
+    try:
+        context = load_report_context(job_id)
+    except Exception as exception_info:
+        logger.error(f'Report of job {job_id} was not loaded: {str(exception_info)}')
+
+        for chat_id in chat_ids:
+            bot.send_message(chat_id=chat_id, text='❌ Отчет больше недоступен. Отправьте ссылку на категорию еще раз, чтобы получить новый.')
+        return
+
+    # отчет по кнопке запрашивает один пользователь, ему возвращаем приветствие по имени
+    if len(chat_ids) == 1:
+        user = User.get_or_none(User.chat_id == chat_ids[0])
+        if user is not None:
+            context['report']['base_username'] = user.user_name
+
+    profiler = JobProfiler(f'{job_id}/{report_format}', enabled=profile)
+    deliver_category_report(chat_ids, job_id=job_id, context=context, report_format=report_format, profiler=profiler)
+    profiler.save()
+
+    for chat_id in chat_ids:
+        track_amplitude.delay(chat_id=chat_id, event=f'Received {report_format} report')
+
+
+def send_file_to_chats(chat_ids: list, send, field: str, file, **kwargs):
+    """File is uploaded to Telegram once, the rest of recipients get it by file_id."""
+    for chat_id in chat_ids:
+        try:
+            if hasattr(file, 'seek'):
+                file.seek(0)
+
+            message = send(chat_id=chat_id, **{field: file}, **kwargs)
+        except Exception as exception_info:
+            logger.error(f'File was not sent to chat #{chat_id}: {str(exception_info)}')
+            continue
+
+        attachment = message.document or (message.photo[-1] if message.photo else None)
+        if attachment is not None:
+            file = attachment.file_id
+
+
+def send_report_card(chat_ids: list, card: dict, caption: str, upload_format: str = 'card', profiler=None):
+    profiler = profiler or JobProfiler(job_id=None)
+
+    with tempfile.NamedTemporaryFile(suffix='.png', prefix='wb_category_', mode='w+b') as card_file:
+        with metrics.timer('report.render', stage='png'), profiler.stage('render_png'):
+            render_report_card_png(card, target=card_file)
+
+        with metrics.timer('report.upload', format=upload_format), profiler.stage('upload'):
+            send_file_to_chats(chat_ids, bot.send_photo, 'photo', card_file, caption=caption)
+
+
+@celery.task()
+def send_category_slice(job_id, chat_id: int, filters: str = ''):
+    """Drill-down into the stored dataset of the category, no new crawl is scheduled."""
+    try:
+        index = get_category_index(job_id)
+    except Exception as exception_info:
+        logger.error(f'Dataset of job {job_id} was not loaded: {str(exception_info)}')
+        bot.send_message(chat_id=chat_id, text='❌ Данные категории больше недоступны. Отправьте ссылку на категорию еще раз, чтобы получить новый отчет.')
+        return
+
+    filters = parse_filters(filters)
+
+    if not filters:
+        bot.send_message(chat_id=chat_id, text='🔎 Выберите, какую часть категории проанализировать:', reply_markup=category_slices_keyboard(job_id, index, filters))
+        return
+
+    with metrics.timer('report.slice'):
+        stats = index.select(filters)
+
+    if stats is None:
+        bot.send_message(chat_id=chat_id, text='🤷 В этом срезе нет товаров.')
+        return
+
+    user = user_get_by_chat_id(chat_id=chat_id)
+    report_format = default_report_format()
+    title = index.title(filters)
+
+    bot.send_message(
+        chat_id=chat_id,
+        text=f'🔎 Срез: {escape_markdown(title)}\n' + generate_category_stats_message(stats=stats, report_format=report_format),
+        parse_mode='Markdown',
+        disable_web_page_preview=True,
+        reply_markup=category_slices_keyboard(job_id, index, filters),
+    )
+
+    context = {
+        'report': generate_category_stats_report_dict(stats, username=user.user_name),
+        'name': f'{stats.category_name()}, {title}',
+    }
+    deliver_category_report([chat_id], job_id=f'{job_id}/{format_filters(filters)}', context=context, report_format=report_format)
+
+    track_amplitude.delay(chat_id=chat_id, event='Received category slice', event_properties={'dimensions': list(filters.keys())})
+
+
+def deliver_category_report(chat_ids: list, job_id, context: dict, report_format: str, profiler=None):
+    profiler = profiler or JobProfiler(job_id=None)
+
+    # верстка и отправка замеряются отдельно, иначе время верстки попадает в загрузку
+    try:
+        if report_format == 'html':
+            key = job_key(job_id, 'report.html')
+
+            with metrics.timer('report.render', stage='web'), profiler.stage('render_web'):
+                html = render_report_web_html(context['report']).encode('utf-8')
+
+            with metrics.timer('report.upload', format=report_format), profiler.stage('upload'):
+                put_object(key, html, content_type='text/html; charset=utf-8')
+
+                for chat_id in chat_ids:
+                    bot.send_message(
+                        chat_id=chat_id,
+                        text=f'🌐 Веб-отчет по категории «{context["name"]}» готов.',
+                        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton('Открыть отчет', url=public_url(key))]]),
+                    )
+        elif report_format == 'png':
+            send_report_card(chat_ids, context['report'], caption=context['name'], upload_format=report_format, profiler=profiler)
+        elif report_format in data_formats:
+            with profiler.stage('export'):
+                export_file = generate_category_stats_export_file(load_category_stats(job_id), export_format=report_format)
+
+            with metrics.timer('report.upload', format=report_format), profiler.stage('upload'):
+                send_file_to_chats(
+                    chat_ids,
+                    bot.send_document,
+                    'document',
+                    export_file,
+                    caption='Файл с данными категории',
+                    filename=f'{context["name"]}.{report_format}',
+                )
+        else:
+            export_file = generate_report_pdf_file(context['report'], profiler=profiler)
+
+            with metrics.timer('report.upload', format=report_format), profiler.stage('upload'):
+                send_file_to_chats(
+                    chat_ids,
+                    bot.send_document,
+                    'document',
+                    export_file,
+                    caption='Файл с отчетом',
+                    filename=f'{context["name"]}.pdf',
+                )
+    except Exception as exception_info:
+        logger.error(f'Error while sending {report_format} report: {str(exception_info)}')
 
 
 @celery.task()
@@ -93,9 +455,24 @@ def schedule_category_export(category_url: str, chat_id: int, log_id):
     log_item = LogCommandItem.get(LogCommandItem.id == log_id)
 
     try:
-        category_export(category_url, chat_id)
+        job = find_category_job(category_url)
+        profile = profiling_requested(chat_id)
+
+        if job is None:
+            job_url = category_export(category_url, chat_id, callback_params={'profile': 1} if profile else None)
+            marketplace = detect_marketplace_by_url(category_url)
+            job = CategoryJob.create(
+                job_id=job_url.rsplit('/p/', 1)[-1],
+                category_url=normalize_category_url(category_url),
+                marketplace=marketplace.slug if marketplace is not None else None,
+            )
+        elif job.state == 'analysed':
+            # выгрузка свежая, анализируем ее заново без нового обхода каталога
+            calculate_category_stats.delay(job_id=job.job_id, chat_id=chat_id, profile=profile)
+
+        job.add_recipient(user_get_by_chat_id(chat_id=chat_id), log_item=log_item)
         message = '⏳ Мы обрабатываем ваш запрос. Когда все будет готово, вы получите результат.\n\nБольшие категории (свыше 1 тыс. товаров) могут обрабатываться до одного часа.\n\nМаленькие категории обрабатываются в течение нескольких минут.'
-        check_requests_count_recovered.apply_async((), {'chat_id': chat_id}, countdown=24 * 60 * 60 + 60)
+        schedule_notification(chat_id, 'requests_recovered', due_at=datetime.datetime.now() + datetime.timedelta(hours=24, minutes=1))
         log_item.set_status('success')
     except Exception:
         message = 'Извините, мы сейчас не можем обработать ваш запрос – у нас образовалась слишком большая очередь на анализ категорий. Пожалуйста, подождите немного и отправьте запрос снова.'
@@ -106,6 +483,129 @@ def schedule_category_export(category_url: str, chat_id: int, log_id):
     bot.send_message(chat_id=chat_id, text=message)
 
 
+def find_category_job(category_url: str):
+    """Running export of the same category is shared by all who asked for it, a fresh finished one is reused."""
+    job = get_recent_category_job(category_url, 'scheduled', minutes=env('SETTINGS_JOB_COALESCE_MINUTES', cast=int, default=60))
+
+    if job is None:
+        job = get_recent_category_job(category_url, 'analysed', minutes=env('SETTINGS_JOB_CACHE_MINUTES', cast=int, default=60))
+
+    return job
+
+
+def category_size(items_count: int) -> str:
+    for limit in [100, 1000, 10000]:
+        if items_count < limit:
+            return f'<{limit}'
+
+    return '10000+'
+
+
+def mark_category_job_analysed(job, items_count: int, marketplace: str = None):
+    """Crawl and analysis wait times by category size, taken from the stage timestamps of the job."""
+    job.set_state('analysed', items_count=items_count)
+    size = category_size(items_count)
+
+    if job.finished_at is not None:
+        metrics.observe('category_job.crawl', (job.finished_at - job.scheduled_at).total_seconds(), marketplace=marketplace, size=size)
+        metrics.observe('category_job.analysis', (job.analysed_at - job.finished_at).total_seconds(), marketplace=marketplace, size=size)
+
+
+@celery.task()
+def schedule_categories_digest():
+    watched = get_watched_categories(days=env('SETTINGS_DIGEST_WATCH_DAYS', cast=int, default=30))
+
+    # самые популярные категории идут первыми, все остальное ждет следующего запуска
+    categories = sorted(watched.keys(), key=lambda url: len(watched[url]), reverse=True)
+    budget = env('SETTINGS_DIGEST_CATEGORIES_BUDGET', cast=int, default=20)
+    stagger = env('SETTINGS_DIGEST_EXPORT_STAGGER', cast=int, default=300)
+
+    # выгрузки растягиваем по времени, чтобы они не занимали очередь паука разом и не мешали запросам пользователей
+    for position, category_url in enumerate(categories[:budget]):
+        export_category_digest.apply_async((category_url, watched[category_url]), countdown=position * stagger)
+
+    logger.info(f'Digest scheduled for {min(budget, len(categories))} of {len(categories)} watched categories')
+
+
+@celery.task(bind=True, default_retry_delay=300, max_retries=12)
+def export_category_digest(self, category_url: str, subscribers: list):
+    try:
+        # своя планка очереди: фоновая выгрузка ставится, только пока у паука есть место для запросов пользователей
+        job_url = category_export(
+            category_url,
+            callback='category_digest',
+            threshold=env('SETTINGS_DIGEST_JOBS_THRESHOLD', cast=int, default=0),
+        )
+    except Exception as exception_info:
+        logger.info(f'Digest export for {category_url} is postponed: {str(exception_info)}')
+        raise self.retry()
+
+    # подписчиков храним у выгрузки, а не в адресе колбэка: у популярных категорий их слишком много для URL,
+    # а свое состояние не дает присоединиться к выгрузке дайджеста запросам пользователей
+    marketplace = detect_marketplace_by_url(category_url)
+    job = CategoryJob.create(
+        job_id=job_url.rsplit('/p/', 1)[-1],
+        category_url=normalize_category_url(category_url),
+        marketplace=marketplace.slug if marketplace is not None else None,
+        state='digest',
+    )
+    job.add_recipients(subscribers)
+
+
+@celery.task(bind=True, default_retry_delay=10, max_retries=6)
+def calculate_category_digest(self, job_id):
+    from .viewmodels.report import Report
+
+    slug, marketplace, transformer = detect_mp_by_job_id(job_id=job_id)
+    data = []
+
+    try:
+        data = ScrapinghubLoader(job_id=job_id, client=get_scrapinghub_client(), transformer=transformer).load()
+    except NotReady:
+        logger.error(f'Job {job_id} is not finished yet, placing new task')
+        self.retry(countdown=10)
+
+    try:
+        stats = CategoryStats(data=data)
+    except BadDataSet:
+        logger.error(f'Job {job_id} returned empty category')
+        return
+
+    category_url = normalize_category_url(stats.category_url())
+    previous_snapshot = get_last_category_snapshot(category_url)
+    snapshot = record_category_snapshot(stats, job_id=job_id)
+
+    try:
+        save_category_aggregate(category_url, Report(stats=stats, username=None).to_aggregate_dict())
+    except Exception as exception_info:
+        logger.error(f'Error while saving category aggregate: {str(exception_info)}')
+
+    if previous_snapshot is None:
+        logger.info(f'No previous snapshot for {category_url}, digest is skipped')
+        return
+
+    # сообщение считаем один раз на категорию, а не на каждого подписчика
+    message = generate_category_digest_message(stats=stats, snapshot=snapshot)
+    # подписчики сохранены при постановке выгрузки, заново ищем их только для выгрузок без записи в реестре
+    job = get_category_job(job_id)
+
+    if job is not None:
+        subscribers = job.chat_ids()
+    else:
+        subscribers = get_watched_categories(days=env('SETTINGS_DIGEST_WATCH_DAYS', cast=int, default=30)).get(category_url, [])
+
+    for chat_id in subscribers:
+        send_digest_message.delay(chat_id, message)
+
+    logger.info(f'Digest for {category_url} sent to {len(subscribers)} subscribers')
+
+
+@celery.task(rate_limit=env('SETTINGS_DIGEST_RATE_LIMIT', cast=str, default='20/s'))
+def send_digest_message(chat_id: int, text: str):
+    bot.send_message(chat_id=chat_id, text=text, parse_mode='Markdown', disable_web_page_preview=True)
+    track_amplitude.delay(chat_id=chat_id, event='Received category digest')
+
+
 @celery.task()
 def send_category_requests_count_message(chat_id: int):
     user = user_get_by_chat_id(chat_id=chat_id)
@@ -138,12 +638,38 @@ def check_requests_count_recovered(chat_id: int):
 
     if user.catalog_requests_left_count() == user.daily_catalog_requests_limit:
         # here we are limiting the maximum number of emojis to 10
-        # emoji = ''.join(map(lambda x: '🌕', range(min(user.daily_catalog_requests_limit, 10))))
-        # message = f'🤘 Рок-н-ролл! Вам доступно {user.daily_catalog_requests_limit} новых запросов категорий Wildberries для анализа.\n{emoji}'
-        # bot.send_message(chat_id=chat_id, text=message)
+        emoji = '🌕' * min(user.daily_catalog_requests_limit, 10)
+        message = f'🤘 Рок-н-ролл! Вам доступно {user.daily_catalog_requests_limit} новых запросов категорий для анализа.\n{emoji}'
+        bot.send_message(chat_id=chat_id, text=message)
+
+        track_amplitude.delay(chat_id=chat_id, event='Received "Recovered requests" message')
+
 
-        # track_amplitude.delay(chat_id=chat_id, event='Received "Recovered requests" message')
-        logger.info('Placeholder for Recovered requests messages called')
+# задачи, которые запускает обход отложенных уведомлений, по виду уведомления
+notification_tasks = {
+    'requests_recovered': check_requests_count_recovered,
+}
+
+
+@celery.task()
+def send_due_notifications():
+    """Due notifications are taken in batches, so the broker holds only what is ready to be sent."""
+    batch_size = env('SETTINGS_NOTIFICATIONS_BATCH', cast=int, default=500)
+    sent = 0
+
+    while True:
+        due = pop_due_notifications(limit=batch_size)
+
+        for chat_id, kind in due:
+            notification_tasks[kind].delay(chat_id)
+
+        sent += len(due)
+
+        if len(due) < batch_size:
+            break
+
+    if sent:
+        logger.info(f'{sent} due notifications sent')
 
 
 @celery.task()
@@ -166,11 +692,65 @@ def track_amplitude(chat_id: int, event: str, event_properties=None, timestamp=N
         )
 
 
-def generate_category_stats_message(stats):
+def default_report_format() -> str:
+    # PDF верстается дольше всего, поэтому сразу отправляем карточку, а PDF — только по кнопке
+    report_format = env('REPORT_DEFAULT_FORMAT', cast=str, default='png')
+
+    return report_format if report_format in report_formats else 'png'
+
+
+def report_formats_keyboard(job_id, exclude: str = None, with_data: bool = False) -> InlineKeyboardMarkup:
+    keyboard = [[
+        InlineKeyboardButton(button, callback_data=f'report_format:{report_format}:{job_id}')
+        for report_format, (_, button) in report_formats.items()
+        if report_format != exclude
+    ]]
+
+    if with_data:
+        keyboard.append([
+            InlineKeyboardButton(data_formats[export_format][1], callback_data=f'report_format:{export_format}:{job_id}')
+            for export_format in export_formats()
+        ])
+        keyboard.append([InlineKeyboardButton('🔎 Срез по бренду, цене, стране или рейтингу', callback_data=f'slice::{job_id}')])
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+callback_data_limit = 64
+
+
+def category_slices_keyboard(job_id, index, filters: dict) -> InlineKeyboardMarkup:
+    """Buttons narrowing the category by the dimensions which are not filtered yet."""
+    limit = env('SETTINGS_SLICE_BUTTONS', cast=int, default=6)
+    keyboard = []
+
+    for dimension in slice_dimensions:
+        if dimension in filters:
+            continue
+
+        buttons = []
+        for code, label in index.options(dimension, limit=limit):
+            callback_data = f'slice:{format_filters({**filters, dimension: code})}:{job_id}'
+
+            # Telegram не принимает клавиатуру целиком, если хотя бы одна кнопка длиннее лимита
+            if len(callback_data.encode('utf-8')) > callback_data_limit:
+                logger.warning(f'Slice button {callback_data} is longer than {callback_data_limit} bytes')
+                continue
+
+            buttons.append(InlineKeyboardButton(label, callback_data=callback_data))
+
+        # по две кнопки в ряд, иначе длинные названия брендов не помещаются
+        keyboard.extend(buttons[position:position + 2] for position in range(0, len(buttons), 2))
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+def generate_category_stats_message(stats, report_format: str = 'pdf'):
     df = stats.df
+    title = report_formats.get(report_format, report_formats['pdf'])[0]
 
     return f"""
-Ваш PDF-отчет по категории [{stats.category_name()}]({stats.category_url()}) находится в следующем сообщении.
+Ваш {title} по категории [{stats.category_name()}]({stats.category_url()}) готовится и придет отдельным сообщением, а пока — главные цифры.
 
 Краткая сводка:
 Количество товаров: `{fnum(df.sku.sum())}`
@@ -180,59 +760,167 @@ def generate_category_stats_message(stats):
 """
 
 
-def generate_category_stats_export_file(stats):
-    start_time = time.time()
+def generate_category_digest_message(stats, snapshot):
+    message = f"""
+📈 Что изменилось в категории [{stats.category_name()}]({stats.category_url()}) с прошлой проверки:
 
-    temp_file = tempfile.NamedTemporaryFile(suffix='.xlsx', prefix='wb_category_', mode='r+b', delete=True)
+Новых товаров: `{fnum(snapshot.added_count)}`
+Пропало товаров: `{fnum(snapshot.removed_count)}`
+Изменились продажи или цена: `{fnum(snapshot.changed_count)}`
+Продаж за период: {fquan(snapshot.purchases_delta)} (на {fcur(snapshot.turnover_delta)})
+Всего товаров в категории: `{fnum(snapshot.items_count)}`
+"""
+
+    # лидеров роста берем из сохраненных изменений снимка, названия — из свежей выгрузки
+    changes = get_category_changes(snapshot, order_by='turnover_delta', limit=env('SETTINGS_DIGEST_TOP_ITEMS', cast=int, default=3))
+    names = dict(zip(stats.df['id'].astype(str), stats.df['name'])) if 'name' in stats.df.columns else {}
+    leaders = [row for row in changes.to_dict('records') if row['turnover_delta'] > 0]
 
-    writer = pd.ExcelWriter(temp_file.name)
-    stats.df.to_excel(writer, sheet_name='Товары', index=None, header=True)
+    if leaders:
+        message += '\nБольше всего выросла выручка:\n'
+        message += ''.join(
+            f'• {escape_markdown(str(names.get(row["item_id"], row["item_id"])))}: +{fcur(row["turnover_delta"])}\n'
+            for row in leaders
+        )
 
-    distributions = calc_sales_distribution(stats)
-    distributions.df.to_excel(writer, sheet_name='Распределение продаж', index=None, header=True)
-    writer.save()
+    return message
+
+
+def generate_category_stats_export_file(stats, export_format: str = 'xlsx'):
+    start_time = time.time()
+
+    temp_file = tempfile.NamedTemporaryFile(suffix=f'.{export_format}', prefix='wb_category_', mode='r+b', delete=True)
+
+    with metrics.timer('report.export', format=export_format):
+        if export_format == 'csv':
+            write_csv(stats.df, temp_file.name)
+        elif export_format == 'parquet':
+            write_parquet(stats.df, temp_file.name)
+        else:
+            # расчет распределения добавляет в датасет служебную колонку с интервалом цены
+            distributions = calc_sales_distribution(stats)
+            stats.df.drop(columns=['bin'], inplace=True)
+            write_xlsx({'Товары': stats.df, 'Распределение продаж': distributions.df}, temp_file.name)
 
     logger.info(f'Export file generated in {time.time() - start_time}s, {os.path.getsize(temp_file.name)} bytes')
 
     return temp_file
 
 
-def generate_category_stats_report_file(stats, username='%username%'):
-    from jinja2 import Environment, FileSystemLoader, select_autoescape
-    from weasyprint import HTML
+def generate_category_stats_report_dict(stats, username='%username%') -> dict:
     from .viewmodels.report import Report
 
-    start_time = time.time()
+    return plain_report(Report(stats=stats, username=username).to_dict())
 
-    base_path = os.path.dirname(os.path.abspath(__file__)) + '/templates/pdf/report/'
-    environment = Environment(
-        loader=FileSystemLoader(base_path),
-        autoescape=select_autoescape(['html', 'xml']),
-    )
-    template = environment.get_template('_index.j2')
+
+def generate_category_stats_report_file(stats, username='%username%', profiler=None):
+    profiler = profiler or JobProfiler(job_id=None)
+
+    with metrics.timer('report.viewmodel', stage='report'), profiler.stage('viewmodel'):
+        report_dict = generate_category_stats_report_dict(stats, username=username)
+
+    return generate_report_pdf_file(report_dict, profiler=profiler)
+
+
+def generate_report_pdf_file(report_dict: dict, profiler=None):
+    start_time = time.time()
+    profiler = profiler or JobProfiler(job_id=None)
 
     temp_file = tempfile.NamedTemporaryFile(suffix='.pdf', prefix='wb_category_', mode='w+b', delete=False)
-    report_vm = Report(stats=stats, username=username)
 
-    HTML(string=template.render(report_vm.to_dict()), base_url=f'{base_path}').write_pdf(target=temp_file.name)
+    with metrics.timer('report.render', stage='html'), profiler.stage('render_html'):
+        htmls = render_report_page_groups(report_dict, groups=report_render_workers())
+
+    with metrics.timer('report.render', stage='pdf'), profiler.stage('render_pdf'):
+        render_report_pdf_parallel(htmls, target=temp_file.name)
 
     logger.info(f'PDF report generated in {time.time() - start_time}s, {os.path.getsize(temp_file.name)} bytes')
 
     return temp_file
 
 
-def add_user_to_crm(chat_id):
-    if env('AIRTABLE_API_KEY', None) is not None:
-        logger.info('Saving new user to CRM')
+_crm_tables = {}
 
-        user = user_get_by_chat_id(chat_id=chat_id)
 
-        logger.info(f"created_at is {user.created_at.replace(tzinfo=datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')}")
+def get_crm_table() -> Airtable:
+    """Airtable client is created once per process so its session keeps connections alive."""
+    key = (env('AIRTABLE_BASE_KEY'), env('AIRTABLE_CRM_TABLE'))
 
+    if key not in _crm_tables:
         airtable = Airtable(env('AIRTABLE_BASE_KEY'), env('AIRTABLE_CRM_TABLE'), api_key=env('AIRTABLE_API_KEY'))
-        airtable.insert({
-            'Имя': user.full_name,
-            'Юзернейм': user.user_name,
-            'ID чата': user.chat_id,
-            'Зарегистрирован': user.created_at.replace(tzinfo=datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
-        })
+        mount_adapter(airtable.session)
+        _crm_tables[key] = airtable
+
+    return _crm_tables[key]
+
+
+def crm_user_fields(user) -> dict:
+    return {
+        'Имя': user.full_name,
+        'Юзернейм': user.user_name,
+        'ID чата': user.chat_id,
+        'Зарегистрирован': user.created_at.replace(tzinfo=datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+    }
+
+
+def backfill_crm_sync_items(airtable: Airtable) -> int:
+    """Link users already present in CRM to their records, so the first sync does not insert them again."""
+    synced_at = datetime.datetime.now()
+    records = {}
+
+    for page in airtable.get_iter(fields=['ID чата']):
+        for record in page:
+            chat_id = record['fields'].get('ID чата')
+            if chat_id is not None:
+                records.setdefault(int(chat_id), record['id'])
+
+    known_ids = {user.chat_id for user in User.select(User.chat_id).where(User.chat_id.in_(list(records.keys())))}
+    rows = [{'user': chat_id, 'record_id': records[chat_id], 'synced_at': synced_at} for chat_id in known_ids]
+
+    for chunk in chunked(rows, 100):
+        CrmSyncItem.insert_many(chunk).on_conflict_ignore().execute()
+
+    logger.info(f'Linked {len(rows)} users to existing CRM records')
+
+    return len(rows)
+
+
+@celery.task()
+def sync_users_to_crm():
+    if env('AIRTABLE_API_KEY', None) is None:
+        return
+
+    airtable = get_crm_table()
+
+    # после выкатки таблица синхронизации пуста, а пользователи в CRM уже есть – сначала связываем их с записями
+    if not CrmSyncItem.select().exists():
+        backfill_crm_sync_items(airtable)
+
+    batch_size = env('SETTINGS_CRM_SYNC_BATCH', cast=int, default=100)
+    users = list(get_users_to_sync_with_crm(limit=batch_size))
+
+    if len(users) == 0:
+        return
+
+    synced_at = datetime.datetime.now()
+
+    new_users = [user for user in users if not hasattr(user, 'crmsyncitem') or user.crmsyncitem.record_id is None]
+    changed_users = [user for user in users if user not in new_users]
+
+    # каждую пачку отмечаем сразу после ответа API, чтобы при ошибке на следующей уже созданные записи не добавились повторно
+    for chunk in chunked(new_users, airtable.MAX_RECORDS_PER_REQUEST):
+        inserted = airtable.batch_insert([crm_user_fields(user) for user in chunk])
+        rows = [{'user': user.chat_id, 'record_id': record['id'], 'synced_at': synced_at} for user, record in zip(chunk, inserted)]
+
+        CrmSyncItem.insert_many(rows).on_conflict(
+            conflict_target=[CrmSyncItem.user],
+            preserve=[CrmSyncItem.record_id, CrmSyncItem.synced_at],
+        ).execute()
+
+    for chunk in chunked(changed_users, airtable.MAX_RECORDS_PER_REQUEST):
+        airtable.batch_update([{'id': user.crmsyncitem.record_id, 'fields': crm_user_fields(user)} for user in chunk])
+        CrmSyncItem.update(synced_at=synced_at).where(CrmSyncItem.user.in_([user.chat_id for user in chunk])).execute()
+        time.sleep(airtable.API_LIMIT)
+
+    # остаток очереди заберёт следующий запуск по расписанию, чтобы два запуска не взяли одну и ту же пачку
+    logger.info(f'Synced {len(new_users)} new and {len(changed_users)} changed users with CRM')
@@ -0,0 +1,76 @@
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from envparse import env
+from requests.adapters import HTTPAdapter
+from telegram import Bot
+from telegram.utils.request import Request
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_sessions = {}
+_bots = {}
+
+
+class TimeoutSession(requests.Session):
+    """Session which never waits for the remote side forever."""
+
+    def __init__(self, timeout: float):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(*args, **kwargs)
+
+
+def create_adapter() -> HTTPAdapter:
+    return HTTPAdapter(
+        pool_connections=env('HTTP_POOL_CONNECTIONS', cast=int, default=4),
+        pool_maxsize=env('HTTP_POOL_MAXSIZE', cast=int, default=16),
+        max_retries=Retry(
+            total=env('HTTP_RETRIES', cast=int, default=3),
+            backoff_factor=0.3,
+            status_forcelist=(500, 502, 503, 504),
+            raise_on_status=False,
+        ),
+    )
+
+
+def mount_adapter(session: requests.Session) -> requests.Session:
+    adapter = create_adapter()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+
+def get_session(url: str) -> requests.Session:
+    """Keep-alive session shared by all calls to the same host within the process."""
+    host = urlsplit(url).netloc or url
+
+    with _lock:
+        if host not in _sessions:
+            logger.info(f'Creating HTTP session for {host}')
+            _sessions[host] = mount_adapter(TimeoutSession(timeout=env('HTTP_TIMEOUT', cast=float, default=10.0)))
+
+        return _sessions[host]
+
+
+def get_bot(token: str = None) -> Bot:
+    """Telegram bot with a connection pool big enough for the threads of the process."""
+    token = token or env('TELEGRAM_API_TOKEN')
+
+    with _lock:
+        if token not in _bots:
+            _bots[token] = Bot(token, base_url=env('TELEGRAM_API_BASE_URL', default=None), request=Request(
+                con_pool_size=env('TELEGRAM_CON_POOL_SIZE', cast=int, default=8),
+                connect_timeout=env('TELEGRAM_CONNECT_TIMEOUT', cast=float, default=5.0),
+                read_timeout=env('TELEGRAM_READ_TIMEOUT', cast=float, default=20.0),
+            ))
+
+        return _bots[token]
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+from seller_stats.category_stats import get_distribution_thresholds
+
+sales_thresholds = [0, 1, 10, 100, 1000, np.inf]
+ratings = [0, 1, 2, 3, 4, 5]
+
+
+def bin_codes(values: np.ndarray, thresholds: list) -> np.ndarray:
+    """Number of the [left, right) interval for every value, -1 for missing values and values out of the scale."""
+    codes = np.searchsorted(thresholds, values, side='right') - 1
+    codes[~((values >= thresholds[0]) & (values < thresholds[-1]))] = -1
+
+    return codes
+
+
+def binned_sums(codes: np.ndarray, thresholds: list, **columns) -> pd.DataFrame:
+    """Same table as groupby over pd.cut(..., right=False): every interval with the sums of the columns, empty ones included."""
+    valid = codes >= 0
+    table = {'bin': pd.IntervalIndex.from_breaks(thresholds, closed='left')}
+
+    for name, values in columns.items():
+        sums = np.bincount(codes[valid], weights=np.nan_to_num(values[valid].astype(float)), minlength=len(thresholds) - 1)
+        table[name] = sums.astype(values.dtype) if values.dtype.kind in 'iu' else sums
+
+    return pd.DataFrame(table)
+
+
+def calc_distributions(df: pd.DataFrame) -> dict:
+    """Rating, sales and price distributions of the category, every column is read once and no frame is copied."""
+    total = len(df.index)
+    rating = df.rating.to_numpy(dtype=float)
+    purchases = df.purchases.to_numpy(dtype=float)
+    sku = df.sku.to_numpy()
+
+    is_rating = np.isin(rating, ratings)
+    rating_counts = np.bincount(rating[is_rating].astype(int), minlength=len(ratings))
+    rated = rating[(rating != 0) & ~np.isnan(rating)]
+
+    sales = binned_sums(bin_codes(purchases, sales_thresholds), sales_thresholds, purchases=purchases, sku=sku)
+    sales['share'] = sales.sku / total
+
+    price_thresholds, _ = get_distribution_thresholds(df.price)
+    prices = binned_sums(
+        bin_codes(df.price.to_numpy(dtype=float), price_thresholds),
+        price_thresholds,
+        sku=sku,
+        turnover_month=df.turnover_month.to_numpy(dtype=float),
+        purchases_month=df.purchases_month.to_numpy(dtype=float),
+    )
+
+    return {
+        'total': total,
+        'rating_ratios': {rating: rating_counts[rating] / total for rating in ratings},
+        'average_rating': rated.mean() if rated.size else np.nan,
+        'trash_share': np.count_nonzero(purchases < 1) / total,
+        'sales': sales,
+        'prices': prices,
+    }
@@ -11,3 +11,52 @@ def image_bag(number, image_pale, image_bright, maximum=5):
         images.append(image_pale)
 
     return images
+
+
+def parse_dates(series):
+    """Review dates come as ISO strings with different offsets, the local date of the string is kept as is."""
+    import pandas as pd
+
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+
+    dates = pd.to_datetime(series.str.slice(0, 19), format='%Y-%m-%dT%H:%M:%S', errors='coerce')
+
+    # другие форматы разбираем медленным путем, но только для того, что не разобралось
+    rest = dates.isna() & series.notna()
+    if rest.any():
+        dates[rest] = pd.to_datetime(series[rest], errors='coerce', utc=True).dt.tz_localize(None)
+
+    return dates
+
+
+def date_labels(dates, months: dict):
+    """Month and year of every date for display, a dash for the missing ones."""
+    labels = dates.dt.month.map(months) + ' ' + dates.dt.year.astype('Int64').astype(str)
+
+    return labels.fillna('–')
+
+
+def first_sales_label(date) -> str:
+    """Part and year of the first sale, a dash when the category has no reviews at all."""
+    import pandas as pd
+
+    parts = {
+        1: 'нас.',
+        2: 'нач.',
+        3: 'нач.',
+        4: 'нач.',
+        5: 'сер.',
+        6: 'сер.',
+        7: 'сер.',
+        8: 'сер.',
+        9: 'кон.',
+        10: 'кон.',
+        11: 'кон.',
+        12: 'кон.',
+    }
+
+    if date is None or pd.isna(date):
+        return '–'
+
+    return f'{parts[date.month]} {date.year}'
@@ -1,8 +1,7 @@
 from textwrap import shorten
 
-from dateutil.parser import parse as date_parse
-
 from .base import BaseListViewModel, BaseViewModel
+from .helpers import date_labels
 from .indicator import Indicator
 from .months import months_short
 
@@ -18,7 +17,7 @@ class Item(BaseViewModel):
         self._turnover = item['turnover']
         self._purchases_month = item['purchases_month']
         self._turnover_month = item['turnover_month']
-        self._first_review = item['first_review']
+        self._first_review_label = item['first_review_label']
         self._rating = item['rating']
         self._images = item['image_urls']
 
@@ -56,12 +55,7 @@ class Item(BaseViewModel):
 
     @property
     def first_review_date(self):
-        months = months_short()
-        try:
-            date = date_parse(self._first_review)
-            return f'{months[date.month]} {date.year}'
-        except TypeError:
-            return '–'
+        return self._first_review_label
 
     @property
     def average_rating(self):
@@ -71,5 +65,7 @@ class Item(BaseViewModel):
 class ItemsList(BaseListViewModel):
     def __init__(self, df):
         super().__init__()
+        df = df.assign(first_review_label=date_labels(df.first_review, months_short()))
+
         for item in df.to_dict('records'):
             self.items.append(Item(item))
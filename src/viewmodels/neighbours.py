@@ -0,0 +1,64 @@
+from .base import BaseListViewModel, BaseViewModel
+from .helpers import first_sales_label, image_bag
+from .indicator import Indicator
+
+
+class NeighboursItem(BaseViewModel):
+    def __init__(self, item):
+        self._url = item['category_url']
+        self._name = item['category_name']
+        self._first_sales = item['first_sales']
+        self._turnover = item['turnover_month']
+        self._goods = item['goods_count']
+        self._brands = item['brands_count']
+        self._turnover_median = item['turnover_median']
+        self._monopoly_index = item['monopoly_index']
+        self._highlighted = item.get('highlighted', False)
+
+    @property
+    def url(self):
+        return self._url
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def first_sales(self):
+        return first_sales_label(self._first_sales)
+
+    @property
+    def turnover(self):
+        return Indicator(number=self._turnover, units='руб.').to_dict()
+
+    @property
+    def goods(self):
+        return Indicator(number=self._goods).to_dict()
+
+    @property
+    def brands(self):
+        return Indicator(number=self._brands).to_dict()
+
+    @property
+    def turnover_median(self):
+        return Indicator(number=self._turnover_median, units='руб. / мес.').to_dict()
+
+    @property
+    def monopoly_index(self):
+        return self._monopoly_index
+
+    @property
+    def monopoly_index_images(self):
+        return image_bag(number=self._monopoly_index, image_pale='m1', image_bright='m1a')
+
+    @property
+    def highlighted(self):
+        return self._highlighted
+
+
+class NeighboursList(BaseListViewModel):
+    def __init__(self, items: list):
+        super().__init__()
+
+        for item in items:
+            self.items.append(NeighboursItem(item))
@@ -1,7 +1,32 @@
-from dateutil.parser import parse as date_parse
+import pandas as pd
 
 from .base import BaseListViewModel, BaseViewModel
+from .helpers import date_labels, parse_dates
 from .indicator import Indicator
+from .months import months_short
+
+
+def calc_brands(df) -> pd.DataFrame:
+    """Brand table of the category in one groupby pass, shared by the brands list, brands count and monopoly index."""
+    columns = pd.DataFrame({
+        'brand_name': df.brand_name.astype('category'),
+        'sku': df.sku,
+        'turnover_month': df.turnover_month,
+        'first_review': parse_dates(df.first_review),
+        # товары без рейтинга не тянут средний рейтинг бренда вниз
+        'rating': df.rating.where(df.rating != 0),
+        'brand_url': df.brand_url,
+        'brand_logo': df.brand_logo,
+    })
+
+    return columns.groupby('brand_name', observed=True, sort=False).agg(
+        sku=('sku', 'sum'),
+        turnover_month=('turnover_month', 'sum'),
+        first_review=('first_review', 'min'),
+        rating=('rating', 'mean'),
+        brand_url=('brand_url', 'first'),
+        brand_logo=('brand_logo', 'first'),
+    )
 
 
 class PopularBrandsItem(BaseViewModel):
@@ -11,7 +36,7 @@ class PopularBrandsItem(BaseViewModel):
         self._name = item['brand_name']
         self._goods = item['sku']
         self._turnover = item['turnover_month']
-        self._first_review = item['first_review']
+        self._first_review_label = item['first_review_label']
         self._average_rating = item['rating']
 
     @property
@@ -36,25 +61,7 @@ class PopularBrandsItem(BaseViewModel):
 
     @property
     def first_review_date(self):
-        months = {
-            1: 'янв.',
-            2: 'фев.',
-            3: 'мар.',
-            4: 'апр.',
-            5: 'май.',
-            6: 'июн.',
-            7: 'июл.',
-            8: 'авг.',
-            9: 'сен.',
-            10: 'окт.',
-            11: 'ноя.',
-            12: 'дек.',
-        }
-        try:
-            date = date_parse(self._first_review)
-            return f'{months[date.month]} {date.year}'
-        except TypeError:
-            return '–'
+        return self._first_review_label
 
     @property
     def average_rating(self):
@@ -64,5 +71,7 @@ class PopularBrandsItem(BaseViewModel):
 class PopularBrandsList(BaseListViewModel):
     def __init__(self, df):
         super().__init__()
+        df = df.assign(first_review_label=date_labels(df.first_review, months_short()))
+
         for item in df.to_dict('records'):
             self.items.append(PopularBrandsItem(item))
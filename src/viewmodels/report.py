@@ -1,18 +1,18 @@
 import datetime
 import logging
+from functools import cached_property
 
-import numpy as np
 import pandas as pd
-from dateutil.parser import parse as date_parse
-from seller_stats.category_stats import calc_hhi, calc_sales_distribution
 
 from .base import BaseViewModel
 from .charts import FlagsBarChart, IntervalBarChart
-from .helpers import image_bag
+from .distributions import calc_distributions
+from .helpers import first_sales_label, image_bag, parse_dates
 from .indicator import Indicator
-from .item import Item, ItemsList
+from .item import ItemsList
 from .months import months_full
-from .popular_brands import PopularBrandsList
+from .neighbours import NeighboursList
+from .popular_brands import PopularBrandsList, calc_brands
 from .rating_distribution import RatingDistributionList
 from .sales_distribution import SalesDistribution
 
@@ -35,9 +35,59 @@ class Report(BaseViewModel):
         'rating',
     ]
 
-    def __init__(self, stats, username):
+    card_fields = [
+        'category_name',
+        'base_current_date',
+        'base_goods',
+        'base_brands',
+        'base_turnover',
+        'base_sold',
+        'base_turnover_median',
+        'base_sold_median',
+        'popular_brands',
+    ]
+
+    def __init__(self, stats, username, neighbours=None):
         self.stats = stats
         self.username = username
+        self._neighbours = neighbours or []
+
+        # даты первого отзыва разбираются один раз на весь датасет, дальше сортировки и группировки идут по datetime64
+        stats.df['first_review'] = parse_dates(stats.df.first_review)
+
+    def to_card_dict(self):
+        """Only the indicators shown on the report card, they are ready long before the whole report."""
+        return {field: getattr(self, field) for field in self.card_fields}
+
+    def to_aggregate_dict(self):
+        """Raw indicators stored for the neighbours comparison of other categories."""
+        first_sales = self.stats.df.first_review.min()
+        turnover_median = self.stats.df.turnover_month.median()
+
+        return {
+            'category_name': self.category_name,
+            'first_sales': None if pd.isna(first_sales) else first_sales.to_pydatetime(),
+            'turnover_month': float(self.stats.df.turnover_month.sum()),
+            'goods_count': len(self.stats.df.index),
+            'brands_count': len(self._brands.index),
+            'turnover_median': 0 if pd.isna(turnover_median) else float(turnover_median),
+            'monopoly_index': self._monopoly_index,
+        }
+
+    @cached_property
+    def _distributions(self):
+        return calc_distributions(self.stats.df)
+
+    @cached_property
+    def _brands(self):
+        return calc_brands(self.stats.df)
+
+    @cached_property
+    def _monopoly_index(self):
+        # индекс Херфиндаля-Хиршмана по обороту брендов, максимум – 10 000
+        shares = self._brands.turnover_month / self.stats.df.turnover_month.sum() * 100
+
+        return int(round(5 * (shares * shares).sum() / 10000))
 
     @property
     def base_current_date(self):
@@ -64,7 +114,7 @@ class Report(BaseViewModel):
 
     @property
     def base_brands(self):
-        return Indicator(number=len(self.stats.df.brand_name.unique()), label='Брендов').to_dict()
+        return Indicator(number=len(self._brands.index), label='Брендов').to_dict()
 
     @property
     def base_turnover(self):
@@ -84,8 +134,7 @@ class Report(BaseViewModel):
 
     @property
     def base_monopoly_index(self):
-        monopoly = round(5 * calc_hhi(self.stats, by='brand_name') / 10000)  # максимум – 10 000
-        return Indicator(number=monopoly, units=None, label=None).to_dict()
+        return Indicator(number=self._monopoly_index, units=None, label=None).to_dict()
 
     @property
     def base_monopoly_index_images(self):
@@ -93,7 +142,7 @@ class Report(BaseViewModel):
 
     @property
     def base_trash_index(self):
-        trash_index = round(5 * len(self.stats.df[self.stats.df.purchases < 1].index) / len(self.stats.df.index))
+        trash_index = round(5 * self._distributions['trash_share'])
         return Indicator(number=trash_index, units=None, label=None).to_dict()
 
     @property
@@ -102,55 +151,22 @@ class Report(BaseViewModel):
 
     @property
     def base_first_sales(self):
-        months = {
-            1: 'нас.',
-            2: 'нач.',
-            3: 'нач.',
-            4: 'нач.',
-            5: 'сер.',
-            6: 'сер.',
-            7: 'сер.',
-            8: 'сер.',
-            9: 'кон.',
-            10: 'кон.',
-            11: 'кон.',
-            12: 'кон.',
-        }
-        try:
-            date = date_parse(self.stats.df.first_review.min())
-            return f'{months[date.month]} {date.year}'
-        except TypeError:
-            return '–'
+        return first_sales_label(self.stats.df.first_review.min())
 
     @property
     def sales_distribution(self):
-        # Распределение продаж
-        sales_distribution_df = self.stats.df.loc[:, ['purchases', 'sku']]
-        sales_distribution_df['bin'] = pd.cut(sales_distribution_df.purchases, (0, 1, 10, 100, 1000, np.inf),
-                                              include_lowest=True, right=False)
-
-        sales_distribution_df = sales_distribution_df.groupby(by='bin').sum()
-        sales_distribution_df['share'] = sales_distribution_df.sku / len(self.stats.df.index)
-        sales_distribution_df = sales_distribution_df.reset_index()
-
-        logger.info('Sales distributions calculated')
-
-        return SalesDistribution(sales_distribution_df).to_dict()
+        return SalesDistribution(self._distributions['sales']).to_dict()
 
     @property
     def sales_distribution_skus_chart(self):
-        distributions_price = calc_sales_distribution(self.stats)
-
-        df = distributions_price.df.loc[:, ['bin', 'sku']]
+        df = self._distributions['prices'].loc[:, ['bin', 'sku']]
         df['val'] = df['sku']
 
         return IntervalBarChart(df, x_axis='Цена', y_axis='Количество артикулов').to_dict()
 
     @property
     def sales_distribution_turnover_chart(self):
-        distributions_price = calc_sales_distribution(self.stats)
-
-        df = distributions_price.df.loc[:, ['bin', 'turnover_month']]
+        df = self._distributions['prices'].loc[:, ['bin', 'turnover_month']]
         df['val'] = df['turnover_month']
 
         return IntervalBarChart(df, x_axis='Цена', y_axis='Оборот').to_dict()
@@ -167,22 +183,27 @@ class Report(BaseViewModel):
 
     @property
     def popular_brands(self):
-        brands_df = self.stats.df.loc[:, ['brand_name', 'sku', 'turnover_month']].groupby(by='brand_name').sum().sort_values(by='turnover_month', ascending=False).reset_index()
-        brands_meta_df = self.stats.df.loc[:, ['brand_name', 'brand_url', 'brand_logo']].groupby(by='brand_name').first()
-        brands_df_first_review = self.stats.df.loc[:, ['brand_name', 'first_review']].groupby(by='brand_name').min()
-        brands_df_retings = self.stats.df[self.stats.df.rating != 0].loc[:, ['brand_name', 'rating']].groupby(by='brand_name').mean()
+        return PopularBrandsList(self._brands.nlargest(5, 'turnover_month').reset_index()).to_dict()
 
-        brands_df = brands_df.merge(brands_df_first_review, on='brand_name', how='left').merge(brands_df_retings, on='brand_name', how='left').merge(brands_meta_df, on='brand_name', how='left')
+    @property
+    def neighbours(self):
+        """Category itself and its neighbours from the same catalog section, empty until some neighbour is analysed."""
+        if not self._neighbours:
+            return []
+
+        current = {**self.to_aggregate_dict(), 'category_url': self.category_url, 'highlighted': True}
 
-        return PopularBrandsList(brands_df.head(5)).to_dict()
+        return NeighboursList([current] + self._neighbours).to_dict()
 
     @property
     def average_rating(self):
-        return round(self.stats.df[self.stats.df.rating != 0].rating.mean(), 1)
+        return round(self._distributions['average_rating'], 1)
 
     @property
     def rating_distribution(self):
-        return RatingDistributionList([{'rating': threshold, 'ratio': len(self.stats.df[self.stats.df.rating == threshold]) / len(self.stats.df.index)} for threshold in [5, 4, 3, 2, 1, 0]]).to_dict()
+        ratios = self._distributions['rating_ratios']
+
+        return RatingDistributionList([{'rating': threshold, 'ratio': ratios[threshold]} for threshold in [5, 4, 3, 2, 1, 0]]).to_dict()
 
     @property
     def best_purchases_overall(self):
@@ -202,9 +223,12 @@ class Report(BaseViewModel):
 
     @property
     def goods_overview(self):
-        return {
-            'expensive': Item(self.stats.df.loc[:, self.items_field_list].sort_values(by='price', ascending=False).head(1).to_dict('records')[0]).to_dict(),
-            'cheap': Item(self.stats.df.loc[:, self.items_field_list].sort_values(by='price', ascending=True).head(1).to_dict('records')[0]).to_dict(),
-            'old': Item(self.stats.df.loc[:, self.items_field_list].sort_values(by='first_review', ascending=True).head(1).to_dict('records')[0]).to_dict(),
-            'bad': Item(self.stats.df[self.stats.df.rating > 0].loc[:, self.items_field_list].sort_values(by='rating', ascending=True).head(1).to_dict('records')[0]).to_dict(),
+        df = self.stats.df.loc[:, self.items_field_list]
+        overview = {
+            'expensive': df.nlargest(1, 'price'),
+            'cheap': df.nsmallest(1, 'price'),
+            'old': df.nsmallest(1, 'first_review'),
+            'bad': df[df.rating > 0].nsmallest(1, 'rating'),
         }
+
+        return {key: ItemsList(items).to_dict()[0] for key, items in overview.items() if len(items.index)}
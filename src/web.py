@@ -1,29 +1,45 @@
+import hmac
 import json
 import logging
 
 import falcon
 from envparse import env
-from telegram import Bot, Update
+from telegram import Update
 
-from . import tasks
+from . import marketplaces, metrics, tasks
 from .bot import reset_webhook, start_bot
+from .models import get_category_job
+from .reports import base_path
+from .transport import get_bot
 
 logger = logging.getLogger(__name__)
 
 
 class CallbackWbCategoryExportResource(object):
     def on_post(self, req, resp):
-        if req.has_param('chat_id'):
-            bot.send_message(
-                chat_id=req.get_param('chat_id'),
-                text='🤘 Выгрузка данных по категории готова.\n🧠 Приступаю к анализу. Минутку...',
-            )
+        # получатели берутся из реестра выгрузок, chat_id в параметрах колбэка остался от старых выгрузок
+        job = get_category_job(req.get_param('job_id')) if req.has_param('job_id') else None
+        chat_ids = job.chat_ids() if job is not None else []
+
+        if not chat_ids and req.has_param('chat_id'):
+            job, chat_ids = None, [req.get_param('chat_id')]
+
+        if chat_ids:
+            if job is not None:
+                job.set_state('finished')
+
+            for chat_id in chat_ids:
+                bot.send_message(
+                    chat_id=chat_id,
+                    text='🤘 Выгрузка данных по категории готова.\n🧠 Приступаю к анализу. Минутку...',
+                )
 
             tasks.calculate_category_stats.apply_async(
                 (),
                 {
                     'job_id': req.get_param('job_id'),
-                    'chat_id': req.get_param('chat_id'),
+                    'chat_id': chat_ids[0] if job is None else None,
+                    'profile': req.get_param_as_bool('profile', default=False),
                 },
                 countdown=60,
             )
@@ -35,27 +51,68 @@ class CallbackWbCategoryExportResource(object):
             resp.body = json.dumps({'error': 'wrong_chat_id'})
 
 
+class CallbackWbCategoryDigestResource(object):
+    def on_post(self, req, resp):
+        if req.has_param('job_id'):
+            tasks.calculate_category_digest.apply_async(
+                (),
+                {
+                    'job_id': req.get_param('job_id'),
+                },
+                countdown=60,
+            )
+
+            resp.status = falcon.HTTP_200
+            resp.body = json.dumps({'status': 'ok'})
+        else:
+            resp.status = falcon.HTTP_500
+            resp.body = json.dumps({'error': 'wrong_job_id'})
+
+
 class CallbackTelegramWebhook(object):
     def on_post(self, req, resp):
-        bot_dispatcher.process_update(Update.de_json(json.load(req.bounded_stream), bot))
+        with metrics.timer('webhook.request'):
+            bot_dispatcher.process_update(Update.de_json(json.load(req.bounded_stream), bot))
 
         resp.status = falcon.HTTP_200
         resp.body = json.dumps({'status': 'ok'})
 
 
+class MetricsResource(object):
+    def on_get(self, req, resp):
+        token = env('METRICS_TOKEN', cast=str, default=None)
+
+        # без токена метрики наружу не отдаем совсем
+        if not token or not hmac.compare_digest(req.get_header('Authorization', default=''), f'Bearer {token}'):
+            raise falcon.HTTPNotFound()
+
+        resp.status = falcon.HTTP_200
+        resp.content_type = 'text/plain; version=0.0.4'
+        resp.data = metrics.registry.render_prometheus()
+
+
 class CallbackIndex(object):
     def on_get(self, req, resp):
         resp.status = falcon.HTTP_200
         resp.body = json.dumps({'status': 'lucky_you'})
 
 
-bot = Bot(env('TELEGRAM_API_TOKEN'))
+bot = get_bot()
 reset_webhook(bot, env('WILDSEARCH_WEBHOOKS_DOMAIN'), env('TELEGRAM_API_TOKEN'))
 bot_dispatcher = start_bot(bot)
 
 app = falcon.API()
 app.req_options.auto_parse_form_urlencoded = True
 
-app.add_route('/callback/wb_category_export', CallbackWbCategoryExportResource())
+# у каждой площадки свои адреса колбэков, обработка выгрузки общая
+for marketplace in marketplaces.registry:
+    app.add_route('/callback/' + marketplace.callback_route('category_export'), CallbackWbCategoryExportResource())
+    app.add_route('/callback/' + marketplace.callback_route('category_digest'), CallbackWbCategoryDigestResource())
+
 app.add_route('/' + env('TELEGRAM_API_TOKEN'), CallbackTelegramWebhook())
+app.add_route('/metrics', MetricsResource())
 app.add_route('/', CallbackIndex())
+
+# стили, шрифты и иконки веб-версии отчета
+for folder in ['css', 'fonts', 'images']:
+    app.add_static_route(f'/report/{folder}', base_path + folder)
@@ -142,6 +142,8 @@ def set_scrapinghub_requests_mock(requests_mock, sample_category_data_raw):
         requests_mock.get('https://storage.scrapinghub.com/ids/414324/spider/ozon', text='1')
         requests_mock.get('https://storage.scrapinghub.com/jobq/414324/count?state=pending&spider=wb', text=f'{pending_count}')
         requests_mock.get('https://storage.scrapinghub.com/jobq/414324/count?state=running&spider=wb', text=f'{running_count}')
+        requests_mock.get('https://storage.scrapinghub.com/jobq/414324/count?state=pending&spider=ozon', text=f'{pending_count}')
+        requests_mock.get('https://storage.scrapinghub.com/jobq/414324/count?state=running&spider=ozon', text=f'{running_count}')
         requests_mock.post('https://app.scrapinghub.com/api/run.json', json={'status': 'ok', 'jobid': f'{job_id}'})
         requests_mock.get(f'https://storage.scrapinghub.com/items/{job_id}?meta=_key', content=sample_category_data_raw(source=result_source), headers={'Content-Type': 'application/x-msgpack; charset=UTF-8'})
         requests_mock.get(f'https://storage.scrapinghub.com/jobs/{job_id}/state', text='"finished"')
@@ -191,7 +193,10 @@ def models(db):
     """Emulate the transaction -- create a new db before each test and flush it after.
     Also, return the app.models module"""
     from src import models
-    app_models = [models.User, models.LogCommandItem]
+    app_models = [models.User, models.LogCommandItem, models.CategorySnapshot, models.CategorySnapshotDelta,
+                  models.CategoryItemState, models.CategoryAggregate, models.CategoryJob,
+                  models.CategoryJobRecipient, models.DueNotification, models.Broadcast, models.BroadcastMessage,
+                  models.CrmSyncItem]
 
     db.bind(app_models, bind_refs=False, bind_backrefs=False)
     db.connect()
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from src import assets
+from src.assets import ImageCache, asset_url_fetcher, prefetch_images, report_image_urls
+
+
+@pytest.fixture()
+def image_cache(tmp_path, monkeypatch):
+    cache = ImageCache(str(tmp_path), max_bytes=1024)
+    monkeypatch.setattr(assets, '_image_cache', cache)
+    monkeypatch.setattr(assets, '_failed_urls', {})
+
+    return cache
+
+
+def test_image_cache_evicts_least_recently_used(image_cache):
+    for index in range(3):
+        image_cache.put(f'http://img/{index}.jpg', b'x' * 400)
+        os.utime(image_cache.file_path(f'http://img/{index}.jpg'), (index, index))
+
+    image_cache.get('http://img/0.jpg')
+    image_cache.evict()
+
+    assert image_cache.get('http://img/0.jpg') is not None
+    assert image_cache.get('http://img/1.jpg') is None
+    assert image_cache.get('http://img/2.jpg') is not None
+
+
+def test_report_image_urls_are_unique_and_remote():
+    html = '<img src="images/t1.png"><img src="http://img/1.jpg"><img src="http://img/2.jpg"><img src="http://img/1.jpg">'
+
+    assert report_image_urls(html) == ['http://img/1.jpg', 'http://img/2.jpg']
+
+
+def test_prefetched_images_are_served_from_cache(image_cache, requests_mocker):
+    requests_mocker.get('http://img/1.jpg', content=b'jpeg')
+    requests_mocker.get('http://img/2.jpg', status_code=404)
+
+    prefetch_images(['http://img/1.jpg', 'http://img/2.jpg'])
+
+    assert asset_url_fetcher('http://img/1.jpg')['string'] == b'jpeg'
+    with pytest.raises(IOError):
+        asset_url_fetcher('http://img/2.jpg')
+
+    # ни одного повторного запроса: первая картинка в кеше, вторая недавно была недоступна
+    assert requests_mocker.call_count == 2
+
+
+def test_local_assets_are_read_once(tmp_path):
+    icon = tmp_path / 'star.png'
+    icon.write_bytes(b'png')
+
+    assert asset_url_fetcher(f'file://{icon}')['string'] == b'png'
+
+    icon.write_bytes(b'changed')
+
+    assert asset_url_fetcher(f'file://{icon}') == {'string': b'png', 'mime_type': 'image/png', 'redirected_url': f'file://{icon}'}
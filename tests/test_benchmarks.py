@@ -0,0 +1,56 @@
+import json
+from urllib.request import urlopen
+
+from seller_stats.category_stats import CategoryStats
+from telegram import Update
+
+from benchmarks.report_pipeline import compare_results
+from benchmarks.stubs import StubServer
+from benchmarks.synthetic import generate_category_items
+from benchmarks.webhook_load import UpdateFactory, summarize
+
+
+def test_synthetic_category_is_reproducible():
+    items = generate_category_items(200, seed=1)
+
+    assert len(items) == 200
+    assert items == generate_category_items(200, seed=1)
+    assert len(CategoryStats(data=items).df.index) == 200
+
+
+def test_compare_results_finds_regressions():
+    previous = {'results': {'1k': {'timings': {'render.html': 1.0, 'report.to_dict': 1.0}}}}
+    current = {'results': {'1k': {'timings': {'render.html': 1.1, 'report.to_dict': 1.5, 'render.pdf': 3.0}}}}
+
+    assert compare_results(previous, current, threshold=0.2) == [('1k', 'report.to_dict', 1.0, 1.5)]
+
+
+def test_update_factory_builds_valid_updates():
+    factory = UpdateFactory(users=10)
+
+    for kind in factory.kinds:
+        update = Update.de_json(factory.make(kind), None)
+
+        assert update.effective_chat.id == update.effective_user.id
+        assert 1000000 <= update.effective_chat.id < 1000010
+
+    assert factory.make('start')['update_id'] != factory.make('start')['update_id']
+
+
+def test_summarize_counts_errors_per_kind():
+    summary = summarize([('start', 0.1, True), ('start', 0.3, False), ('catalog', 0.2, True)], duration=1)
+
+    assert summary['start']['error_rate'] == 0.5
+    assert summary['catalog']['p50'] == 200
+    assert summary['all']['requests'] == 3
+
+
+def test_stub_server_answers_telegram():
+    server = StubServer().start()
+
+    # requests перехвачен requests_mock, поэтому обращаемся к серверу через urllib
+    response = urlopen(server.environ()['TELEGRAM_API_BASE_URL'] + '123:token/sendMessage', data=b'chat_id=5&text=Hi')
+    server.shutdown()
+
+    assert json.load(response)['result']['chat']['id'] == 5
+    assert server.requests == {'/telegram/bot123:token/sendMessage': 1}
@@ -12,6 +12,8 @@ from src.tasks import send_category_requests_count_message
     ['https://www.wildberries.ru/catalog/dom-i-dacha/tovary-dlya-remonta/instrumenty/magnitnye-instrumenty'],
     ['https://www.wildberries.ru/catalog/0/search.aspx?subject=99&search=сапоги&sort=popular'],
     ['https://www.wildberries.ru/search?text=одеяло%201,5%20спальное'],
+    ['https://www.ozon.ru/category/elektronika-15500/'],
+    ['https://www.ozon.ru/brand/xiaomi-32686750/'],
 ])
 @patch('src.tasks.schedule_category_export.apply_async')
 def test_command_catalog_correct(mocked_celery_delay, web_app, telegram_json_message, message):
@@ -37,12 +39,12 @@ def test_command_catalog_maintenance(mocked_bot_send_message, web_app, telegram_
 
 
 @pytest.mark.parametrize('message, expected_text', [
-    ['https://www.ozon.ru/category/elektronika-15500/', 'пока не поддерживаются'],
     ['https://beru.ru/catalog/vytiazhki/80444/list?hid=90581', 'пока не поддерживаются'],
     ['https://goods.ru/catalog/avtosvet/', 'пока не поддерживаются'],
     ['https://www.lamoda.ru/c/21/shoes-sapogi/?sitelink=topmenuW&l=5', 'пока не поддерживаются'],
     ['https://tmall.ru/ru/__pc/pages/sda_appliances.htm', 'пока не поддерживаются'],
     ['https://www.wildberries.ru/catalog/12365745/detail.aspx?targetUrl=GP', 'указали неправильную команду'],
+    ['https://www.ozon.ru/product/smartfon-xiaomi-redmi-9-176845399/', 'указали неправильную команду'],
 ])
 @patch('telegram.Bot.send_message')
 def test_wrong_catalog_commands(mocked_bot_send_message, message, expected_text, web_app, telegram_json_message):
@@ -110,6 +112,27 @@ def test_reply_callbacks(mocked_bot_send_message, web_app, telegram_json_callbac
     assert expected_text in mocked_bot_send_message.call_args.kwargs['text']
 
 
+@patch('telegram.Bot.answerCallbackQuery')
+@patch('src.tasks.send_category_report.delay')
+def test_report_format_callback(mocked_send_category_report, mocked_answer_callback_query, web_app, telegram_json_callback):
+    telegram_json = telegram_json_callback(callback='report_format:html:414324/1/926')
+
+    web_app.simulate_post('/' + env('TELEGRAM_API_TOKEN'), body=telegram_json)
+
+    mocked_answer_callback_query.assert_called_once()
+    mocked_send_category_report.assert_called_once_with('414324/1/926', [383716], 'html')
+
+
+@patch('telegram.Bot.answerCallbackQuery')
+@patch('src.tasks.send_category_slice.delay')
+def test_category_slice_callback(mocked_send_category_slice, mocked_answer_callback_query, web_app, telegram_json_callback):
+    telegram_json = telegram_json_callback(callback='slice:brand=3,price=1:414324/1/926')
+
+    web_app.simulate_post('/' + env('TELEGRAM_API_TOKEN'), body=telegram_json)
+
+    mocked_send_category_slice.assert_called_once_with('414324/1/926', 383716, 'brand=3,price=1')
+
+
 @patch('telegram.Bot.send_message')
 def test_left_requests_messages(mocked_bot_send_message, create_telegram_command_logs, bot_user):
     create_telegram_command_logs(2, 'wb_catalog', 'https://www.wildberries.ru/catalog/knigi-i-diski/kantstovary/tochilki')
@@ -0,0 +1,109 @@
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from telegram.error import RetryAfter, TimedOut, Unauthorized
+
+from src.broadcast import Broadcaster, TokenBucket
+from src.models import Broadcast, BroadcastMessage, User
+
+
+@pytest.fixture()
+def broadcast_users():
+    def _broadcast_users(count=3, subscribed=False):
+        for chat_id in range(1, count + 1):
+            User.create(chat_id=chat_id, subscribe_to_wb_categories_updates=subscribed)
+
+    return _broadcast_users
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=50, capacity=1)
+
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+
+    assert time.monotonic() - start >= 0.09
+
+
+def test_broadcast_recipients(broadcast_users, bot_user):
+    broadcast_users(3)
+    bot_user.subscribe_to_wb_categories_updates = True
+    bot_user.save()
+
+    assert len(Broadcast.create(text='Hi').pending_chat_ids()) == 4
+    assert Broadcast.create(text='Hi', recipients='subscribed').pending_chat_ids() == [bot_user.chat_id]
+    assert Broadcast.create(text='Hi', chat_ids='1,3').pending_chat_ids() == [1, 3]
+
+
+def test_broadcaster_sends_all(broadcast_users):
+    broadcast_users(5)
+    bot = MagicMock()
+    broadcast = Broadcast.create(text='Hi')
+
+    counters = Broadcaster(bot, broadcast, workers=2, rate=1000).run()
+
+    assert counters == {'sent': 5, 'failed': 0, 'timed_out': 0}
+    assert bot.send_message.call_count == 5
+    assert broadcast.status == 'finished'
+    assert BroadcastMessage.select().where(BroadcastMessage.status == 'sent').count() == 5
+
+
+def test_broadcaster_resumes(broadcast_users):
+    broadcast_users(4)
+    bot = MagicMock()
+    broadcast = Broadcast.create(text='Hi')
+    BroadcastMessage.create(broadcast=broadcast, user=1, status='sent', sent_at=broadcast.created_at)
+    BroadcastMessage.create(broadcast=broadcast, user=2, status='failed', sent_at=broadcast.created_at)
+    BroadcastMessage.create(broadcast=broadcast, user=3, status='timed_out', sent_at=broadcast.created_at)
+
+    Broadcaster(bot, broadcast, workers=2, rate=1000).run()
+
+    assert sorted(call.kwargs['chat_id'] for call in bot.send_message.call_args_list) == [2, 4]
+    assert BroadcastMessage.get(BroadcastMessage.user == 2).status == 'sent'
+
+
+def test_broadcaster_does_not_repeat_timed_out_message(broadcast_users):
+    broadcast_users(1)
+    bot = MagicMock()
+    bot.send_message.side_effect = TimedOut()
+
+    counters = Broadcaster(bot, Broadcast.create(text='Hi'), workers=1, rate=1000).run()
+
+    assert counters == {'sent': 0, 'failed': 0, 'timed_out': 1}
+    assert bot.send_message.call_count == 1
+    assert BroadcastMessage.get().status == 'timed_out'
+
+
+def test_broadcaster_saves_progress_in_small_batches(broadcast_users, monkeypatch):
+    broadcast_users(5)
+    saved = []
+    broadcaster = Broadcaster(MagicMock(), Broadcast.create(text='Hi'), workers=1, rate=1000)
+    monkeypatch.setattr(broadcaster, 'save_results', lambda results: saved.append(len(results)))
+
+    broadcaster.run(progress_every=2)
+
+    assert saved == [2, 2, 1]
+
+
+def test_broadcaster_retries_after_flood_control(broadcast_users):
+    broadcast_users(1)
+    bot = MagicMock()
+    bot.send_message.side_effect = [RetryAfter(0.01), None]
+
+    counters = Broadcaster(bot, Broadcast.create(text='Hi'), workers=1, rate=1000).run()
+
+    assert counters == {'sent': 1, 'failed': 0, 'timed_out': 0}
+    assert bot.send_message.call_count == 2
+
+
+def test_broadcaster_records_blocked_users(broadcast_users):
+    broadcast_users(1)
+    bot = MagicMock()
+    bot.send_message.side_effect = Unauthorized('Forbidden: bot was blocked by the user')
+
+    counters = Broadcaster(bot, Broadcast.create(text='Hi'), workers=1, rate=1000).run()
+
+    assert counters == {'sent': 0, 'failed': 1, 'timed_out': 0}
+    assert 'blocked' in BroadcastMessage.get().error
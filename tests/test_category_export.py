@@ -1,13 +1,19 @@
-from unittest.mock import patch
+import pstats
+from datetime import datetime, timedelta
+from unittest.mock import Mock, patch
+from urllib.parse import unquote
 
 import pytest
 from celery.exceptions import Retry
 from freezegun import freeze_time
+from telegram.error import Unauthorized
 
 from src.helpers import category_export, init_scrapinghub, scheduled_jobs_count
-from src.models import log_command
-from src.tasks import (calculate_category_stats, check_requests_count_recovered, get_cat_update_users,
-                       schedule_category_export, send_category_requests_count_message)
+from src.models import CategoryJob, DueNotification, User, log_command, schedule_notification
+from src.profiling import JobProfiler
+from src.tasks import (calculate_category_stats, check_requests_count_recovered, deliver_category_report, get_cat_update_users,
+                       mark_category_job_analysed, schedule_category_export, send_category_report, send_category_requests_count_message,
+                       send_due_notifications)
 
 
 def test_scheduled_jobs_count(set_scrapinghub_requests_mock):
@@ -28,6 +34,13 @@ def test_category_export_too_many_jobs_exception(set_scrapinghub_requests_mock):
     assert str(e_info.value) == 'Spider wb has more than SCHEDULED_JOBS_THRESHOLD queued jobs'
 
 
+def test_category_export_own_threshold(set_scrapinghub_requests_mock):
+    set_scrapinghub_requests_mock(pending_count=1, running_count=0)
+
+    with pytest.raises(Exception, match='queued jobs'):
+        category_export('https://www.wildberries.ru/category/dummy', threshold=0)
+
+
 def test_get_cat_update_users(bot_user):
     bot_user.subscribe_to_wb_categories_updates = True
     bot_user.save()
@@ -46,17 +59,75 @@ def test_category_export_correct(set_scrapinghub_requests_mock):
     assert result_url == 'https://app.scrapinghub.com/p/123/1/1234'
 
 
-@patch('src.tasks.check_requests_count_recovered.apply_async')
+def test_category_export_runs_spider_of_the_marketplace(set_scrapinghub_requests_mock, requests_mock):
+    set_scrapinghub_requests_mock(job_id='123/2/1234')
+
+    category_export('https://www.ozon.ru/category/elektronika-15500/', 321)
+
+    run_request = requests_mock.request_history[-1]
+    assert 'spider=ozon' in run_request.text
+    assert 'ozon_category_export' in unquote(run_request.text)
+
+
 @patch('telegram.Bot.send_message')
-def test_schedule_category_export_correct(mocked_send_message, mocked_check_requests_count_recovered, bot_user, set_scrapinghub_requests_mock):
+def test_schedule_category_export_correct(mocked_send_message, bot_user, set_scrapinghub_requests_mock):
     set_scrapinghub_requests_mock(job_id='123/1/1234')
 
     log_item = log_command(bot_user, 'wb_catalog', 'la-la-la')
 
-    schedule_category_export('https://www.wildberries/category/url', bot_user.chat_id, log_item.id)
+    with freeze_time('2030-06-15 01:20:00'):
+        schedule_category_export('https://www.wildberries/category/url', bot_user.chat_id, log_item.id)
+
+    notification = DueNotification.get(DueNotification.user == bot_user.chat_id)
 
     assert 'Мы обрабатываем ваш запрос' in mocked_send_message.call_args.kwargs['text']
-    mocked_check_requests_count_recovered.assert_called()
+    assert notification.kind == 'requests_recovered'
+    assert notification.due_at == datetime(2030, 6, 16, 1, 21)
+
+
+@patch('src.tasks.check_requests_count_recovered.apply_async')
+@patch('telegram.Bot.send_message')
+def test_schedule_category_export_coalesces_requests(mocked_send_message, mocked_check_requests_count_recovered, bot_user, set_scrapinghub_requests_mock, requests_mock):
+    set_scrapinghub_requests_mock(job_id='123/1/1234')
+    another_user = User.create(chat_id=100500, user_name='another_user')
+
+    for user in [bot_user, another_user]:
+        log_item = log_command(user, 'wb_catalog', 'la-la-la')
+        schedule_category_export('https://www.wildberries.ru/catalog/knigi-i-diski/', user.chat_id, log_item.id)
+
+    runs = [request for request in requests_mock.request_history if request.url.endswith('/api/run.json')]
+    job = CategoryJob.get(CategoryJob.job_id == '123/1/1234')
+
+    assert len(runs) == 1
+    assert job.category_url == 'https://www.wildberries.ru/catalog/knigi-i-diski'
+    assert job.chat_ids() == [bot_user.chat_id, another_user.chat_id]
+
+
+@patch('src.tasks.calculate_category_stats.delay')
+@patch('src.tasks.category_export')
+@patch('src.tasks.check_requests_count_recovered.apply_async')
+@patch('telegram.Bot.send_message')
+def test_schedule_category_export_reuses_fresh_analysis(mocked_send_message, mocked_check_requests_count_recovered, mocked_category_export, mocked_calculate_category_stats, bot_user):
+    CategoryJob.create(job_id='123/1/1234', category_url='https://www.wildberries.ru/catalog/knigi-i-diski', state='analysed')
+    log_item = log_command(bot_user, 'wb_catalog', 'la-la-la')
+
+    schedule_category_export('https://www.wildberries.ru/catalog/knigi-i-diski/', bot_user.chat_id, log_item.id)
+
+    mocked_category_export.assert_not_called()
+    mocked_calculate_category_stats.assert_called_once_with(job_id='123/1/1234', chat_id=bot_user.chat_id, profile=False)
+
+
+@patch('src.tasks.check_requests_count_recovered.apply_async')
+@patch('telegram.Bot.send_message')
+def test_schedule_category_export_profiles_requests_from_listed_chats(mocked_send_message, mocked_check_requests_count_recovered, bot_user, set_scrapinghub_requests_mock, requests_mock, monkeypatch):
+    monkeypatch.setenv('PROFILING_CHAT_IDS', f'100500, {bot_user.chat_id}')
+    set_scrapinghub_requests_mock(job_id='123/1/1234')
+    log_item = log_command(bot_user, 'wb_catalog', 'la-la-la')
+
+    schedule_category_export('https://www.wildberries.ru/catalog/knigi-i-diski/', bot_user.chat_id, log_item.id)
+
+    run_request = [request for request in requests_mock.request_history if request.url.endswith('/api/run.json')][-1]
+    assert 'profile=1' in unquote(run_request.text)
 
 
 @patch('src.tasks.category_export')
@@ -94,6 +165,172 @@ def test_category_export_task_sends_message(mocked_send_message, mocked_send_doc
     mocked_send_category_requests_count_message.assert_called()
 
 
+@patch('src.tasks.track_amplitude.delay')
+@patch('src.tasks.send_category_requests_count_message.delay')
+@patch('src.tasks.send_category_report.delay')
+@patch('src.tasks.send_category_card.delay')
+@patch('src.tasks.save_report_card', return_value=True)
+@patch('src.tasks.save_report_context', return_value=True)
+@patch('src.viewmodels.report.Report.to_card_dict', return_value={'category_name': 'Точилки'})
+@patch('src.viewmodels.report.Report.to_dict', return_value={'category_name': 'Точилки'})
+@patch('telegram.Bot.edit_message_reply_markup')
+@patch('telegram.Bot.send_message')
+def test_category_export_task_delivers_in_stages(mocked_send_message, mocked_edit_message_reply_markup, mocked_to_dict, mocked_to_card_dict, mocked_save_report_context,
+                                                 mocked_save_report_card, mocked_send_category_card, mocked_send_category_report, mocked_requests_count, mocked_track_amplitude, set_scrapinghub_requests_mock, bot_user, monkeypatch):
+    monkeypatch.setenv('REPORT_DEFAULT_FORMAT', 'pdf')
+    set_scrapinghub_requests_mock(job_id='414324/1/926')
+
+    calculate_category_stats('414324/1/926', bot_user.chat_id)
+
+    assert 'Краткая сводка' in mocked_send_message.call_args.kwargs['text']
+    mocked_save_report_card.assert_called_once_with('414324/1/926', {'category_name': 'Точилки'})
+    assert mocked_send_category_card.call_args.args == ('414324/1/926', [bot_user.chat_id])
+    mocked_send_category_report.assert_called_once_with('414324/1/926', [bot_user.chat_id], 'pdf', profile=False)
+    mocked_edit_message_reply_markup.assert_called_once()
+
+
+@patch('src.tasks.track_amplitude.delay')
+@patch('src.tasks.send_category_requests_count_message.delay')
+@patch('src.tasks.send_category_report.delay')
+@patch('src.tasks.send_category_card.delay')
+@patch('src.tasks.save_report_card', return_value=True)
+@patch('src.tasks.save_report_context', return_value=True)
+@patch('src.viewmodels.report.Report.to_card_dict', return_value={'category_name': 'Точилки'})
+@patch('src.viewmodels.report.Report.to_dict', return_value={'category_name': 'Точилки'})
+@patch('telegram.Bot.edit_message_reply_markup')
+@patch('telegram.Bot.send_message')
+def test_category_export_task_delivers_to_every_recipient(mocked_send_message, mocked_edit_message_reply_markup, mocked_to_dict, mocked_to_card_dict, mocked_save_report_context,
+                                                          mocked_save_report_card, mocked_send_category_card, mocked_send_category_report, mocked_requests_count, mocked_track_amplitude, set_scrapinghub_requests_mock, bot_user):
+    set_scrapinghub_requests_mock(job_id='414324/1/926')
+    job = CategoryJob.create(job_id='414324/1/926', category_url='https://www.wildberries.ru/catalog/knigi-i-diski')
+    job.add_recipient(bot_user)
+    job.add_recipient(User.create(chat_id=100500, user_name='another_user'))
+    job.set_state('finished')
+
+    calculate_category_stats('414324/1/926')
+
+    job = CategoryJob.get_by_id(job.id)
+    mocked_send_category_report.assert_called_once_with('414324/1/926', [bot_user.chat_id, 100500], 'png', profile=False)
+    mocked_send_category_card.assert_not_called()
+    assert mocked_edit_message_reply_markup.call_count == 2
+    assert job.state == 'analysed'
+    assert job.items_count > 0
+
+
+@patch('src.tasks.track_amplitude.delay')
+@patch('src.tasks.send_category_requests_count_message.delay')
+@patch('src.tasks.send_category_report.delay')
+@patch('src.tasks.send_category_card.delay')
+@patch('src.tasks.save_report_card', return_value=True)
+@patch('src.tasks.save_report_context', return_value=True)
+@patch('src.viewmodels.report.Report.to_card_dict', return_value={'category_name': 'Точилки'})
+@patch('src.viewmodels.report.Report.to_dict', return_value={'category_name': 'Точилки'})
+@patch('telegram.Bot.edit_message_reply_markup')
+@patch('telegram.Bot.send_message')
+def test_category_export_task_skips_blocked_recipient(mocked_send_message, mocked_edit_message_reply_markup, mocked_to_dict, mocked_to_card_dict, mocked_save_report_context,
+                                                      mocked_save_report_card, mocked_send_category_card, mocked_send_category_report, mocked_requests_count, mocked_track_amplitude, set_scrapinghub_requests_mock, bot_user):
+    set_scrapinghub_requests_mock(job_id='414324/1/926')
+    job = CategoryJob.create(job_id='414324/1/926', category_url='https://www.wildberries.ru/catalog/knigi-i-diski')
+    job.add_recipient(User.create(chat_id=100500, user_name='blocked_user'))
+    job.add_recipient(bot_user)
+    job.set_state('finished')
+
+    def send_message(chat_id, **kwargs):
+        if chat_id == 100500:
+            raise Unauthorized('Forbidden: bot was blocked by the user')
+        return Mock()
+
+    mocked_send_message.side_effect = send_message
+
+    calculate_category_stats('414324/1/926')
+
+    assert mocked_send_category_report.call_args.args[1] == [bot_user.chat_id]
+    assert mocked_edit_message_reply_markup.call_count == 1
+    mocked_requests_count.assert_called_once_with(bot_user.chat_id)
+
+
+@patch('src.tasks.track_amplitude.delay')
+@patch('src.tasks.send_category_requests_count_message.delay')
+@patch('src.tasks.send_category_report.delay')
+@patch('src.tasks.send_category_card.delay')
+@patch('src.tasks.save_report_card', return_value=True)
+@patch('src.tasks.save_report_context', return_value=True)
+@patch('src.viewmodels.report.Report.to_card_dict', return_value={'category_name': 'Точилки'})
+@patch('src.viewmodels.report.Report.to_dict', return_value={'category_name': 'Точилки'})
+@patch('telegram.Bot.edit_message_reply_markup')
+@patch('telegram.Bot.send_message')
+def test_category_export_task_delivers_to_late_recipients(mocked_send_message, mocked_edit_message_reply_markup, mocked_to_dict, mocked_to_card_dict, mocked_save_report_context,
+                                                          mocked_save_report_card, mocked_send_category_card, mocked_send_category_report, mocked_requests_count, mocked_track_amplitude, set_scrapinghub_requests_mock, bot_user):
+    set_scrapinghub_requests_mock(job_id='414324/1/926')
+    job = CategoryJob.create(job_id='414324/1/926', category_url='https://www.wildberries.ru/catalog/knigi-i-diski')
+    job.add_recipient(bot_user)
+    job.set_state('finished')
+
+    def _join_while_analysing(job, *args, **kwargs):
+        job.add_recipient(User.create(chat_id=100500))
+        mark_category_job_analysed(job, *args, **kwargs)
+
+    with patch('src.tasks.mark_category_job_analysed', side_effect=_join_while_analysing):
+        calculate_category_stats('414324/1/926')
+
+    with freeze_time(datetime.now() + timedelta(minutes=1)):
+        job.add_recipient(User.create(chat_id=100501))
+
+    assert mocked_send_category_report.call_args.args[1] == [bot_user.chat_id, 100500]
+    assert mocked_send_category_report.call_args.args[1] == job.chat_ids(joined_before=CategoryJob.get_by_id(job.id).analysed_at)
+
+
+@patch('src.tasks.track_amplitude.delay')
+@patch('src.tasks.send_category_requests_count_message.delay')
+@patch('src.tasks.send_category_card.delay')
+@patch('src.tasks.save_report_card', return_value=True)
+@patch('src.tasks.save_report_context', return_value=True)
+@patch('src.viewmodels.report.Report.to_card_dict', return_value={'category_name': 'Точилки'})
+@patch('src.viewmodels.report.Report.to_dict', return_value={'category_name': 'Точилки'})
+@patch('telegram.Bot.edit_message_reply_markup')
+@patch('telegram.Bot.send_message')
+def test_category_export_task_queues_report_before_dataset(mocked_send_message, mocked_edit_message_reply_markup, mocked_to_dict, mocked_to_card_dict, mocked_save_report_context,
+                                                           mocked_save_report_card, mocked_send_category_card, mocked_requests_count, mocked_track_amplitude, set_scrapinghub_requests_mock, bot_user):
+    set_scrapinghub_requests_mock(job_id='414324/1/926')
+    calls = Mock()
+
+    with patch('src.tasks.send_category_report.delay', calls.send_category_report), patch('src.tasks.save_category_stats', calls.save_category_stats):
+        calculate_category_stats('414324/1/926', bot_user.chat_id)
+
+    assert [name for name, args, kwargs in calls.mock_calls] == ['send_category_report', 'save_category_stats']
+
+
+@patch('src.tasks.track_amplitude.delay')
+@patch('src.tasks.generate_report_pdf_file')
+@patch('src.tasks.load_report_context')
+@patch('telegram.Bot.send_document')
+def test_shared_report_is_rendered_once(mocked_send_document, mocked_load_report_context, mocked_generate_report_pdf_file, mocked_track_amplitude, bot_user):
+    mocked_load_report_context.return_value = {'report': {'base_username': None}, 'name': 'Точилки'}
+
+    send_category_report('414324/1/926', [bot_user.chat_id, 100500], 'pdf')
+
+    mocked_generate_report_pdf_file.assert_called_once()
+    assert mocked_generate_report_pdf_file.call_args.args[0]['base_username'] is None
+    assert mocked_send_document.call_count == 2
+    assert mocked_send_document.call_args.kwargs['document'] == mocked_send_document.return_value.document.file_id
+
+
+@patch('src.tasks.render_report_pdf_parallel')
+@patch('src.tasks.render_report_page_groups')
+@patch('telegram.Bot.send_document')
+def test_report_upload_is_profiled_apart_from_rendering(mocked_send_document, mocked_render_report_page_groups, mocked_render_report_pdf_parallel, bot_user):
+    profiler = JobProfiler('414324/1/926', enabled=True)
+
+    deliver_category_report([bot_user.chat_id], job_id='414324/1/926', context={'report': {}, 'name': 'Точилки'}, report_format='pdf', profiler=profiler)
+
+    upload_functions = [function for file, line, function in pstats.Stats(*profiler.profiles['upload']).stats]
+
+    mocked_send_document.assert_called_once()
+    assert set(profiler.timings.keys()) == {'render_html', 'render_pdf', 'upload'}
+    assert 'send_file_to_chats' in upload_functions
+    assert 'render_report_pdf_parallel' not in upload_functions
+
+
 @patch('telegram.Bot.send_message')
 def test_category_export_task_not_finished(mocked_send_message, set_scrapinghub_requests_mock, bot_user, requests_mock):
     requests_mock.get('https://storage.scrapinghub.com/jobs/414324/1/926/state', text='"running"')
@@ -127,8 +364,9 @@ def test_category_export_task_sends_correct_filenames(mocked_send_message, mocke
     assert expected_marketplace in mocked_send_document.call_args.kwargs['filename']
 
 
+@patch('src.tasks.track_amplitude.delay')
 @patch('telegram.Bot.send_message')
-def _test_check_requests_count_recovered_fully(mocked_send_message, bot_user, create_telegram_command_logs):
+def test_check_requests_count_recovered_fully(mocked_send_message, mocked_track_amplitude, bot_user, create_telegram_command_logs):
     bot_user.save()
 
     with freeze_time('2030-06-15 01:20:00'):
@@ -152,6 +390,21 @@ def test_check_requests_count_recovered_not_fully(mocked_send_message, bot_user,
         mocked_send_message.assert_not_called()
 
 
+@patch('src.tasks.check_requests_count_recovered.delay')
+def test_send_due_notifications_takes_only_due(mocked_check_requests_count_recovered, bot_user):
+    another_user = User.create(chat_id=100500, user_name='another_user')
+
+    with freeze_time('2030-06-15 01:20:00'):
+        schedule_notification(bot_user.chat_id, 'requests_recovered', due_at=datetime(2030, 6, 16, 1, 21))
+        schedule_notification(another_user.chat_id, 'requests_recovered', due_at=datetime(2030, 6, 16, 2, 0))
+
+    with freeze_time('2030-06-16 01:30:00'):
+        send_due_notifications()
+
+    mocked_check_requests_count_recovered.assert_called_once_with(bot_user.chat_id)
+    assert [notification.user_id for notification in DueNotification.select()] == [another_user.chat_id]
+
+
 @patch('telegram.Bot.send_message')
 def test_send_category_requests_count_message(mocked_send_message, bot_user, create_telegram_command_logs):
     bot_user.daily_catalog_requests_limit = 5
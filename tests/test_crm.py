@@ -0,0 +1,108 @@
+import json
+import re
+
+import pytest
+from freezegun import freeze_time
+from requests.exceptions import HTTPError
+
+from src.models import CrmSyncItem, User, get_users_to_sync_with_crm
+from src.tasks import sync_users_to_crm
+
+
+@pytest.fixture()
+def set_airtable(monkeypatch, requests_mocker):
+    monkeypatch.setenv('AIRTABLE_API_KEY', 'dummy_airtable_key')
+    monkeypatch.setenv('AIRTABLE_BASE_KEY', 'base')
+    monkeypatch.setenv('AIRTABLE_CRM_TABLE', 'crm')
+
+    def _records_response(request, context):
+        records = request.json()['records']
+        return {'records': [{'id': record.get('id', f'rec{record["fields"]["ID чата"]}'), 'fields': record['fields']} for record in records]}
+
+    requests_mocker.get(re.compile('https://api.airtable.com/v0/base/crm'), json={'records': []})
+    requests_mocker.post(re.compile('https://api.airtable.com/v0/base/crm'), json=_records_response)
+    requests_mocker.patch(re.compile('https://api.airtable.com/v0/base/crm'), json=_records_response)
+
+    return requests_mocker
+
+
+def test_users_to_sync_with_crm(bot_user):
+    with freeze_time('2030-01-15'):
+        CrmSyncItem.create(user=User.create(chat_id=1), record_id='rec1', synced_at='2030-01-16')
+        CrmSyncItem.create(user=User.create(chat_id=2), record_id='rec2', synced_at='2030-01-14')
+
+    assert sorted(user.chat_id for user in get_users_to_sync_with_crm()) == [2, bot_user.chat_id]
+
+
+def test_sync_users_to_crm_batches_new_users(set_airtable):
+    for chat_id in range(1, 13):
+        User.create(chat_id=chat_id, full_name=f'User {chat_id}')
+
+    sync_users_to_crm()
+
+    inserts = [request for request in set_airtable.request_history if request.method == 'POST']
+    assert [len(json.loads(request.text)['records']) for request in inserts] == [10, 2]
+    assert CrmSyncItem.select().count() == 12
+    assert CrmSyncItem.get(CrmSyncItem.user == 5).record_id == 'rec5'
+
+
+def test_sync_users_to_crm_keeps_inserted_chunks_on_failure(set_airtable):
+    for chat_id in range(1, 13):
+        User.create(chat_id=chat_id)
+
+    def _records_response(request, context):
+        records = request.json()['records']
+        if records[0]['fields']['ID чата'] > 10:
+            context.status_code = 422
+            return {'error': 'INVALID_REQUEST'}
+        return {'records': [{'id': f'rec{record["fields"]["ID чата"]}', 'fields': record['fields']} for record in records]}
+
+    set_airtable.post(re.compile('https://api.airtable.com/v0/base/crm'), json=_records_response)
+
+    with pytest.raises(HTTPError):
+        sync_users_to_crm()
+
+    assert sorted(item.user_id for item in CrmSyncItem.select()) == list(range(1, 11))
+    assert sorted(user.chat_id for user in get_users_to_sync_with_crm()) == [11, 12]
+
+
+def test_sync_users_to_crm_links_users_already_in_crm(set_airtable):
+    for chat_id in range(1, 4):
+        User.create(chat_id=chat_id)
+
+    set_airtable.get(re.compile('https://api.airtable.com/v0/base/crm'), json={'records': [
+        {'id': 'recOld1', 'fields': {'ID чата': 1}},
+        {'id': 'recOld2', 'fields': {'ID чата': 2}},
+        {'id': 'recGone', 'fields': {'ID чата': 100}},
+    ]})
+
+    sync_users_to_crm()
+
+    inserts = [request for request in set_airtable.request_history if request.method == 'POST']
+    assert [record['fields']['ID чата'] for record in json.loads(inserts[0].text)['records']] == [3]
+    assert CrmSyncItem.get(CrmSyncItem.user == 1).record_id == 'recOld1'
+    assert CrmSyncItem.select().count() == 3
+
+
+def test_sync_users_to_crm_updates_changed_users(set_airtable, bot_user):
+    with freeze_time('2030-01-15'):
+        sync_users_to_crm()
+
+    with freeze_time('2030-01-16'):
+        bot_user.full_name = 'New Name'
+        bot_user.save()
+
+    with freeze_time('2030-01-17'):
+        sync_users_to_crm()
+
+    updates = [request for request in set_airtable.request_history if request.method == 'PATCH']
+    assert len(updates) == 1
+    assert json.loads(updates[0].text)['records'][0]['id'] == f'rec{bot_user.chat_id}'
+    assert json.loads(updates[0].text)['records'][0]['fields']['Имя'] == 'New Name'
+    assert len(get_users_to_sync_with_crm()) == 0
+
+
+def test_sync_users_to_crm_without_airtable(bot_user, requests_mocker):
+    sync_users_to_crm()
+
+    assert len(requests_mocker.request_history) == 0
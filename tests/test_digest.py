@@ -0,0 +1,111 @@
+from unittest.mock import patch
+
+import pytest
+from celery.exceptions import Retry
+
+from src.models import CategoryJob, CategorySnapshot, User, get_watched_categories, log_command
+from src.tasks import calculate_category_digest, export_category_digest, schedule_categories_digest
+
+
+@pytest.fixture()
+def watched_category(bot_user):
+    def _watched_category(url='https://www.wildberries.ru/catalog/knigi-i-diski/', chat_id=None):
+        user = bot_user if chat_id is None else User.get_or_create(chat_id=chat_id)[0]
+        user.subscribe_to_wb_categories_updates = True
+        user.save()
+
+        log_command(user, 'wb_catalog', url).set_status('success')
+
+    return _watched_category
+
+
+def test_get_watched_categories(watched_category, bot_user):
+    watched_category('https://www.wildberries.ru/catalog/knigi-i-diski/')
+    watched_category('https://www.wildberries.ru/catalog/knigi-i-diski')
+    watched_category('https://www.wildberries.ru/catalog/knigi-i-diski', chat_id=1001)
+    log_command(User.create(chat_id=1002), 'wb_catalog', 'https://www.wildberries.ru/catalog/igrushki').set_status('success')
+
+    watched = get_watched_categories()
+
+    assert list(watched.keys()) == ['https://www.wildberries.ru/catalog/knigi-i-diski']
+    assert watched['https://www.wildberries.ru/catalog/knigi-i-diski'] == [bot_user.chat_id, 1001]
+
+
+@patch('src.tasks.export_category_digest.apply_async')
+def test_schedule_categories_digest_respects_budget(mocked_export_category_digest, watched_category, monkeypatch):
+    monkeypatch.setenv('SETTINGS_DIGEST_CATEGORIES_BUDGET', '2')
+    monkeypatch.setenv('SETTINGS_DIGEST_EXPORT_STAGGER', '300')
+
+    watched_category('https://www.wildberries.ru/catalog/knigi')
+    watched_category('https://www.wildberries.ru/catalog/igrushki')
+    watched_category('https://www.wildberries.ru/catalog/igrushki', chat_id=1001)
+    watched_category('https://www.wildberries.ru/catalog/obuv')
+    watched_category('https://www.wildberries.ru/catalog/obuv', chat_id=1001)
+    watched_category('https://www.wildberries.ru/catalog/obuv', chat_id=1002)
+
+    schedule_categories_digest()
+
+    exported = [call.args[0][0] for call in mocked_export_category_digest.call_args_list]
+
+    assert exported == ['https://www.wildberries.ru/catalog/obuv', 'https://www.wildberries.ru/catalog/igrushki']
+    assert [call.kwargs['countdown'] for call in mocked_export_category_digest.call_args_list] == [0, 300]
+
+
+@patch('src.tasks.category_export', return_value='https://app.scrapinghub.com/p/414324/1/926')
+def test_export_category_digest_stores_subscribers(mocked_category_export, bot_user):
+    User.create(chat_id=1001)
+
+    export_category_digest('https://www.wildberries.ru/catalog/knigi/', [bot_user.chat_id, 1001])
+    job = CategoryJob.get(CategoryJob.job_id == '414324/1/926')
+
+    assert mocked_category_export.call_args.kwargs['callback'] == 'category_digest'
+    assert mocked_category_export.call_args.kwargs['threshold'] == 0
+    assert 'callback_params' not in mocked_category_export.call_args.kwargs
+    assert job.state == 'digest'
+    assert job.category_url == 'https://www.wildberries.ru/catalog/knigi'
+    assert job.chat_ids() == [bot_user.chat_id, 1001]
+
+
+@patch('src.tasks.export_category_digest.retry', side_effect=Retry())
+@patch('src.tasks.category_export')
+def test_export_category_digest_postponed_on_long_queue(mocked_category_export, mocked_retry):
+    mocked_category_export.side_effect = Exception('Spider wb has more than SCHEDULED_JOBS_THRESHOLD queued jobs')
+
+    with pytest.raises(Retry):
+        export_category_digest('https://www.wildberries.ru/catalog/knigi', [1001])
+
+    mocked_retry.assert_called_once()
+    assert CategoryJob.select().count() == 0
+
+
+@patch('src.tasks.send_digest_message.delay')
+def test_calculate_category_digest_fans_out_once(mocked_send_digest_message, set_scrapinghub_requests_mock, watched_category):
+    set_scrapinghub_requests_mock(job_id='414324/1/926')
+    category_url = 'https://www.wildberries.ru/catalog/budushchie-mamy/aksessuary/prokladki-dlya-grudi'
+    watched_category(category_url)
+    watched_category(category_url, chat_id=1001)
+
+    calculate_category_digest('414324/1/926')
+    mocked_send_digest_message.assert_not_called()
+
+    calculate_category_digest('414324/1/926')
+
+    assert CategorySnapshot.select().count() == 2
+    assert mocked_send_digest_message.call_count == 2
+    assert mocked_send_digest_message.call_args_list[0].args[1] == mocked_send_digest_message.call_args_list[1].args[1]
+    assert 'Что изменилось в категории' in mocked_send_digest_message.call_args.args[1]
+
+
+@patch('src.tasks.send_digest_message.delay')
+def test_calculate_category_digest_uses_stored_subscribers(mocked_send_digest_message, set_scrapinghub_requests_mock):
+    set_scrapinghub_requests_mock(job_id='414324/1/926')
+    User.create(chat_id=1001)
+    User.create(chat_id=1002)
+    job = CategoryJob.create(job_id='414324/1/926', category_url='https://www.wildberries.ru/catalog/knigi', state='digest')
+    job.add_recipients([1001])
+
+    calculate_category_digest('414324/1/926')
+    job.add_recipients([1001, 1002])
+    calculate_category_digest('414324/1/926')
+
+    assert [call.args[0] for call in mocked_send_digest_message.call_args_list] == [1001, 1002]
@@ -0,0 +1,83 @@
+import csv
+
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import load_workbook
+from seller_stats.category_stats import CategoryStats
+
+from src.exports import export_formats, sheet_rows, write_csv, write_xlsx
+from src.tasks import generate_category_stats_export_file
+
+
+@pytest.fixture()
+def items_df():
+    return pd.DataFrame({
+        'name': ['Точилка', 'Ластик', 'Линейка'],
+        'image_urls': [['//img/1.jpg', '//img/2.jpg'], [], ['//img/3.jpg']],
+        'price': [100.0, np.nan, 35.5],
+        'sku': [1, 1, 1],
+        'bin': pd.cut([100, 20, 35], [0, 50, 150]),
+    })
+
+
+def test_sheet_rows_are_plain_values(items_df):
+    rows = list(sheet_rows(items_df, chunk_size=2))
+
+    assert rows[0] == ['name', 'image_urls', 'price', 'sku', 'bin']
+    assert len(rows) == 4
+    assert rows[1][:4] == ['Точилка', '//img/1.jpg, //img/2.jpg', 100.0, 1]
+    assert rows[2][2] is None
+    assert rows[3][4] == '(0, 50]'
+
+
+def test_xlsx_has_every_sheet(items_df, tmp_path):
+    target = str(tmp_path / 'export.xlsx')
+
+    write_xlsx({'Товары': items_df, 'Цены': items_df.loc[:, ['price']]}, target)
+    workbook = load_workbook(target, read_only=True)
+
+    assert workbook.sheetnames == ['Товары', 'Цены']
+    assert [cell.value for cell in next(workbook['Товары'].iter_rows(min_row=2, max_row=2))][:2] == ['Точилка', '//img/1.jpg, //img/2.jpg']
+    assert len(list(workbook['Цены'].iter_rows())) == 4
+
+
+def test_csv_opens_in_excel(items_df, tmp_path):
+    target = str(tmp_path / 'export.csv')
+
+    write_csv(items_df, target)
+
+    with open(target, 'rb') as file:
+        assert file.read(3) == b'\xef\xbb\xbf'
+
+    with open(target, encoding='utf-8-sig') as file:
+        rows = list(csv.reader(file))
+
+    assert rows[0][0] == 'name'
+    assert rows[2][2] == ''
+
+
+def test_parquet_offered_only_with_pyarrow():
+    pytest.importorskip('pyarrow')
+
+    assert 'parquet' in export_formats()
+
+
+def test_category_parquet_export_file(scrapinghub_dataset):
+    pytest.importorskip('pyarrow')
+    stats = CategoryStats(data=scrapinghub_dataset(job_id='123/1/2', result_source='wb_raw'))
+
+    export_file = generate_category_stats_export_file(stats, export_format='parquet')
+
+    assert len(pd.read_parquet(export_file.name).index) == len(stats.df.index)
+
+
+def test_category_export_file(scrapinghub_dataset):
+    stats = CategoryStats(data=scrapinghub_dataset(job_id='123/1/2', result_source='wb_raw'))
+
+    export_file = generate_category_stats_export_file(stats, export_format='xlsx')
+    workbook = load_workbook(export_file.name, read_only=True)
+
+    assert workbook.sheetnames == ['Товары', 'Распределение продаж']
+    assert len(list(workbook['Товары'].iter_rows())) == len(stats.df.index) + 1
+    assert 'bin' not in stats.df.columns
@@ -0,0 +1,26 @@
+import os
+
+from src.commands.build_fonts import faces, font_face_css, used_font_weights
+from src.reports import base_path
+
+
+def test_used_font_weights():
+    css = """
+    @font-face { font-family: 'Roboto'; font-weight: 900; src: url(../fonts/Roboto-Black.ttf); }
+    .title { font-weight: 100; }
+    .subtitle { font-weight: bold; }
+    .note { font-weight: lighter; }
+    """
+
+    assert used_font_weights(css) == [100, 400, 700]
+
+
+def test_built_fonts_match_styles():
+    with open(base_path + 'css/style.css') as file:
+        weights = used_font_weights(file.read())
+
+    with open(base_path + 'css/fonts.css') as file:
+        assert file.read() == font_face_css(weights)
+
+    for weight in weights:
+        assert os.path.exists(base_path + f'fonts/subset/Roboto-{faces[weight]}.ttf')
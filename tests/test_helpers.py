@@ -5,8 +5,9 @@ import requests_mock
 from seller_stats.utils.transformers import WildsearchCrawlerOzonTransformer as ozon_transformer
 from seller_stats.utils.transformers import WildsearchCrawlerWildberriesTransformer as wb_transformer
 
-from src.helpers import (AmplitudeLogger, detect_mp_by_job_id, get_digits_text, smart_format_number,
-                         smart_format_prettify, smart_format_round_hard, smart_format_round_super_hard)
+from src.helpers import (AmplitudeLogger, detect_mp_by_job_id, get_digits_text, parent_category_url,
+                         smart_format_number, smart_format_prettify, smart_format_round_hard, smart_format_round_super_hard)
+from src.marketplaces import detect_marketplace_by_url
 
 
 @pytest.fixture()
@@ -240,3 +241,26 @@ def test_smart_format_round_super_hard(test_number, expected):
 
     assert number == expected[0]
     assert digits == expected[1]
+
+
+@pytest.mark.parametrize('url, expected', [
+    ['https://www.wildberries.ru/catalog/dlya-doma/postelnye-prinadlezhnosti/podushki', 'https://www.wildberries.ru/catalog/dlya-doma/postelnye-prinadlezhnosti'],
+    ['www.Wildberries.ru/catalog/dlya-doma/postelnye-prinadlezhnosti/podushki/?sort=popular', 'https://www.wildberries.ru/catalog/dlya-doma/postelnye-prinadlezhnosti'],
+    ['https://www.wildberries.ru/catalog', 'https://www.wildberries.ru/'],
+])
+def test_parent_category_url(url, expected):
+    assert parent_category_url(url) == expected
+
+
+@pytest.mark.parametrize('url, expected', [
+    ['https://www.wildberries.ru/catalog/zhenshchinam/odezhda/kigurumi', 'wb'],
+    ['https://www.wildberries.ru/search?text=одеяло', 'wb'],
+    ['https://www.ozon.ru/category/elektronika-15500/', 'ozon'],
+    ['ozon.ru/brand/xiaomi-32686750/', 'ozon'],
+])
+def test_detect_marketplace_by_url(url, expected):
+    assert detect_marketplace_by_url(url).spider == expected
+
+
+def test_detect_marketplace_by_url_unknown():
+    assert detect_marketplace_by_url('https://goods.ru/catalog/avtosvet/') is None
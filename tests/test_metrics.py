@@ -0,0 +1,93 @@
+import socket
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+from src import metrics
+from src.metrics import MetricsRegistry, StatsdClient, task_queue_wait
+
+
+def test_registry_renders_prometheus_histograms():
+    registry = MetricsRegistry()
+    registry.observe('report.render', 0.3, stage='pdf')
+    registry.observe('report.render', 7, stage='pdf')
+
+    text = registry.render_prometheus().decode()
+
+    assert '# TYPE wildsearch_report_render_seconds histogram' in text
+    assert 'wildsearch_report_render_seconds_count{stage="pdf"} 2.0' in text
+    assert registry.registry.get_sample_value('wildsearch_report_render_seconds_bucket', {'stage': 'pdf', 'le': '0.5'}) == 1
+    assert registry.registry.get_sample_value('wildsearch_report_render_seconds_bucket', {'stage': 'pdf', 'le': '10.0'}) == 2
+    assert registry.registry.get_sample_value('wildsearch_report_render_seconds_bucket', {'stage': 'pdf', 'le': '+Inf'}) == 2
+
+
+def test_timer_observes_duration(monkeypatch):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(metrics, 'registry', registry)
+
+    with metrics.timer('scrapinghub.load', marketplace='WB'):
+        time.sleep(0.01)
+
+    assert registry.registry.get_sample_value('wildsearch_scrapinghub_load_seconds_count', {'marketplace': 'WB'}) == 1
+    assert registry.registry.get_sample_value('wildsearch_scrapinghub_load_seconds_sum', {'marketplace': 'WB'}) >= 0.01
+
+
+def test_inconsistent_labels_do_not_break_caller():
+    registry = MetricsRegistry()
+    registry.observe('report.viewmodel', 0.1, stage='card')
+    registry.observe('report.viewmodel', 0.1)
+
+    assert registry.registry.get_sample_value('wildsearch_report_viewmodel_seconds_count', {'stage': 'card'}) == 1
+
+
+def test_multiprocess_values_are_read_from_shared_directory(monkeypatch, tmp_path):
+    monkeypatch.setenv('prometheus_multiproc_dir', str(tmp_path))
+
+    with patch('src.metrics.multiprocess.MultiProcessCollector') as mocked_collector:
+        MetricsRegistry().render_prometheus()
+
+    assert mocked_collector.call_args.kwargs['path'] == str(tmp_path)
+
+
+def test_statsd_client_sends_dogstatsd_packet():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(1)
+
+    client = StatsdClient('127.0.0.1', server.getsockname()[1], prefix='wildsearch.')
+    client.histogram('webhook.handler', 12.5, {'handler': 'help_start'})
+
+    assert server.recv(1024) == b'wildsearch.webhook.handler:12.5|h|#handler:help_start'
+
+
+def test_task_queue_wait_skips_countdown():
+    now = time.time()
+
+    assert task_queue_wait(SimpleNamespace(published_at=now - 5, eta=None)) >= 5
+    assert task_queue_wait(SimpleNamespace(published_at=now - 100, eta='2000-01-01T00:00:00+00:00')) >= 100
+    assert task_queue_wait(SimpleNamespace(eta=None)) is None
+
+
+def test_metrics_endpoint(web_app, monkeypatch):
+    monkeypatch.setenv('METRICS_TOKEN', 'secret')
+    metrics.observe('webhook.request', 0.1)
+
+    got = web_app.simulate_get('/metrics', headers={'Authorization': 'Bearer secret'})
+
+    assert got.status_code == 200
+    assert 'wildsearch_webhook_request_seconds_count' in got.text
+
+
+@pytest.mark.parametrize('token, header', [
+    ['secret', None],
+    ['secret', 'Bearer wrong'],
+    ['', 'Bearer '],
+])
+def test_metrics_endpoint_requires_token(web_app, monkeypatch, token, header):
+    monkeypatch.setenv('METRICS_TOKEN', token)
+
+    got = web_app.simulate_get('/metrics', headers={'Authorization': header} if header else None)
+
+    assert got.status_code == 404
@@ -1,10 +1,14 @@
+from contextlib import contextmanager
 from datetime import datetime
+from unittest.mock import patch
 
 import pytest
 from freezegun import freeze_time
 
-from src.models import (LogCommandItem, User, get_subscribed_to_wb_categories_updates, log_command,
-                        user_get_by_chat_id, user_get_by_update)
+from src.models import (CategoryAggregate, CategoryJob, DueNotification, LogCommandItem, User, db, get_category_neighbours,
+                        get_recent_category_job, get_subscribed_to_wb_categories_updates, log_command,
+                        pop_due_notifications, save_category_aggregate, schedule_notification, user_get_by_chat_id,
+                        user_get_by_update)
 
 
 def test_user_get_by_chat_id():
@@ -204,3 +208,94 @@ def test_get_subscribed_to_wb_categories_updates_not_subscribed(bot_user):
     subscribed_users = get_subscribed_to_wb_categories_updates()
 
     assert subscribed_users.count() == 0
+
+
+def test_category_neighbours_are_taken_from_the_same_section():
+    section = 'https://www.wildberries.ru/catalog/dlya-doma/postelnye-prinadlezhnosti/'
+
+    save_category_aggregate(section + 'podushki', {'category_name': 'Подушки', 'turnover_month': 100})
+    save_category_aggregate(section + 'odeyala/', {'category_name': 'Одеяла', 'turnover_month': 300})
+    save_category_aggregate(section + 'pledy', {'category_name': 'Пледы', 'turnover_month': 200})
+    save_category_aggregate('https://www.wildberries.ru/catalog/dlya-doma/mebel/stulya', {'category_name': 'Стулья', 'turnover_month': 500})
+
+    neighbours = get_category_neighbours(section + 'podushki/')
+
+    assert [neighbour['category_name'] for neighbour in neighbours] == ['Одеяла', 'Пледы']
+    assert neighbours[0]['category_url'] == 'https://www.wildberries.ru/catalog/dlya-doma/postelnye-prinadlezhnosti/odeyala'
+
+
+def test_category_aggregate_keeps_the_latest_state_only():
+    category_url = 'https://www.wildberries.ru/catalog/dlya-doma/postelnye-prinadlezhnosti/podushki'
+
+    save_category_aggregate(category_url, {'category_name': 'Подушки', 'goods_count': 10})
+    save_category_aggregate(category_url + '/', {'category_name': 'Подушки', 'goods_count': 12})
+
+    assert CategoryAggregate.select().count() == 1
+    assert CategoryAggregate.get().goods_count == 12
+
+
+def test_category_job_recipients_are_unique(bot_user):
+    job = CategoryJob.create(job_id='123/1/1234', category_url='https://www.wildberries.ru/catalog/knigi-i-diski')
+
+    job.add_recipient(bot_user)
+    job.add_recipient(bot_user)
+
+    assert job.chat_ids() == [bot_user.chat_id]
+
+
+def test_category_job_stage_timestamps():
+    job = CategoryJob.create(job_id='123/1/1234', category_url='https://www.wildberries.ru/catalog/knigi-i-diski')
+
+    with freeze_time('2030-01-15 01:30:00'):
+        job.set_state('finished')
+
+    with freeze_time('2030-01-15 01:32:00'):
+        job.set_state('analysed', items_count=100)
+
+    job = CategoryJob.get_by_id(job.id)
+    assert job.finished_at == datetime(2030, 1, 15, 1, 30)
+    assert job.analysed_at == datetime(2030, 1, 15, 1, 32)
+    assert job.items_count == 100
+
+
+def test_get_recent_category_job():
+    with freeze_time('2030-01-15 01:00:00'):
+        CategoryJob.create(job_id='123/1/1', category_url='https://www.wildberries.ru/catalog/knigi-i-diski')
+
+    with freeze_time('2030-01-15 01:30:00'):
+        assert get_recent_category_job('https://www.wildberries.ru/catalog/knigi-i-diski/', 'scheduled', minutes=60).job_id == '123/1/1'
+        assert get_recent_category_job('https://www.wildberries.ru/catalog/knigi-i-diski', 'analysed', minutes=60) is None
+
+    with freeze_time('2030-01-15 02:30:00'):
+        assert get_recent_category_job('https://www.wildberries.ru/catalog/knigi-i-diski', 'scheduled', minutes=60) is None
+
+
+def test_later_request_moves_due_notification(bot_user):
+    schedule_notification(bot_user.chat_id, 'requests_recovered', due_at=datetime(2030, 1, 16, 1, 30))
+    schedule_notification(bot_user.chat_id, 'requests_recovered', due_at=datetime(2030, 1, 16, 2, 30))
+
+    assert DueNotification.select().count() == 1
+
+    with freeze_time('2030-01-16 02:00:00'):
+        assert pop_due_notifications() == []
+
+    with freeze_time('2030-01-16 02:30:00'):
+        assert pop_due_notifications() == [(bot_user.chat_id, 'requests_recovered')]
+        assert pop_due_notifications() == []
+
+
+def test_notification_moved_while_taken_is_kept(bot_user):
+    schedule_notification(bot_user.chat_id, 'requests_recovered', due_at=datetime(2030, 1, 16, 1, 30))
+    atomic = db.atomic
+
+    @contextmanager
+    def _moved_after_select():
+        schedule_notification(bot_user.chat_id, 'requests_recovered', due_at=datetime(2030, 1, 17, 1, 30))
+
+        with atomic():
+            yield
+
+    with freeze_time('2030-01-16 02:00:00'), patch('src.models.db.atomic', _moved_after_select):
+        assert pop_due_notifications() == []
+
+    assert DueNotification.get().due_at == datetime(2030, 1, 17, 1, 30)
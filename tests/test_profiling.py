@@ -0,0 +1,46 @@
+import json
+import os
+import pstats
+
+import pandas as pd
+
+from src.profiling import JobProfiler, profile_prefix
+
+
+def test_disabled_profiler_saves_nothing():
+    profiler = JobProfiler('414324/1/926')
+
+    with profiler.stage('stats'):
+        sum(range(1000))
+
+    assert profiler.profiles == {}
+    assert profiler.save() is None
+
+
+def test_profile_prefix_is_path_safe():
+    assert profile_prefix('414324/1/926') == 'profiles/414324-1-926'
+
+
+def test_profiler_saves_stages_with_dataset_size(tmp_path, monkeypatch):
+    monkeypatch.setenv('PROFILING_DIR', str(tmp_path))
+    profiler = JobProfiler('414324/1/926', enabled=True)
+
+    with profiler.stage('stats'):
+        df = pd.DataFrame({'price': range(100)})
+    with profiler.stage('render_html'):
+        summary = df.describe().to_string()
+
+    profiler.describe_dataset(df, marketplace='wb')
+    assert 'price' in summary
+    path = profiler.save()
+
+    assert path == os.path.join(str(tmp_path), 'profiles', '414324-1-926')
+    assert sorted(os.listdir(path)) == ['meta.json', 'render_html.prof', 'render_html.txt', 'stats.prof', 'stats.txt']
+    assert pstats.Stats(os.path.join(path, 'stats.prof')).total_calls > 0
+
+    with open(os.path.join(path, 'meta.json')) as file:
+        meta = json.load(file)
+
+    assert meta['dataset']['items'] == 100
+    assert meta['dataset']['marketplace'] == 'wb'
+    assert set(meta['timings'].keys()) == {'stats', 'render_html'}
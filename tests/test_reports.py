@@ -0,0 +1,162 @@
+import io
+import multiprocessing
+
+import pytest
+from PyPDF2 import PdfFileReader, PdfFileWriter
+from seller_stats.category_stats import CategoryStats
+
+from src.reports import (get_executor, merge_pdf_parts, plain_report, render_report_html, render_report_page_groups, render_report_pdf_parallel,
+                         render_report_web_html, report_pages, report_render_workers, reset_executor, split_pages)
+from src.viewmodels.neighbours import NeighboursItem
+from src.viewmodels.report import Report
+
+
+@pytest.fixture()
+def report_dict(scrapinghub_dataset):
+    stats = CategoryStats(data=scrapinghub_dataset(job_id='123/1/2', result_source='wb_raw'))
+
+    return Report(stats=stats, username='username').to_dict()
+
+
+def blank_pdf(pages):
+    writer = PdfFileWriter()
+    for _ in range(pages):
+        writer.addBlankPage(width=842, height=595)
+
+    content = io.BytesIO()
+    writer.write(content)
+
+    return content.getvalue()
+
+
+def test_report_pages_skip_commented_includes():
+    pages = report_pages()
+
+    assert pages[0] == '001_cover.j2'
+    assert pages[-1] == '018_vocabulary.j2'
+    assert '008_popular_brands_chart.j2' not in pages
+
+
+def test_split_pages_keeps_order():
+    assert split_pages(['1', '2', '3', '4', '5'], 2) == [['1', '2', '3'], ['4', '5']]
+    assert split_pages(['1', '2'], 4) == [['1'], ['2']]
+
+
+def test_page_groups_contain_every_page(report_dict):
+    single = render_report_page_groups(report_dict, groups=1)
+    groups = render_report_page_groups(report_dict, groups=3)
+
+    assert single == [render_report_html(report_dict)]
+    assert len(groups) == 3
+    assert sum(html.count('class="page') for html in groups) == single[0].count('class="page')
+
+
+def test_merge_pdf_parts_restores_bookmarks():
+    parts = [
+        (blank_pdf(2), [(1, 'Обложка', 0), (2, 'Привет', 1)]),
+        (blank_pdf(1), [(2, 'Распределение продаж', 0)]),
+        (blank_pdf(1), [(1, 'Словарь', 0)]),
+    ]
+    target = io.BytesIO()
+
+    merge_pdf_parts(parts, target, title='Отчет')
+    reader = PdfFileReader(io.BytesIO(target.getvalue()))
+    outlines = reader.getOutlines()
+
+    assert reader.getNumPages() == 4
+    assert reader.getDocumentInfo().title == 'Отчет'
+    assert [outlines[0].title, outlines[2].title] == ['Обложка', 'Словарь']
+    assert [item.title for item in outlines[1]] == ['Привет', 'Распределение продаж']
+    assert reader.getDestinationPageNumber(outlines[1][1]) == 2
+
+
+def test_render_workers_fall_back_to_one_in_daemonic_process(monkeypatch):
+    monkeypatch.setenv('REPORT_RENDER_WORKERS', '3')
+    assert report_render_workers() == 3
+
+    monkeypatch.setitem(multiprocessing.current_process()._config, 'daemon', True)
+    assert report_render_workers() == 1
+
+
+def test_parallel_render_does_not_start_pool_in_daemonic_process(monkeypatch):
+    monkeypatch.setitem(multiprocessing.current_process()._config, 'daemon', True)
+    monkeypatch.setattr('src.reports.prefetch_images', lambda urls: None)
+    monkeypatch.setattr('src.reports.render_pdf_part', lambda html: (blank_pdf(1), [(1, html, 0)]))
+    monkeypatch.setattr('src.reports.get_executor', lambda workers: pytest.fail('pool must not be started'))
+    target = io.BytesIO()
+
+    render_report_pdf_parallel(['Обложка', 'Словарь'], target, workers=2)
+
+    assert PdfFileReader(io.BytesIO(target.getvalue())).getNumPages() == 2
+
+
+def test_executor_is_shared_per_workers_count():
+    try:
+        assert get_executor(2) is get_executor(2)
+        assert get_executor(3) is not get_executor(2)
+        assert get_executor(3)._max_workers == 3
+    finally:
+        reset_executor(2)
+        reset_executor(3)
+
+
+def test_plain_report_drops_viewmodel_internals(report_dict):
+    plain = plain_report(report_dict)
+
+    assert 'stats' not in plain
+    assert 'to_dict' not in plain
+    assert not [key for key in plain if key.startswith('_')]
+    assert plain['category_name'] == report_dict['category_name']
+
+
+def test_web_html_points_assets_to_web_app(report_dict, monkeypatch):
+    monkeypatch.setenv('REPORT_ASSETS_URL', 'https://example.com/report/')
+
+    html = render_report_web_html(plain_report(report_dict))
+
+    assert '<base href="https://example.com/report/">' in html
+    assert 'css/web.css' in html
+    assert '<base href' not in render_report_html(plain_report(report_dict))
+
+
+def test_card_html_has_no_remote_images(report_dict):
+    html = render_report_html(plain_report(report_dict), template_name='_card.j2')
+
+    assert report_dict['category_name'] in html
+    assert 'src="http' not in html
+
+
+def test_neighbours_pages_shown_only_with_neighbours(scrapinghub_dataset, report_dict):
+    stats = CategoryStats(data=scrapinghub_dataset(job_id='123/1/2', result_source='wb_raw'))
+    neighbour = {
+        'category_url': 'https://www.wildberries.ru/catalog/dlya-doma/postelnye-prinadlezhnosti/pledy',
+        'category_name': 'Пледы',
+        'first_sales': None,
+        'turnover_month': 37000000,
+        'goods_count': 2120,
+        'brands_count': 43,
+        'turnover_median': 10400,
+        'monopoly_index': 1,
+    }
+    html = render_report_html(plain_report(Report(stats=stats, username='username', neighbours=[neighbour]).to_dict()))
+
+    assert 'Соседние разделы' not in render_report_html(plain_report(report_dict))
+    assert 'Соседние разделы' in html
+    assert html.count('class="highlighted"') == 1
+    assert neighbour['category_url'] in html
+    assert 'images/m3.png' not in html
+
+
+def test_neighbour_monopoly_index_images():
+    item = NeighboursItem({
+        'category_url': 'https://www.wildberries.ru/catalog/dlya-doma/postelnye-prinadlezhnosti/pledy',
+        'category_name': 'Пледы',
+        'first_sales': None,
+        'turnover_month': 37000000,
+        'goods_count': 2120,
+        'brands_count': 43,
+        'turnover_median': 10400,
+        'monopoly_index': 2,
+    })
+
+    assert item.monopoly_index_images == ['m1a', 'm1a', 'm1', 'm1', 'm1']
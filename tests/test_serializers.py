@@ -0,0 +1,44 @@
+import datetime
+
+import numpy as np
+import pytest
+from kombu.exceptions import EncodeError
+from kombu.serialization import dumps, loads
+
+from src.serializers import content_type, register_serializer
+
+
+@pytest.fixture(autouse=True)
+def serializer():
+    register_serializer('wildsearch')
+
+
+def roundtrip(value):
+    _, _, payload = dumps(value, serializer='wildsearch')
+
+    return loads(payload, content_type=content_type, content_encoding='binary', accept=[content_type])
+
+
+def test_task_payload_keeps_types():
+    payload = {
+        'args': [383716, '414324/1/926'],
+        'kwargs': {
+            'created_at': datetime.datetime(2030, 1, 15, 1, 30, 15),
+            'day': datetime.date(2030, 1, 15),
+            'photo': b'\x89PNG',
+            'count': np.int64(5),
+        },
+    }
+
+    result = roundtrip(payload)
+
+    assert result['args'] == [383716, '414324/1/926']
+    assert result['kwargs']['created_at'] == datetime.datetime(2030, 1, 15, 1, 30, 15)
+    assert result['kwargs']['day'] == datetime.date(2030, 1, 15)
+    assert result['kwargs']['photo'] == b'\x89PNG'
+    assert result['kwargs']['count'] == 5
+
+
+def test_objects_are_not_serialized():
+    with pytest.raises(EncodeError):
+        dumps({'stats': object()}, serializer='wildsearch')
@@ -0,0 +1,74 @@
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from seller_stats.category_stats import CategoryStats
+
+from benchmarks.synthetic import generate_category_items
+from src.slices import CategoryIndex, format_filters, parse_filters
+from src.tasks import category_slices_keyboard, send_category_slice
+
+
+@pytest.fixture(scope='module')
+def category_index():
+    return CategoryIndex(CategoryStats(data=generate_category_items(2000, seed=1)))
+
+
+def test_filters_roundtrip():
+    assert parse_filters('brand=12,price=1') == {'brand': 12, 'price': 1}
+    assert parse_filters('b12,p1') == {'brand': 12, 'price': 1}
+    assert format_filters({'country': 3, 'rating': 5}) == 'c3,r5'
+    assert parse_filters(format_filters({'country': 3, 'rating': 5})) == {'country': 3, 'rating': 5}
+    assert parse_filters('') == {}
+
+
+def test_slice_buttons_fit_callback_data_limit(category_index):
+    filters = {'brand': 1234, 'price': 12, 'country': 123}
+    keyboard = category_slices_keyboard('414324/12345/1234567', category_index, filters)
+
+    buttons = [button for row in keyboard.inline_keyboard for button in row]
+
+    assert len(buttons) > 0
+    assert all(len(button.callback_data.encode('utf-8')) <= 64 for button in buttons)
+
+
+def test_index_matches_dataframe_filter(category_index):
+    df = category_index.stats.df
+    brand_code, brand = category_index.options('brand', limit=1)[0]
+    country_code, country = category_index.options('country', limit=1)[0]
+
+    stats = category_index.select({'brand': brand_code, 'country': country_code, 'rating': 5})
+    expected = df[(df.brand_name == brand) & (df.manufacture_country == country) & (df.rating == 5)]
+
+    assert list(stats.df.id) == list(expected.id)
+    assert stats.category_name() == 'Синтетическая категория'
+
+
+def test_price_bands_cover_category(category_index):
+    sizes = [len(category_index.positions({'price': code})) for code, _ in category_index.options('price')]
+
+    assert sum(sizes) == int(np.count_nonzero(category_index.stats.df.price.notna()))
+    assert category_index.options('rating')[0][1] == '5'
+
+
+def test_empty_slice(category_index):
+    brand_code = category_index.options('brand')[-1][0]
+    item = category_index.stats.df.iloc[category_index.positions({'brand': brand_code})[0]]
+    other_rating = next(code for code, _ in category_index.options('rating') if code != int(item.rating))
+
+    assert len(category_index.positions({'brand': brand_code})) == 1
+    assert category_index.select({'brand': brand_code, 'rating': other_rating}) is None
+
+
+@patch('src.tasks.track_amplitude.delay')
+@patch('src.tasks.deliver_category_report')
+@patch('telegram.Bot.send_message')
+def test_slice_is_delivered_from_stored_dataset(mocked_send_message, mocked_deliver_category_report, mocked_track_amplitude, category_index, bot_user):
+    brand_code, brand = category_index.options('brand', limit=1)[0]
+
+    with patch('src.tasks.get_category_index', return_value=category_index):
+        send_category_slice('414324/1/926', bot_user.chat_id, f'brand={brand_code}')
+
+    assert f'бренд {brand}' in mocked_send_message.call_args.kwargs['text']
+    assert mocked_deliver_category_report.call_args.kwargs['job_id'] == f'414324/1/926/b{brand_code}'
+    assert all(f'b{brand_code}' in button.callback_data for row in mocked_send_message.call_args.kwargs['reply_markup'].inline_keyboard for button in row)
@@ -0,0 +1,114 @@
+from unittest.mock import MagicMock
+
+import pandas as pd
+import pytest
+
+from src.helpers import normalize_category_url
+from src.models import CategoryItemState, CategorySnapshot, CategorySnapshotDelta
+from src.snapshots import calc_category_diff, get_category_changes, prepare_category_state, record_category_snapshot
+from src.tasks import generate_category_digest_message
+
+
+@pytest.fixture()
+def category_stats():
+    def _category_stats(items, url='https://www.wildberries.ru/catalog/knigi-i-diski/'):
+        stats = MagicMock()
+        stats.category_url.return_value = url
+        stats.df = pd.DataFrame(items, columns=['id', 'price', 'purchases', 'turnover'])
+
+        return stats
+
+    return _category_stats
+
+
+def test_calc_category_diff():
+    previous = prepare_category_state(pd.DataFrame([
+        {'id': 1, 'price': 100, 'purchases': 10, 'turnover': 1000},
+        {'id': 2, 'price': 200, 'purchases': 5, 'turnover': 1000},
+        {'id': 3, 'price': 300, 'purchases': 1, 'turnover': 300},
+    ]))
+    current = prepare_category_state(pd.DataFrame([
+        {'id': 1, 'price': 100, 'purchases': 10, 'turnover': 1000},
+        {'id': 2, 'price': 200, 'purchases': 7, 'turnover': 1400},
+        {'id': 4, 'price': 50, 'purchases': 2, 'turnover': 100},
+    ]))
+
+    diff = calc_category_diff(previous, current).set_index('item_id')
+
+    assert len(diff.index) == 3
+    assert diff.loc['2', 'change'] == 'changed'
+    assert diff.loc['2', 'purchases_delta'] == 2
+    assert diff.loc['3', 'change'] == 'removed'
+    assert diff.loc['3', 'turnover_delta'] == -300
+    assert diff.loc['4', 'change'] == 'added'
+    assert diff.loc['4', 'price'] == 50
+
+
+@pytest.mark.parametrize('url, expected', [
+    ['https://www.wildberries.ru/catalog/knigi-i-diski/', 'https://www.wildberries.ru/catalog/knigi-i-diski'],
+    ['http://WWW.wildberries.ru/catalog/knigi-i-diski#top', 'https://www.wildberries.ru/catalog/knigi-i-diski'],
+    ['www.wildberries.ru/search?text=одеяло', 'https://www.wildberries.ru/search?text=одеяло'],
+])
+def test_normalize_category_url(url, expected):
+    assert normalize_category_url(url) == expected
+
+
+def test_record_first_category_snapshot(category_stats):
+    snapshot = record_category_snapshot(category_stats([
+        [1, 100, 10, 1000],
+        [2, 200, 5, 1000],
+    ]), job_id='123/1/1')
+
+    assert snapshot.items_count == 2
+    assert snapshot.added_count == 2
+    assert snapshot.turnover == 2000
+    assert CategoryItemState.select().count() == 2
+    assert CategorySnapshotDelta.select().count() == 0
+
+
+def test_record_category_snapshot_stores_only_changes(category_stats):
+    record_category_snapshot(category_stats([
+        [1, 100, 10, 1000],
+        [2, 200, 5, 1000],
+        [3, 300, 1, 300],
+    ]))
+
+    snapshot = record_category_snapshot(category_stats([
+        [1, 100, 10, 1000],
+        [2, 200, 7, 1400],
+        [4, 50, 2, 100],
+    ], url='https://www.wildberries.ru/catalog/knigi-i-diski'))
+
+    assert CategorySnapshot.select().count() == 2
+    assert CategorySnapshotDelta.select().where(CategorySnapshotDelta.snapshot == snapshot).count() == 3
+    assert snapshot.added_count == 1
+    assert snapshot.removed_count == 1
+    assert snapshot.changed_count == 1
+    assert snapshot.items_count == 3
+    assert snapshot.turnover == 2500
+    assert snapshot.turnover_delta == 200
+    assert sorted(state.item_id for state in CategoryItemState.select()) == ['1', '2', '4']
+    assert CategoryItemState.get(CategoryItemState.item_id == '2').purchases == 7
+
+
+def test_get_category_changes(category_stats):
+    record_category_snapshot(category_stats([[1, 100, 10, 1000], [2, 200, 5, 1000]]))
+    snapshot = record_category_snapshot(category_stats([[1, 100, 20, 2000], [2, 200, 6, 1200]]))
+
+    changes = get_category_changes(snapshot, change='changed', limit=1)
+
+    assert len(changes.index) == 1
+    assert changes.loc[0, 'item_id'] == '1'
+
+
+def test_digest_message_lists_growth_leaders(category_stats):
+    record_category_snapshot(category_stats([[1, 100, 10, 1000], [2, 200, 5, 1000], [3, 300, 1, 300]]))
+    stats = category_stats([[1, 100, 20, 2000], [2, 200, 4, 800], [3, 300, 2, 600]])
+    stats.df['name'] = ['Книга_1', 'Книга 2', 'Книга 3']
+    stats.category_name.return_value = 'Книги'
+
+    message = generate_category_digest_message(stats, record_category_snapshot(stats))
+
+    assert 'Больше всего выросла выручка' in message
+    assert message.index('Книга\\_1') < message.index('Книга 3')
+    assert 'Книга 2' not in message
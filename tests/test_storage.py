@@ -0,0 +1,127 @@
+import io
+from unittest.mock import patch
+
+import pytest
+from botocore.response import StreamingBody
+from click.testing import CliRunner
+from envparse import env
+from seller_stats.category_stats import CategoryStats
+
+from src import serializers
+from src.commands.expire_reports import main as expire_reports
+from src.storage import (job_key, load_category_stats, load_report_context, save_category_stats, save_report_context,
+                         set_reports_expiration)
+from src.tasks import send_category_report
+
+
+@pytest.fixture()
+def report_context():
+    return {'report': {'category_name': 'Точилки'}, 'name': 'Точилки на Wildberries'}
+
+
+def streaming_body(content):
+    return StreamingBody(io.BytesIO(content), len(content))
+
+
+def test_job_key_is_flat():
+    assert job_key('414324/1/926', 'report.msgpack') == 'reports/414324-1-926/report.msgpack'
+
+
+def test_report_context_saved(s3_stub, report_context):
+    s3_stub.add_response('put_object', {}, {
+        'Bucket': env('AWS_S3_BUCKET_NAME'),
+        'Key': 'reports/414324-1-926/report.msgpack',
+        'Body': serializers.dumps(report_context),
+        'ContentType': serializers.content_type,
+    })
+
+    assert save_report_context('414324/1/926', report_context) is True
+
+
+def test_report_context_not_saved_on_storage_error(s3_stub, report_context):
+    s3_stub.add_client_error('put_object', service_error_code='AccessDenied')
+
+    assert save_report_context('414324/1/926', report_context) is False
+
+
+def test_report_context_loaded(s3_stub, report_context):
+    s3_stub.add_response('get_object', {'Body': streaming_body(serializers.dumps(report_context))}, {
+        'Bucket': env('AWS_S3_BUCKET_NAME'),
+        'Key': 'reports/414324-1-926/report.msgpack',
+    })
+
+    assert load_report_context('414324/1/926') == report_context
+
+
+def test_category_dataset_restored(scrapinghub_dataset):
+    data = scrapinghub_dataset(job_id='123/1/2', result_source='wb_raw')
+    stored = {}
+
+    with patch('src.storage.put_object', side_effect=lambda key, body, content_type: stored.update({key: body})):
+        assert save_category_stats('414324/1/926', data) is True
+
+    with patch('src.storage.get_object', side_effect=lambda key: stored[key]):
+        stats = load_category_stats('414324/1/926')
+
+    assert list(stored.keys()) == ['reports/414324-1-926/dataset.msgpack.gz']
+    assert stats.df.equals(CategoryStats(data=data).df)
+
+
+def test_reports_expiration_keeps_other_rules(s3_stub):
+    other_rule = {'ID': 'logs', 'Filter': {'Prefix': 'logs/'}, 'Status': 'Enabled', 'Expiration': {'Days': 30}}
+
+    s3_stub.add_response('get_bucket_lifecycle_configuration', {'Rules': [other_rule]}, {'Bucket': env('AWS_S3_BUCKET_NAME')})
+    s3_stub.add_response('put_bucket_lifecycle_configuration', {}, {
+        'Bucket': env('AWS_S3_BUCKET_NAME'),
+        'LifecycleConfiguration': {'Rules': [
+            other_rule,
+            {'ID': 'reports-expiration', 'Filter': {'Prefix': 'reports/'}, 'Status': 'Enabled', 'Expiration': {'Days': 14}},
+        ]},
+    })
+
+    set_reports_expiration(14)
+
+    s3_stub.assert_no_pending_responses()
+
+
+def test_reports_expiration_on_bucket_without_rules(s3_stub):
+    s3_stub.add_client_error('get_bucket_lifecycle_configuration', service_error_code='NoSuchLifecycleConfiguration')
+    s3_stub.add_response('put_bucket_lifecycle_configuration', {}, {
+        'Bucket': env('AWS_S3_BUCKET_NAME'),
+        'LifecycleConfiguration': {'Rules': [
+            {'ID': 'reports-expiration', 'Filter': {'Prefix': 'reports/'}, 'Status': 'Enabled', 'Expiration': {'Days': 7}},
+        ]},
+    })
+
+    set_reports_expiration(7)
+
+    s3_stub.assert_no_pending_responses()
+
+
+def test_reports_expiration_is_not_rewritten_when_unchanged(s3_stub):
+    rule = {'ID': 'reports-expiration', 'Filter': {'Prefix': 'reports/'}, 'Status': 'Enabled', 'Expiration': {'Days': 14}}
+    s3_stub.add_response('get_bucket_lifecycle_configuration', {'Rules': [rule]}, {'Bucket': env('AWS_S3_BUCKET_NAME')})
+
+    assert set_reports_expiration(14) is False
+    s3_stub.assert_no_pending_responses()
+
+
+def test_expire_reports_command_does_not_fail_without_access(s3_stub):
+    s3_stub.add_client_error('get_bucket_lifecycle_configuration', service_error_code='AccessDenied')
+
+    result = CliRunner().invoke(expire_reports, ['--days', '14'])
+
+    assert result.exit_code == 0
+    assert 'Reports expiration was not set' in result.output
+
+
+@patch('src.tasks.deliver_category_report')
+@patch('src.tasks.track_amplitude.delay')
+@patch('telegram.Bot.send_message')
+def test_expired_report_is_reported_to_user(mocked_send_message, mocked_track_amplitude, mocked_deliver_category_report, s3_stub):
+    s3_stub.add_client_error('get_object', service_error_code='NoSuchKey')
+
+    send_category_report('414324/1/926', [383716], 'html')
+
+    mocked_deliver_category_report.assert_not_called()
+    assert 'Отчет больше недоступен' in mocked_send_message.call_args.kwargs['text']
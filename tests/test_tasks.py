@@ -1,6 +1,8 @@
 from unittest.mock import patch
 
-from src.tasks import track_amplitude
+import pytest
+
+from src.tasks import celery, track_amplitude
 
 
 @patch('src.helpers.AmplitudeLogger.log')
@@ -11,3 +13,22 @@ def test_track_amplitude(mocked_log, bot_user, set_amplitude):
     assert 'sample_event' in mocked_log.call_args.kwargs['event']
     assert {'prop1': 'val1'} == mocked_log.call_args.kwargs['event_properties']
     assert 12345 == mocked_log.call_args.kwargs['timestamp']
+
+
+@pytest.mark.parametrize('task_name, expected_queue', [
+    ['src.tasks.send_category_requests_count_message', 'interactive'],
+    ['src.tasks.schedule_category_export', 'interactive'],
+    ['src.tasks.track_amplitude', 'analytics'],
+    ['src.tasks.sync_users_to_crm', 'analytics'],
+    ['src.tasks.calculate_category_stats', 'heavy'],
+    ['src.tasks.send_category_report', 'heavy'],
+    ['src.tasks.send_category_card', 'heavy'],
+])
+def test_tasks_routed_to_their_queues(task_name, expected_queue):
+    assert celery.amqp.router.route({}, task_name)['queue'].name == expected_queue
+
+
+def test_waited_report_goes_before_digest():
+    router = celery.amqp.router
+
+    assert router.route({}, 'src.tasks.send_category_report')['priority'] < router.route({}, 'src.tasks.calculate_category_digest')['priority']
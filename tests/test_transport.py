@@ -0,0 +1,28 @@
+from src.transport import TimeoutSession, get_bot, get_session
+
+
+def test_get_session_is_shared_per_host():
+    session = get_session('https://api.amplitude.com/2/httpapi')
+
+    assert isinstance(session, TimeoutSession)
+    assert session is get_session('https://api.amplitude.com/other')
+    assert session is not get_session('https://api.airtable.com/v0/')
+
+
+def test_session_sets_default_timeout(requests_mocker):
+    requests_mocker.get('https://example.com/', text='ok')
+
+    get_session('https://example.com/').get('https://example.com/')
+
+    assert requests_mocker.request_history[0].timeout == 10.0
+
+
+def test_get_bot_is_shared():
+    assert get_bot() is get_bot()
+    assert get_bot().request.con_pool_size == 8
+
+
+def test_get_bot_uses_custom_api_url(monkeypatch):
+    monkeypatch.setenv('TELEGRAM_API_BASE_URL', 'http://127.0.0.1:8090/telegram/bot')
+
+    assert get_bot('456:AnOtHeRtOkEn').base_url == 'http://127.0.0.1:8090/telegram/bot456:AnOtHeRtOkEn'
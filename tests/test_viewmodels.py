@@ -1,6 +1,12 @@
+import numpy as np
+import pandas as pd
 import pytest
 from seller_stats.category_stats import CategoryStats
 
+from src.viewmodels.distributions import calc_distributions, sales_thresholds
+from src.viewmodels.helpers import date_labels, parse_dates
+from src.viewmodels.months import months_short
+from src.viewmodels.popular_brands import calc_brands
 from src.viewmodels.report import Report
 
 
@@ -21,3 +27,62 @@ def test_corrupted_chart_handling(report_vm_from_source_file):
     report_vm.to_dict()
 
     assert True  # assert there is no exception
+
+
+def test_distributions_match_pandas_binning():
+    df = pd.DataFrame({
+        'rating': [5, 5, 4, 0, np.nan, 3.5],
+        'purchases': [0, 1, 9, 10, 1500, np.nan],
+        'price': [10, 20, 30, 40, 50, 60],
+        'sku': [1, 1, 1, 1, 1, 1],
+        'turnover_month': [0, 20, np.nan, 400, 75000, 0],
+        'purchases_month': [0, 1, 9, 10, 1500, 0],
+    })
+
+    distributions = calc_distributions(df)
+    sales = df.loc[:, ['purchases', 'sku']].groupby(pd.cut(df.purchases, sales_thresholds, include_lowest=True, right=False)).sum()
+
+    assert distributions['rating_ratios'][5] == 2 / 6
+    assert distributions['rating_ratios'][0] == 1 / 6
+    assert distributions['average_rating'] == pytest.approx((5 + 5 + 4 + 3.5) / 4)
+    assert distributions['trash_share'] == 1 / 6
+    assert list(distributions['sales'].sku) == list(sales.sku)
+    assert list(distributions['sales'].purchases) == list(sales.purchases)
+    assert distributions['prices'].turnover_month.sum() == 75420
+
+
+def test_brands_table_aggregates_in_one_pass():
+    df = pd.DataFrame({
+        'brand_name': ['A', 'B', 'A', 'C'],
+        'sku': [1, 1, 1, 1],
+        'turnover_month': [100, 300, 50, np.nan],
+        'first_review': ['2020-05-02T22:09:06.4948965+03:00', None, '2013-04-12T18:14:15.0000000+04:00', None],
+        'rating': [5, 0, 4, 0],
+        'brand_url': [None, '/b', '/a', '/c'],
+        'brand_logo': ['a.jpg', 'b.jpg', 'a2.jpg', 'c.jpg'],
+    })
+
+    brands = calc_brands(df)
+
+    assert len(brands.index) == 3
+    assert list(brands.nlargest(2, 'turnover_month').index) == ['B', 'A']
+    assert brands.loc['A', 'sku'] == 2
+    assert brands.loc['A', 'rating'] == 4.5
+    assert np.isnan(brands.loc['B', 'rating'])
+    assert brands.loc['A', 'first_review'] == pd.Timestamp('2013-04-12 18:14:15')
+    assert brands.loc['A', 'brand_url'] == '/a'
+
+
+def test_review_dates_parsed_once_and_ordered_by_time(report_vm_from_source_file):
+    report_vm = report_vm_from_source_file(job_id='123/1/2', result_source='wb_raw')
+    df = report_vm.stats.df
+
+    assert pd.api.types.is_datetime64_any_dtype(df.first_review)
+    assert report_vm.base_first_sales == 'нач. 2013'
+    assert report_vm.goods_overview['old']['first_review_date'] == 'апр. 2013'
+
+
+def test_date_labels_mark_missing_dates():
+    dates = parse_dates(pd.Series(['2020-05-02T22:09:06.4948965+03:00', None, '2019-12-31T23:59:59+04:00', 'garbage']))
+
+    assert list(date_labels(dates, months_short())) == ['май. 2020', '–', 'дек. 2019', '–']
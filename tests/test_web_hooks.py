@@ -41,6 +41,23 @@ def test_category_export_finished_hook_correct(mocked_send_message, mocked_calcu
     assert 'ok' in got.text
 
 
+@patch('src.tasks.calculate_category_stats.apply_async')
+@patch('telegram.Bot.send_message')
+def test_category_export_finished_hook_notifies_job_recipients(mocked_send_message, mocked_calculate_category_stats, web_app, bot_user):
+    from src.models import CategoryJob, User
+
+    job = CategoryJob.create(job_id='123/1/1234', category_url='https://www.wildberries.ru/catalog/knigi-i-diski')
+    job.add_recipient(bot_user)
+    job.add_recipient(User.create(chat_id=100500, user_name='another_user'))
+
+    got = web_app.simulate_post('/callback/wb_category_export', params={'job_id': '123/1/1234'})
+
+    assert got.status_code == 200
+    assert mocked_send_message.call_count == 2
+    assert mocked_calculate_category_stats.call_args.args[1]['chat_id'] is None
+    assert CategoryJob.get_by_id(job.id).state == 'finished'
+
+
 @patch('telegram.ext.Dispatcher.process_update')
 @patch('telegram.Update.de_json')
 def test_telegram_webhook(mocked_de_json, mocked_process_update, web_app):
@@ -71,3 +88,18 @@ def test_setting_webhooks(mocked_set_webhook, mocked_delete_webhook):
 
     mocked_delete_webhook.assert_called()
     mocked_set_webhook.assert_called()
+
+
+@patch('src.tasks.calculate_category_digest.apply_async')
+def test_category_digest_finished_hook_correct(mocked_calculate_category_digest, web_app):
+    got = web_app.simulate_post('/callback/wb_category_digest', params={'job_id': '414324/1/926'})
+
+    mocked_calculate_category_digest.assert_called_once()
+    assert got.status_code == 200
+
+
+def test_category_digest_finished_hook_missing_job_id(web_app):
+    got = web_app.simulate_post('/callback/wb_category_digest')
+
+    assert got.status_code == 500
+    assert 'wrong_job_id' in got.text